@@ -1,33 +1,386 @@
-from turtle import mode
-import uuid
-from agentscope.agent import ReActAgent
+import asyncio
+import os
+import threading
+import time
+import weakref
+from dataclasses import dataclass, asdict
+from typing import Any, AsyncGenerator, Callable, Optional, Type
+
+from agentscope.agent import AgentBase, ReActAgent, UserAgent, UserInputBase
 from agentscope.formatter import DashScopeMultiAgentFormatter
-from agentscope.model import DashScopeChatModel
+from agentscope.model import ChatModelBase, ChatResponse, DashScopeChatModel
 from agentscope.message import Msg
-from typing import Type
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
+
+from store.replies import ReplyCache, reply_key
+
+# 全局模型调用限制：同时在途的请求数与每秒发起的请求数，默认 0 表示不限，
+# 需要时通过环境变量或 model_registry.configure() 开启
+MODEL_MAX_CONCURRENCY = int(os.getenv("MODEL_MAX_CONCURRENCY", "0"))
+MODEL_QPS = float(os.getenv("MODEL_QPS", "0"))
+
+
+class CallLimiter:
+    """
+    全局并发 / QPS 限制，均为 0 时不做任何限制。QPS 按时间槽排队，跨线程共享；
+    并发信号量按事件循环各建一个（asyncio 原语不能跨循环使用）。
+    """
+
+    def __init__(self, max_concurrency: int = MODEL_MAX_CONCURRENCY, qps: float = MODEL_QPS):
+        self.max_concurrency = max(0, max_concurrency)
+        self.interval = 1.0 / qps if qps > 0 else 0.0
+        self._next = 0.0
+        self._lock = threading.Lock()
+        self._semaphores: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = \
+            weakref.WeakKeyDictionary()
+
+    def _semaphore(self) -> asyncio.Semaphore | None:
+        if not self.max_concurrency:
+            return None
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            semaphore = self._semaphores.get(loop)
+            if semaphore is None:
+                semaphore = self._semaphores[loop] = asyncio.Semaphore(self.max_concurrency)
+            return semaphore
+
+    async def acquire(self) -> None:
+        """占用一个并发名额并等到 QPS 时间槽；等待期间被取消时归还名额，不会泄漏。"""
+        semaphore = self._semaphore()
+        if semaphore is not None:
+            await semaphore.acquire()
+        try:
+            if self.interval:
+                with self._lock:
+                    now = time.monotonic()
+                    slot = max(now, self._next)
+                    self._next = slot + self.interval
+                if slot > now:
+                    await asyncio.sleep(slot - now)
+        except BaseException:
+            if semaphore is not None:
+                semaphore.release()
+            raise
+
+    def release(self) -> None:
+        semaphore = self._semaphore()
+        if semaphore is not None:
+            semaphore.release()
+
+
+@dataclass
+class ModelStats:
+    """单个 (model, api_key) 的调用统计。"""
+    calls: int = 0
+    errors: int = 0
+    input_tokens: int = 0
+    output_tokens: int = 0
+    # 请求耗时（秒，不含排队），wait_total 为排队等待限流的总时间
+    latency_total: float = 0.0
+    latency_max: float = 0.0
+    wait_total: float = 0.0
+
+    @property
+    def latency_avg(self) -> float:
+        return self.latency_total / self.calls if self.calls else 0.0
+
+    def to_dict(self) -> dict:
+        return {**asdict(self), "latency_avg": self.latency_avg}
+
+
+class ModelPool:
+    """同一 (model, api_key) 共享的客户端与统计；流式与非流式各一个底层客户端。"""
+
+    def __init__(self, model_name: str, api_key: str, limiter: CallLimiter):
+        self.model_name = model_name
+        self.api_key = api_key
+        self.limiter = limiter
+        self.stats = ModelStats()
+        self._clients: dict[bool, DashScopeChatModel] = {}
+        self._lock = threading.Lock()
+
+    def client(self, stream: bool) -> DashScopeChatModel:
+        with self._lock:
+            client = self._clients.get(stream)
+            if client is None:
+                client = self._clients[stream] = DashScopeChatModel(
+                    model_name=self.model_name, api_key=self.api_key, stream=stream)
+            return client
+
+    def record(self, latency: float, wait: float, response: ChatResponse | None) -> None:
+        usage = response.usage if response is not None else None
+        with self._lock:
+            self.stats.calls += 1
+            self.stats.latency_total += latency
+            self.stats.latency_max = max(self.stats.latency_max, latency)
+            self.stats.wait_total += wait
+            if usage is not None:
+                self.stats.input_tokens += usage.input_tokens
+                self.stats.output_tokens += usage.output_tokens
+
+    def record_error(self) -> None:
+        with self._lock:
+            self.stats.errors += 1
+
+
+class PooledChatModel(ChatModelBase):
+    """
+    每个智能体一个的轻量模型句柄：stream 可由智能体临时修改而不影响他人，
+    实际请求走共享的 ModelPool 客户端，并受全局限流约束。
+    """
+
+    def __init__(self, pool: ModelPool, stream: bool = False):
+        super().__init__(pool.model_name, stream)
+        self.pool = pool
+
+    async def __call__(self, *args: Any, **kwargs: Any) -> ChatResponse | AsyncGenerator[ChatResponse, None]:
+        if self.stream:
+            # 流式请求在首次迭代时才占用名额并发起，拿到生成器却不迭代不会占住名额
+            return self._stream(args, kwargs)
+        limiter = self.pool.limiter
+        queued = time.monotonic()
+        # acquire 自身在被取消时归还名额；拿到名额后的任何异常（含取消）都在这里归还
+        await limiter.acquire()
+        try:
+            started = time.monotonic()
+            response = await self.pool.client(False)(*args, **kwargs)
+        except BaseException:
+            self.pool.record_error()
+            raise
+        finally:
+            limiter.release()
+        self.pool.record(time.monotonic() - started, started - queued, response)
+        return response
+
+    async def _stream(self, args: tuple, kwargs: dict) -> AsyncGenerator[ChatResponse, None]:
+        # 流式响应读完才算一次调用结束，期间一直占用并发名额
+        limiter = self.pool.limiter
+        queued = time.monotonic()
+        await limiter.acquire()
+        last = None
+        try:
+            started = time.monotonic()
+            response = await self.pool.client(True)(*args, **kwargs)
+            async for chunk in response:
+                last = chunk
+                yield chunk
+        except GeneratorExit:
+            # 调用方提前 aclose() 是正常结束，不计为失败
+            raise
+        except BaseException:
+            self.pool.record_error()
+            raise
+        else:
+            self.pool.record(time.monotonic() - started, started - queued, last)
+        finally:
+            limiter.release()
+
+
+class ModelRegistry:
+    """按 (model, api_key) 复用模型客户端，所有模型共享一个全局限流器。"""
+
+    def __init__(self, max_concurrency: int = MODEL_MAX_CONCURRENCY, qps: float = MODEL_QPS):
+        self.limiter = CallLimiter(max_concurrency, qps)
+        self.formatter = DashScopeMultiAgentFormatter()
+        self._pools: dict[tuple[str, str], ModelPool] = {}
+        self._lock = threading.Lock()
+
+    def configure(self, max_concurrency: int | None = None, qps: float | None = None) -> None:
+        """调整全局限制，需在发起调用之前设置。"""
+        self.limiter = CallLimiter(
+            self.limiter.max_concurrency if max_concurrency is None else max_concurrency,
+            (1.0 / self.limiter.interval if self.limiter.interval else 0.0) if qps is None else qps,
+        )
+        with self._lock:
+            for pool in self._pools.values():
+                pool.limiter = self.limiter
+
+    def pool(self, model_name: str, api_key: str) -> ModelPool:
+        with self._lock:
+            pool = self._pools.get((model_name, api_key))
+            if pool is None:
+                pool = self._pools[(model_name, api_key)] = ModelPool(model_name, api_key, self.limiter)
+            return pool
+
+    def model(self, config: dict, stream: bool = False) -> PooledChatModel:
+        """按配置 {model, api_key} 返回模型句柄。"""
+        return PooledChatModel(self.pool(config["model"], config["api_key"]), stream)
+
+    def stats(self) -> dict[str, dict]:
+        """{模型名: 统计}，同一模型多个 api_key 时合并。"""
+        result: dict[str, ModelStats] = {}
+        with self._lock:
+            pools = list(self._pools.values())
+        for pool in pools:
+            total = result.setdefault(pool.model_name, ModelStats())
+            for key, value in asdict(pool.stats).items():
+                setattr(total, key, max(getattr(total, key), value) if key == "latency_max"
+                        else getattr(total, key) + value)
+        return {name: stats.to_dict() for name, stats in result.items()}
+
+
+model_registry = ModelRegistry()
+
+
+class PropUse(BaseModel):
+    name: str = Field(description="使用的道具名称，必须是自己持有的道具；使用不会把道具交给别人")
+    target: Optional[str] = Field(None, description="道具作用的玩家名字（作用对象），没有对象时留空")
+    count: int = Field(1, ge=1, description="使用数量")
+
+
+class PropGive(BaseModel):
+    name: str = Field(description="交出的道具名称，必须是自己持有的道具")
+    to: str = Field(description="接收道具的玩家名字")
+    count: int = Field(1, ge=1, description="交出数量")
+
+
+class MoneyTransfer(BaseModel):
+    to: str = Field(description="收款玩家的名字")
+    amount: int = Field(ge=1, description="转账金额")
+
+
+class PlayerAction(BaseModel):
+    """玩家一轮的结构化回复：发言与本轮动作一次给出，引擎校验后写入记忆。"""
+    speech: str = Field(description="本轮对其他玩家说的话")
+    vote: Optional[str] = Field(None, description="主持人要求做选择时填写选项编号，否则留空")
+    props: list[PropUse] = Field(default_factory=list, description="本轮使用的道具，没有则为空")
+    gives: list[PropGive] = Field(default_factory=list, description="本轮交给其他玩家的道具，没有则为空")
+    transfers: list[MoneyTransfer] = Field(default_factory=list, description="本轮给其他玩家的转账，没有则为空")
+
+
+class PropGrant(BaseModel):
+    name: str = Field(description="发放的道具名称，必须是剧本道具表中的道具")
+    count: int = Field(1, ge=1, description="发放数量")
+
+
+class Grant(BaseModel):
+    to: str = Field(description="发放对象玩家的名字")
+    money: int = Field(0, description="发放金额（元，30 万填 300000），负数表示扣款，没有则为 0")
+    props: list[PropGrant] = Field(default_factory=list, description="发放的道具，没有则为空")
+
+
+class ModeratorAction(BaseModel):
+    """主持人处理一个步骤的结构化回复：旁白与本步骤提示要求的发放、星级变化，由引擎结算。"""
+    speech: str = Field(description="对玩家说的话")
+    grants: list[Grant] = Field(default_factory=list, description="本步骤提示要求给玩家发放的资金与道具，没有则为空")
+    stars: int = Field(0, description="本步骤按星级规则判定的星级变化，升星为正，消星为负，没有变化为 0")
+
+
+def _partial_speech(chunk: ChatResponse) -> str:
+    """流式结构化输出中，已生成部分的 speech 字段（工具参数为逐步修复的 JSON）。"""
+    for block in chunk.content:
+        if block.get("type") == "tool_use" and isinstance(block.get("input"), dict):
+            speech = block["input"].get("speech")
+            if isinstance(speech, str):
+                return speech
+    return ""
+
+
+# (智能体, 截至目前的消息, 是否为最后一块)，同一条回复的各块共用同一个 msg.id
+StreamListener = Callable[[AgentBase, Msg, bool], None]
+
+
+class _ListenerOutput:
+    # 设置后流式输出与完整回复交给它展示，不再由 agentscope 打印到标准输出
+    stream_listener: Optional[StreamListener] = None
+
+    async def print(self, msg: Msg, last: bool = True, speech: Any = None) -> None:
+        if self.stream_listener is None:
+            return await super().print(msg, last, speech)
+        self.stream_listener(self, msg, last)
+
+
+class PlayerAgent(_ListenerOutput, ReActAgent):
+    # 录制 / 回放缓存，所有智能体共用；为 None 或 off 模式时直接调用模型
+    reply_cache: Optional[ReplyCache] = None
+
+    async def reply(self, msg: Msg | list[Msg] | None = None, structured_model: Type[BaseModel] | None = None) -> Msg:
+        cache = self.reply_cache
+        if cache is None or not cache.enabled:
+            return await self._reply(msg, structured_model)
+        incoming = msg if isinstance(msg, list) else [msg] if msg is not None else []
+        history = await self.memory.get_memory()
+        key = reply_key(self.name, self.model.model_name, self.sys_prompt, [*history, *incoming],
+                        structured_model.__name__ if structured_model else None)
+        cached = cache.lookup(key)
+        if cached is not None:
+            # 回放：恢复录制时本次回复写入记忆的全部消息（含 ReAct 的中间推理与工具调用），
+            # 后续 key 才能与录制时一致；旧格式的缓存只有回复本身
+            reply_msg = Msg.from_dict(cached["reply"] if "reply" in cached else cached)
+            for item in cached["memory"] if "memory" in cached else [msg, reply_msg]:
+                await self.memory.add(Msg.from_dict(item) if isinstance(item, dict) else item)
+            await self.print(reply_msg, True)
+            return reply_msg
+        reply_msg = await self._reply(msg, structured_model)
+        delta = (await self.memory.get_memory())[len(history):]
+        cache.store(key, {"reply": reply_msg.to_dict(), "memory": [m.to_dict() for m in delta]})
+        return reply_msg
+
+    async def _reply(self, msg: Msg | list[Msg] | None, structured_model: Type[BaseModel] | None) -> Msg:
+        if structured_model is None:
+            return await super().reply(msg, structured_model)
+        # 结构化回合只调用一次模型：直接强制输出 structured_model，
+        # 不走 ReAct 的工具循环，也不再额外请求一段文本回复
+        await self.memory.add(msg)
+        prompt = await self.formatter.format(
+            msgs=[Msg("system", self.sys_prompt, "system"), *await self.memory.get_memory()])
+        res = await self.model(prompt, structured_model=structured_model)
+        reply_msg = Msg(self.name, "", "assistant")
+        if not isinstance(res, ChatResponse):
+            # 流式：speech 字段一边生成一边输出
+            async for chunk in res:
+                res = chunk
+                speech = _partial_speech(chunk)
+                if speech and speech != reply_msg.content:
+                    reply_msg.content = speech
+                    await self.print(reply_msg, False)
+        output = res.metadata or {}
+        reply_msg.content = output.get("speech") or " ".join(
+            block.get("text", "") for block in res.content if block.get("type") == "text")
+        reply_msg.metadata = output
+        await self.print(reply_msg, True)
+        await self.memory.add(reply_msg)
+        return reply_msg
+
+
+class HumanAgent(_ListenerOutput, UserAgent):
+    """
+    由真人操控的玩家：回复来自 input_method（如网页提交），轮到其发言时先调用 on_turn(agent, msg)
+    通知前端。结构化回合时 input_method 给出的 structured_input 即 PlayerAction。
+    """
+    on_turn: Optional[Callable[["HumanAgent", Msg | list[Msg] | None], None]] = None
+
+    def __init__(self, name: str, input_method: UserInputBase):
+        super().__init__(name)
+        self.override_instance_input_method(input_method)
 
-class PlayerAgent(ReActAgent):
     async def reply(self, msg: Msg | list[Msg] | None = None, structured_model: Type[BaseModel] | None = None) -> Msg:
+        if self.on_turn is not None:
+            self.on_turn(self, msg)
         return await super().reply(msg, structured_model)
 
+    async def handle_interrupt(self, *args: Any, **kwargs: Any) -> Msg:
+        """对局停止时 interrupt() 会取消等待中的输入，返回空发言（UserAgent 未实现该方法）。"""
+        return Msg(self.name, "", "assistant")
+
+
 class Character:
     id: str
     name: str
     system_prompt: str
-    agent: PlayerAgent
-    def __init__(self, config: dict, id: str, name: str, system_prompt: str):
+    # 角色背景；启用上下文窗口时不写进 system_prompt，由窗口按预算附上
+    background: str
+    agent: PlayerAgent | HumanAgent
+    def __init__(self, config: dict, id: str, name: str, system_prompt: str, agent: HumanAgent | None = None,
+                 background: str = ""):
         self.id = id
         self.name = name
         self.system_prompt = system_prompt
-        self.agent = PlayerAgent(
-            name=name, 
-            sys_prompt=system_prompt, formatter=DashScopeMultiAgentFormatter(),
-            model=DashScopeChatModel(
-                model_name=config["model"],
-                api_key=config["api_key"],
-                stream=False
-            ))
+        self.background = background
+        self.agent = agent or PlayerAgent(
+            name=name,
+            sys_prompt=system_prompt, formatter=model_registry.formatter,
+            model=model_registry.model(config, stream=config.get("stream", True)))
 
 class Scene:
     id: str
@@ -36,4 +389,4 @@ class Scene:
     def __init__(self, id: str, name: str, system_prompt: str):
         self.id = id
         self.name = name
-        self.system_prompt = system_prompt
\ No newline at end of file
+        self.system_prompt = system_prompt
@@ -0,0 +1,120 @@
+"""
+对局事件总线：智能体的流式 token、完整发言等事件按频道（一局游戏一个频道）发布，
+控制台与网站的 SSE 订阅者各自消费。发布方在游戏的事件循环里，订阅方可以是 Flask 的请求线程。
+"""
+
+import itertools
+import json
+import queue
+import threading
+import time
+from collections import deque
+from typing import Optional
+
+# 每个频道保留最近的事件数，供新订阅者或断线重连（Last-Event-ID）补发
+HISTORY_SIZE = 1000
+# 每个订阅者的队列上限，消费过慢时丢弃最旧的事件
+SUBSCRIBER_QUEUE_SIZE = 2000
+
+
+def live_channel(story_id: str, session_id: str = "") -> str:
+    """一局游戏的频道名。"""
+    return f"{story_id}.{session_id or 'default'}"
+
+
+class Subscription:
+    """单个订阅者：线程安全的有界队列。"""
+
+    def __init__(self, bus: "EventBus", channel: str, maxsize: int = SUBSCRIBER_QUEUE_SIZE):
+        self.bus = bus
+        self.channel = channel
+        self.queue: queue.Queue[dict] = queue.Queue(maxsize)
+        self.dropped = 0
+
+    def put(self, event: dict) -> None:
+        while True:
+            try:
+                self.queue.put_nowait(event)
+                return
+            except queue.Full:
+                try:
+                    self.queue.get_nowait()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+
+    def get(self, timeout: Optional[float] = None) -> Optional[dict]:
+        """取下一个事件，超时返回 None。"""
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self) -> None:
+        self.bus.unsubscribe(self)
+
+    def __enter__(self) -> "Subscription":
+        return self
+
+    def __exit__(self, *args: object) -> None:
+        self.close()
+
+
+class EventBus:
+    """按频道发布 / 订阅事件，事件带全局递增 id。线程安全。"""
+
+    def __init__(self, history: int = HISTORY_SIZE):
+        self.history_size = history
+        self._ids = itertools.count(1)
+        self._history: dict[str, deque[dict]] = {}
+        self._subscribers: dict[str, set[Subscription]] = {}
+        self._lock = threading.Lock()
+
+    def publish(self, channel: str, type: str, **data) -> dict:
+        with self._lock:
+            event = {"id": next(self._ids), "channel": channel, "type": type, "time": time.time(), **data}
+            history = self._history.get(channel)
+            if history is None:
+                history = self._history[channel] = deque(maxlen=self.history_size)
+            history.append(event)
+            subscribers = list(self._subscribers.get(channel, ()))
+        for subscription in subscribers:
+            subscription.put(event)
+        return event
+
+    def subscribe(self, channel: str, last_id: int = 0, *, replay: bool = True) -> Subscription:
+        """订阅频道；replay 为 True 时先补发历史中 id > last_id 的事件。"""
+        subscription = Subscription(self, channel)
+        with self._lock:
+            if replay:
+                for event in self._history.get(channel, ()):
+                    if event["id"] > last_id:
+                        subscription.put(event)
+            self._subscribers.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.channel)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.channel]
+
+    def drop(self, channel: str) -> None:
+        """丢弃频道的历史事件（对局结束后调用）；已有订阅者不受影响，断开时自行退订。"""
+        with self._lock:
+            self._history.pop(channel, None)
+
+    def channels(self) -> list[str]:
+        with self._lock:
+            return sorted(self._history)
+
+
+def sse_format(event: dict) -> str:
+    """格式化为一条 Server-Sent Event。"""
+    data = json.dumps(event, ensure_ascii=False)
+    return f"id: {event['id']}\nevent: {event['type']}\ndata: {data}\n\n"
+
+
+bus = EventBus()
@@ -0,0 +1,227 @@
+"""OSS 资源增量同步：本地清单记录内容哈希与 ETag，只上传新增或内容变化的文件。"""
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Optional
+
+import alibabacloud_oss_v2 as oss
+
+IMAGE_SUFFIXES = frozenset({".png", ".jpg", ".jpeg", ".webp"})
+AUDIO_SUFFIXES = frozenset({".mp3", ".wav", ".ogg", ".m4a"})
+# 同步的资源前缀及各自允许的文件后缀，对应 resources/<prefix> 与 OSS 上的 <story_id>/<prefix>/
+PREFIX_SUFFIXES = {
+    "characters": IMAGE_SUFFIXES,
+    "scenes": IMAGE_SUFFIXES,
+    "covers": IMAGE_SUFFIXES,
+    "audio": AUDIO_SUFFIXES,
+}
+# 超过该大小的文件使用分片上传
+MULTIPART_THRESHOLD = 16 * 1024 * 1024
+PART_SIZE = 8 * 1024 * 1024
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def content_etag(path: Path) -> str:
+    """文件按 OSS 简单上传计算的 ETag：大写 MD5，带引号。"""
+    md5 = hashlib.md5()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            md5.update(chunk)
+    return f'"{md5.hexdigest().upper()}"'
+
+
+class AliyunOSS:
+    """阿里云 OSS 后端。"""
+
+    def __init__(self, client: oss.Client, bucket: str = "aimmg"):
+        self.client = client
+        self.bucket = bucket
+
+    def list(self, prefix: str) -> dict[str, tuple[str, int]]:
+        """列出前缀下全部对象，返回 {key: (etag, size)}。"""
+        result = {}
+        paginator = self.client.list_objects_v2_paginator()
+        for page in paginator.iter_page(oss.ListObjectsV2Request(bucket=self.bucket, prefix=prefix)):
+            for obj in page.contents or []:
+                result[obj.key] = (obj.etag or "", obj.size or 0)
+        return result
+
+    def put(self, key: str, path: Path, size: int) -> str:
+        """上传文件，大文件走分片上传，返回 ETag。"""
+        request = oss.PutObjectRequest(bucket=self.bucket, key=key)
+        if size >= MULTIPART_THRESHOLD:
+            result = self.client.uploader(part_size=PART_SIZE, parallel_num=4).upload_file(
+                request, filepath=path.as_posix())
+        else:
+            result = self.client.put_object_from_file(request, path.as_posix())
+        return result.etag or ""
+
+
+class LocalOSS:
+    """
+    用本地目录模拟 OSS，便于离线调试同步流程：对象保存为 root/<key>，
+    ETag 与 OSS 简单上传一致（大写 MD5，带引号）。
+    """
+
+    def __init__(self, root: str | Path):
+        self.root = Path(root)
+        self.puts = 0
+        self.lists = 0
+        self._lock = threading.Lock()
+
+    def list(self, prefix: str) -> dict[str, tuple[str, int]]:
+        with self._lock:
+            self.lists += 1
+        base = self.root / prefix
+        if not base.is_dir():
+            return {}
+        return {p.relative_to(self.root).as_posix(): (content_etag(p), p.stat().st_size)
+                for p in base.rglob("*") if p.is_file()}
+
+    def put(self, key: str, path: Path, size: int) -> str:
+        target = self.root / key
+        target.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copyfile(path, target)
+        with self._lock:
+            self.puts += 1
+        return content_etag(target)
+
+
+@dataclass
+class SyncItem:
+    """一个待上传文件。"""
+    key: str
+    path: Path
+    size: int
+    sha256: str
+    reason: str
+
+
+class OSSSync:
+    """
+    基于本地清单的增量同步。清单 {key: {sha256, size, mtime_ns, etag}} 记录上次成功上传的内容，
+    文件 (mtime_ns, size) 未变时沿用清单中的哈希，不重复读取；内容哈希与清单一致即跳过，
+    因此没有变化时无需列举 OSS。full=True 时额外列举 OSS，补传远端缺失或 ETag 不一致的对象。
+    清单中没有记录的文件（如首次同步）也会列举 OSS：远端已有相同内容的对象时直接记入清单，不再上传。
+    """
+
+    def __init__(self, backend, resource_dir: str | Path, manifest_path: str | Path):
+        self.backend = backend
+        self.resource_dir = Path(resource_dir)
+        self.manifest_path = Path(manifest_path)
+        try:
+            self.manifest: dict[str, dict] = json.loads(self.manifest_path.read_text(encoding="utf-8"))
+        except (OSError, json.JSONDecodeError):
+            self.manifest = {}
+        self._lock = threading.Lock()
+
+    def _hash(self, path: Path, st: os.stat_result, entry: Optional[dict]) -> str:
+        if entry and entry.get("size") == st.st_size and entry.get("mtime_ns") == st.st_mtime_ns:
+            return entry["sha256"]
+        sha = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+                sha.update(chunk)
+        return sha.hexdigest()
+
+    @staticmethod
+    def _same_as_remote(path: Path, size: int, remote: tuple[str, int]) -> bool:
+        """远端对象与本地文件内容一致。分片上传的 ETag 不是 MD5（带 -N 后缀），只能比较大小。"""
+        etag, remote_size = remote
+        if remote_size != size:
+            return False
+        if "-" in etag:
+            return True
+        return etag.strip('"').upper() == content_etag(path).strip('"')
+
+    def local_files(self, prefix: str) -> list[Path]:
+        directory = self.resource_dir / prefix
+        if not directory.is_dir():
+            return []
+        suffixes = PREFIX_SUFFIXES.get(prefix, IMAGE_SUFFIXES)
+        return sorted(p for p in directory.iterdir() if p.is_file() and p.suffix.lower() in suffixes)
+
+    def plan(self, story_id: str, prefixes: list[str], *, full: bool = False) -> tuple[list[SyncItem], int]:
+        """返回 (待上传文件, 本地文件总数)。"""
+        items = []
+        total = 0
+        for prefix in prefixes:
+            files = self.local_files(prefix)
+            keys = [f"{story_id}/{prefix}/{path.name}" for path in files]
+            listed = full or any(key not in self.manifest for key in keys)
+            remote = self.backend.list(f"{story_id}/{prefix}/") if listed else None
+            for path, key in zip(files, keys):
+                total += 1
+                st = path.stat()
+                entry = self.manifest.get(key)
+                digest = self._hash(path, st, entry)
+                if entry is None:
+                    if remote is not None and key in remote and self._same_as_remote(path, st.st_size, remote[key]):
+                        # 远端已有相同内容（如清单丢失或首次使用清单），只补记清单
+                        self.manifest[key] = {
+                            "sha256": digest, "size": st.st_size, "mtime_ns": st.st_mtime_ns, "etag": remote[key][0]}
+                        continue
+                    reason = "远端不一致" if remote is not None and key in remote else "新增"
+                elif entry["sha256"] != digest:
+                    reason = "已变化"
+                elif remote is not None and key not in remote:
+                    reason = "远端缺失"
+                elif remote is not None and entry.get("etag") and remote[key][0] != entry["etag"]:
+                    reason = "远端不一致"
+                else:
+                    if entry.get("mtime_ns") != st.st_mtime_ns:
+                        # 内容未变但 mtime 变了（如重新检出），更新清单避免下次再读文件
+                        entry["mtime_ns"] = st.st_mtime_ns
+                    continue
+                items.append(SyncItem(key, path, st.st_size, digest, reason))
+        return items, total
+
+    def upload(
+        self,
+        items: list[SyncItem],
+        *,
+        workers: int = 8,
+        on_done: Optional[Callable[[SyncItem, Optional[Exception]], None]] = None,
+    ) -> list[tuple[SyncItem, Exception]]:
+        """并发上传，成功的写入清单；返回失败列表。"""
+        failures = []
+
+        def put(item: SyncItem) -> str:
+            return self.backend.put(item.key, item.path, item.size)
+
+        try:
+            with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+                futures = {pool.submit(put, item): item for item in items}
+                for future in as_completed(futures):
+                    item = futures[future]
+                    error = future.exception()
+                    if error is None:
+                        with self._lock:
+                            self.manifest[item.key] = {
+                                "sha256": item.sha256,
+                                "size": item.size,
+                                "mtime_ns": item.path.stat().st_mtime_ns,
+                                "etag": future.result(),
+                            }
+                    else:
+                        failures.append((item, error))
+                    if on_done is not None:
+                        on_done(item, error)
+        finally:
+            self.save()
+        return failures
+
+    def save(self) -> None:
+        """原子写入清单。"""
+        with self._lock:
+            data = json.dumps(self.manifest, ensure_ascii=False, indent=2, sort_keys=True)
+        self.manifest_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.manifest_path.with_name(f".{self.manifest_path.name}.{os.getpid()}.tmp")
+        tmp.write_text(data, encoding="utf-8")
+        os.replace(tmp, self.manifest_path)
@@ -0,0 +1,61 @@
+"""StoryMemory 写入基准：对比逐条提交与 WAL 批量提交的吞吐（条/秒）。"""
+
+import argparse
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+
+from store.memory import StoryMemory  # noqa: E402
+
+
+def _rows(n: int) -> list[tuple[str, str, str, str, str]]:
+    content = "（我站在吧台后，用一块干净的布慢条斯理地擦拭着一个高脚杯。）" * 4
+    return [("scene", "场景", f"c{i % 5}", f"角色{i % 5}", content) for i in range(n)]
+
+
+def bench_add(db_dir: Path, name: str, n: int, **kwargs) -> float:
+    """逐条 add，返回条/秒。"""
+    rows = _rows(n)
+    start = time.perf_counter()
+    with StoryMemory(name, db_dir, **kwargs) as memory:
+        for row in rows:
+            memory.add(*row)
+    return n / (time.perf_counter() - start)
+
+
+def bench_add_many(db_dir: Path, name: str, n: int, chunk: int) -> float:
+    """按 chunk 条一组 add_many，返回条/秒。"""
+    rows = _rows(n)
+    start = time.perf_counter()
+    with StoryMemory(name, db_dir) as memory:
+        for i in range(0, n, chunk):
+            memory.add_many(rows[i:i + chunk])
+    return n / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="StoryMemory 写入基准")
+    parser.add_argument("-n", type=int, default=2000, help="写入条数")
+    parser.add_argument("--batch-size", type=int, default=64, help="批量提交条数")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_dir = Path(tmp)
+        results = [
+            ("逐条提交（旧行为）", bench_add(db_dir, "legacy", args.n, batch_size=1, wal=False)),
+            ("WAL 逐条提交", bench_add(db_dir, "wal", args.n, batch_size=1)),
+            (f"WAL 批量提交 ({args.batch_size})",
+             bench_add(db_dir, "batched", args.n, batch_size=args.batch_size, flush_interval=60)),
+            (f"add_many ({args.batch_size})", bench_add_many(db_dir, "many", args.n, args.batch_size)),
+        ]
+    baseline = results[0][1]
+    for name, rate in results:
+        print(f"{name:<24} {rate:>12,.0f} 条/秒  x{rate / baseline:.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""文件扫描基准：在合成目录树上对比 rglob 实现与 os.scandir 扫描器（含目录缓存）的耗时。"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from utils import ScanCache, scan_files  # noqa: E402
+
+SUFFIXES = (".md", ".json", ".pdf", ".png")
+
+
+def build_tree(root: Path, files: int, per_dir: int) -> None:
+    """生成 files 个空文件，每个目录 per_dir 个，两层目录。"""
+    dirs = max(1, files // per_dir)
+    for d in range(dirs):
+        directory = root / f"group_{d // 32}" / f"dir_{d}"
+        directory.mkdir(parents=True, exist_ok=True)
+        for i in range(per_dir):
+            (directory / f"page_{i}{SUFFIXES[i % len(SUFFIXES)]}").touch()
+
+
+def scan_files_rglob(root: Path, suffix: list[str]) -> list[dict]:
+    """改写前的 scan_files：rglob + 每个文件 stat、每次重建后缀列表。"""
+    root = Path(root).resolve()
+    suffixes = [s if s.startswith(".") else f".{s}" for s in suffix]
+    result = []
+    for p in root.rglob("*"):
+        if not p.is_file():
+            continue
+        if p.suffix.lower() not in [s.lower() for s in suffixes]:
+            continue
+        result.append({"name": p.name, "relpath": p.relative_to(root).as_posix()})
+    return result
+
+
+def timed(fn) -> tuple[float, int]:
+    start = time.perf_counter()
+    n = len(fn())
+    return time.perf_counter() - start, n
+
+
+def main():
+    parser = argparse.ArgumentParser(description="scan_files 基准")
+    parser.add_argument("--files", type=int, default=100_000, help="合成文件数")
+    parser.add_argument("--per-dir", type=int, default=500, help="每个目录的文件数")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp) / "tree"
+        start = time.perf_counter()
+        build_tree(root, args.files, args.per_dir)
+        print(f"生成 {args.files} 个文件: {time.perf_counter() - start:.1f} 秒")
+
+        suffix = [".md", ".json"]
+        cache = ScanCache(Path(tmp) / "scan_cache.json")
+        cases = [
+            ("rglob（旧实现）", lambda: scan_files_rglob(root, suffix)),
+            ("scandir", lambda: scan_files(root, suffix)),
+            ("scandir + 缓存（冷）", lambda: scan_files(root, suffix, cache=cache)),
+            ("scandir + 缓存（热）", lambda: scan_files(root, suffix, cache=cache)),
+            ("scandir + 剪枝一半目录", lambda: scan_files(
+                root, suffix, prune=lambda parent, name: name.startswith("group_") and int(name[6:]) % 2 == 1)),
+        ]
+        baseline = None
+        for name, fn in cases:
+            seconds, n = timed(fn)
+            baseline = baseline or seconds
+            print(f"  {name:<24} {seconds * 1000:8.1f} ms  {n} 个匹配  {baseline / seconds:5.1f}x")
+        cache.save()
+        print(f"  缓存文件 {os.path.getsize(cache.path) // 1024} KB，命中 {cache.hits} / 未命中 {cache.misses}")
+        reloaded = ScanCache(cache.path)
+        seconds, n = timed(lambda: scan_files(root, suffix, cache=reloaded))
+        print(f"  {'scandir + 缓存（从文件加载）':<24} {seconds * 1000:8.1f} ms  {n} 个匹配  {baseline / seconds:5.1f}x")
+
+
+if __name__ == "__main__":
+    main()
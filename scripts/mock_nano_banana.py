@@ -0,0 +1,114 @@
+"""
+本地模拟绘图 API，用于离线调试 story_utils 的生成与下载流程。
+
+    python scripts/mock_nano_banana.py --port 8765
+    NANO_BANANA_API_URL=http://127.0.0.1:8765/v1/draw python story_utils.py scene
+
+POST /v1/draw 以 SSE 推送进度，最后一条返回 /images/<n>.png 的地址；--fail-rate 可随机返回 429 / 500，
+用于验证重试与退避。
+"""
+
+import argparse
+import itertools
+import json
+import random
+import struct
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def _png(width: int, height: int, rgb: tuple[int, int, int]) -> bytes:
+    """生成纯色 PNG（不依赖 Pillow）。"""
+    def chunk(tag: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data))
+
+    row = b"\x00" + bytes(rgb) * width
+    return (b"\x89PNG\r\n\x1a\n"
+            + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(row * height))
+            + chunk(b"IEND", b""))
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    counter = itertools.count(1)
+    steps = 5
+    delay = 0.2
+    fail_rate = 0.0
+    image_size = (512, 512)
+
+    def log_message(self, fmt, *args):
+        print(f"  {self.address_string()} {fmt % args}")
+
+    def _send(self, status: int, body: bytes, content_type: str) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = json.loads(self.rfile.read(length) or b"{}")
+        if random.random() < self.fail_rate:
+            self._send(random.choice((429, 500, 503)), b'{"error": "mock failure"}', "application/json")
+            return
+        n = next(self.counter)
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def event(data: dict) -> None:
+            payload = f"data: {json.dumps(data, ensure_ascii=False)}\n\n".encode("utf-8")
+            self.wfile.write(f"{len(payload):x}\r\n".encode() + payload + b"\r\n")
+            self.wfile.flush()
+
+        for i in range(1, self.steps + 1):
+            time.sleep(self.delay)
+            event({"status": "running", "progress": i * 100 // (self.steps + 1)})
+        host = self.headers.get("Host") or f"127.0.0.1:{self.server.server_port}"
+        event({
+            "status": "succeeded",
+            "progress": 100,
+            "results": [{"url": f"http://{host}/images/{n}.png"}],
+            "prompt": body.get("prompt", ""),
+        })
+        self.wfile.write(b"0\r\n\r\n")
+
+    def do_GET(self):
+        if not self.path.startswith("/images/"):
+            self._send(404, b"not found", "text/plain")
+            return
+        seed = sum(self.path.encode())
+        rgb = (seed * 37 % 256, seed * 67 % 256, seed * 97 % 256)
+        self._send(200, _png(*self.image_size, rgb), "image/png")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地模拟绘图 API（SSE 进度 + 图片下载）")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--steps", type=int, default=5, help="每次生成推送的进度条数")
+    parser.add_argument("--delay", type=float, default=0.2, help="两条进度之间的间隔（秒）")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="随机返回 429/5xx 的概率")
+    parser.add_argument("--size", type=int, nargs=2, default=[512, 512], metavar=("W", "H"), help="返回图片尺寸")
+    args = parser.parse_args()
+
+    MockHandler.steps = args.steps
+    MockHandler.delay = args.delay
+    MockHandler.fail_rate = args.fail_rate
+    MockHandler.image_size = tuple(args.size)
+    server = ThreadingHTTPServer((args.host, args.port), MockHandler)
+    print(f"模拟绘图 API: http://{args.host}:{args.port}/v1/draw")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
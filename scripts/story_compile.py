@@ -0,0 +1,341 @@
+"""
+剧本编译：把 story_tidy merge 生成的 *_merged.md 解析为 data/story__<id>.json 结构。
+
+源文件按路径与文件名归类：
+    - 文件名含「主持人」「组织者」「DM」：主持人手册，一级/二级标题为场景，三级及以下标题分隔步骤，
+      引用行（> ...）为主持人提示（user），其余段落为自动上下文（memory）；
+    - 位于「线索」目录或文件名含「卡」「线索」：道具，条目「名称：描述」为子道具；
+    - 其余：角色剧本，文件名为角色名，「第 N 幕」标题分幕，「任务」「技能」标题下的条目为任务 / 技能，
+      其余段落为该幕提示词。
+
+每个文件切分为若干小节（按幕 / 场景 / 文件），按 (文件, 小节标题, 内容哈希) 缓存编译结果，
+只重新编译内容变化的小节，小节前后插入或删除其他小节不影响缓存命中。
+已存在的剧本中同名角色 / 场景沿用原 id。
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import sys
+import uuid
+from pathlib import Path
+from typing import Optional
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+
+from store.compiled import compile_story as compile_story_db  # noqa: E402
+from store.model import validate_story  # noqa: E402
+from store.stories import DATA_DIR  # noqa: E402
+from utils import iter_files  # noqa: E402
+
+COMPILE_CACHE_NAME = ".compile_cache.json"
+MERGED_SUFFIX = "_merged.md"
+
+# merge 插入的分页标记
+RE_PAGE_BREAK = re.compile(r"\n*^---\n+## 第 (\d+) 页\n*", re.M)
+RE_HEADING = re.compile(r"^(#{1,6})\s+(.+?)\s*#*$")
+RE_ACT = re.compile(r"第\s*([一二三四五六七八九十\d]+)\s*幕")
+RE_LIST_ITEM = re.compile(r"^(?:[-*+•]|\d+[.、)）]|[（(]\d+[)）])\s*")
+RE_CHILD = re.compile(r"^(.+?)\s*[:：]\s*(.+)$")
+CN_DIGITS = {"一": 1, "二": 2, "三": 3, "四": 4, "五": 5, "六": 6, "七": 7, "八": 8, "九": 9, "十": 10}
+
+MASTER_KEYWORDS = ("主持人", "组织者", "DM")
+PROP_KEYWORDS = ("卡", "线索")
+
+
+def _act_number(text: str) -> Optional[int]:
+    m = RE_ACT.search(text)
+    if m is None:
+        return None
+    raw = m.group(1)
+    if raw.isdigit():
+        return int(raw)
+    if raw.startswith("十"):
+        return 10 + CN_DIGITS.get(raw[1:], 0)
+    if "十" in raw:
+        tens, _, ones = raw.partition("十")
+        return CN_DIGITS[tens] * 10 + CN_DIGITS.get(ones, 0)
+    return CN_DIGITS.get(raw)
+
+
+def _hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def classify(relpath: str) -> str:
+    """按路径与文件名判断源文件类型：master / props / character。"""
+    stem = Path(relpath).name[: -len(MERGED_SUFFIX)]
+    if any(k in stem for k in MASTER_KEYWORDS):
+        return "master"
+    if "线索" in Path(relpath).parent.parts or any(k in stem for k in PROP_KEYWORDS):
+        return "props"
+    return "character"
+
+
+def split_pages(text: str) -> list[tuple[int, str]]:
+    """按 merge 插入的「第 N 页」分隔切分，返回 [(页码, 内容)]，页码从 1 开始。"""
+    pages = []
+    last, number = 0, 1
+    for m in RE_PAGE_BREAK.finditer(text):
+        pages.append((number, text[last:m.start()]))
+        number, last = int(m.group(1)), m.end()
+    pages.append((number, text[last:]))
+    return pages
+
+
+def parse_blocks(text: str) -> list[tuple[str, object]]:
+    """
+    把 markdown 切成块：("heading", (级别, 文本)) / ("para", 文本) / ("quote", 文本) / ("item", 文本)。
+    连续的普通行合并为一个段落。
+    """
+    blocks: list[tuple[str, object]] = []
+    para: list[str] = []
+
+    def flush():
+        if para:
+            blocks.append(("para", "".join(para)))
+            para.clear()
+
+    for raw in text.splitlines():
+        line = raw.strip()
+        if not line or line == "---":
+            flush()
+            continue
+        m = RE_HEADING.match(line)
+        if m:
+            flush()
+            blocks.append(("heading", (len(m.group(1)), m.group(2).strip())))
+        elif line.startswith(">"):
+            flush()
+            blocks.append(("quote", line.lstrip("> ").strip()))
+        elif RE_LIST_ITEM.match(line):
+            flush()
+            blocks.append(("item", RE_LIST_ITEM.sub("", line, count=1).strip()))
+        else:
+            para.append(line)
+    flush()
+    return [b for b in blocks if b[1]]
+
+
+def split_sections(kind: str, text: str) -> list[tuple[str, str]]:
+    """
+    把文件切分为可独立编译的小节，返回 [(标题, 内容)]。
+    角色剧本按「第 N 幕」标题切分（第一幕之前为简介）；主持人手册按一级 / 二级标题切分；道具文件整体为一节。
+    """
+    body = "\n\n".join(page for _number, page in split_pages(text))
+    if kind == "props":
+        return [("", body)]
+    sections: list[tuple[str, list[str]]] = [("", [])]
+    for line in body.splitlines():
+        m = RE_HEADING.match(line.strip())
+        if m and (
+            (kind == "character" and _act_number(m.group(2)) is not None)
+            or (kind == "master" and len(m.group(1)) <= 2)
+        ):
+            sections.append((m.group(2).strip(), []))
+            continue
+        sections[-1][1].append(line)
+    return [(title, "\n".join(lines).strip()) for title, lines in sections if title or "\n".join(lines).strip()]
+
+
+def compile_character_section(title: str, text: str) -> dict:
+    """角色剧本小节：简介返回 {introduction, description}，每一幕返回 {act, prompts, tasks, skills}。"""
+    blocks = parse_blocks(text)
+    if not title:
+        paras = [b[1] for b in blocks if b[0] in ("para", "item", "quote")]
+        introduction = paras[0] if paras else ""
+        return {"introduction": introduction, "description": re.split(r"[。！？]", introduction, maxsplit=1)[0]}
+    result: dict = {"act": _act_number(title), "prompts": []}
+    target = "prompts"
+    for kind, value in blocks:
+        if kind == "heading":
+            heading = value[1]
+            target = "tasks" if "任务" in heading else "skills" if "技能" in heading else "prompts"
+            continue
+        result.setdefault(target, []).append(value)
+    return result
+
+
+def compile_master_section(title: str, text: str) -> dict:
+    """主持人手册小节：返回 {name, steps}，三级及以下标题分隔步骤，步骤内相邻同类段落合并为一块。"""
+    steps: list[list[dict]] = [[]]
+    for kind, value in parse_blocks(text):
+        if kind == "heading":
+            if steps[-1]:
+                steps.append([])
+            continue
+        block_type = "user" if kind == "quote" else "memory"
+        step = steps[-1]
+        if step and step[-1]["type"] == block_type:
+            step[-1]["value"].append(value)
+        else:
+            step.append({"type": block_type, "value": [value]})
+    return {"name": title, "steps": [s for s in steps if s]}
+
+
+def compile_props_section(stem: str, text: str, pages: int) -> dict:
+    """道具文件：名称为文件名，数量为页数，「名称：描述」条目为子道具。"""
+    prop: dict = {"name": stem, "count": max(1, pages)}
+    children = []
+    for kind, value in parse_blocks(text):
+        m = RE_CHILD.match(value) if kind == "item" else None
+        if m:
+            children.append({"name": m.group(1), "description": m.group(2)})
+    if children:
+        prop["children"] = children
+    return prop
+
+
+def _stable_id(story_id: str, kind: str, name: str, existing: dict[str, str]) -> str:
+    if name in existing:
+        return existing[name]
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f"aimmg:{story_id}:{kind}:{name}"))
+
+
+def _character_name(stem: str) -> str:
+    """文件名中的空格 / 点号统一为间隔号：「贝克 巴顿」→「贝克·巴顿」。"""
+    return re.sub(r"\s*[ ·.•]\s*", "·", stem.strip())
+
+
+def _load_cache(out_dir: Path) -> dict:
+    try:
+        return json.loads((out_dir / COMPILE_CACHE_NAME).read_text(encoding="utf-8"))
+    except (OSError, json.JSONDecodeError):
+        return {}
+
+
+def _atomic_write(path: Path, text: str) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    tmp.write_text(text, encoding="utf-8")
+    os.replace(tmp, path)
+
+
+def compile_story(story_id: str, existing: Optional[dict] = None, force: bool = False) -> tuple[dict, dict]:
+    """
+    编译 stories/<id>/output 下全部 *_merged.md，返回 (剧本 JSON, 统计)。
+    小节内容哈希与缓存一致时直接复用上次的编译结果。
+    """
+    out_dir = PROJECT_ROOT / "stories" / story_id / "output"
+    cache = {} if force else _load_cache(out_dir)
+    new_cache: dict[str, dict] = {}
+    stats = {"files": 0, "compiled": 0, "reused": 0}
+    existing = existing or {}
+    character_ids = {c.get("name"): c.get("id") for c in existing.get("characters") or []}
+    scene_ids = {s.get("name"): s.get("id") for s in existing.get("scenes") or [] if s.get("id")}
+
+    characters, scenes, props = [], [], []
+    for relpath in sorted(iter_files(out_dir, ".md")):
+        if not relpath.endswith(MERGED_SUFFIX):
+            continue
+        stats["files"] += 1
+        kind = classify(relpath)
+        stem = Path(relpath).name[: -len(MERGED_SUFFIX)]
+        text = (out_dir / relpath).read_text(encoding="utf-8")
+        pages = len(split_pages(text))
+        results = []
+        for title, body in split_sections(kind, text):
+            # 按 (文件, 标题, 内容哈希) 寻址，与小节位置无关：插入或删除一幕不会让后面的小节失效
+            digest = _hash(f"{kind}\n{title}\n{pages if kind == 'props' else ''}\n{body}")
+            key = f"{relpath}#{title}#{digest}"
+            cached = cache.get(key)
+            if cached is not None:
+                result = cached["result"]
+                stats["reused"] += 1
+            else:
+                if kind == "character":
+                    result = compile_character_section(title, body)
+                elif kind == "master":
+                    result = compile_master_section(title, body)
+                else:
+                    result = compile_props_section(stem, body, pages)
+                stats["compiled"] += 1
+            new_cache[key] = {"result": result}
+            results.append(result)
+
+        if kind == "character":
+            name = _character_name(stem)
+            character = {
+                "id": _stable_id(story_id, "character", name, character_ids),
+                "name": name,
+                "description": "",
+                "introduction": "",
+                "scenes": [],
+            }
+            for result in results:
+                if "act" not in result:
+                    character.update(result)
+                else:
+                    character["scenes"].append({k: v for k, v in result.items() if k != "act"})
+            characters.append(character)
+        elif kind == "master":
+            for result in results:
+                if not result["steps"]:
+                    continue
+                name = result["name"] or stem
+                scenes.append({"id": _stable_id(story_id, "scene", name, scene_ids), "name": name,
+                               "steps": result["steps"]})
+        else:
+            props.extend(results)
+
+    _atomic_write(out_dir / COMPILE_CACHE_NAME, json.dumps(new_cache, ensure_ascii=False))
+    story = {
+        "name": existing.get("name") or story_id,
+        "props": props,
+        "scenes": scenes,
+        "characters": characters,
+    }
+    return story, stats
+
+
+def run_compile(story_id: str, out: Optional[Path] = None, force: bool = False, overwrite: bool = False) -> int:
+    """编译并校验，通过后原子写入 out（默认 data/story__<id>.json）。返回进程退出码。"""
+    out_dir = PROJECT_ROOT / "stories" / story_id / "output"
+    if not out_dir.is_dir():
+        print(f"目录不存在: {out_dir}")
+        return 1
+    target = out or DATA_DIR / f"story__{story_id}.json"
+    existing = None
+    if target.is_file():
+        try:
+            existing = json.loads(target.read_text(encoding="utf-8"))
+        except json.JSONDecodeError:
+            existing = None
+    story, stats = compile_story(story_id, existing, force=force)
+    print(f"源文件 {stats['files']} 个，编译小节 {stats['compiled']} 个，复用 {stats['reused']} 个")
+    print(f"角色 {len(story['characters'])} 个，场景 {len(story['scenes'])} 个，道具 {len(story['props'])} 个")
+
+    errors = validate_story(story)
+    if errors:
+        print("校验失败：")
+        for error in errors:
+            print(f"  {error}")
+        return 1
+    if target.is_file() and not overwrite and out is None:
+        # 不覆盖手工维护的剧本，输出到 output 目录供比对
+        target = out_dir / target.name
+        print(f"  {DATA_DIR.name}/{target.name} 已存在，未覆盖（--overwrite 可覆盖）")
+    _atomic_write(target, json.dumps(story, ensure_ascii=False, indent=2))
+    print(f"已写入: {target}")
+    if target.parent == DATA_DIR:
+        db_path = target.with_suffix(".sqlite")
+        compile_story_db(target, db_path)
+        print(f"已写入: {db_path}")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="把合并后的 OCR 结果编译为剧本 JSON")
+    parser.add_argument("--id", default="shou_huo_ri", help="剧本 ID，对应 stories/<id>")
+    parser.add_argument("--out", type=Path, default=None, help="输出路径，默认 data/story__<id>.json")
+    parser.add_argument("--force", action="store_true", help="忽略缓存，全部重新编译")
+    parser.add_argument("--overwrite", action="store_true", help="覆盖 data 目录下已存在的剧本")
+    args = parser.parse_args()
+    exit(run_compile(args.id, args.out, force=args.force, overwrite=args.overwrite))
+
+
+if __name__ == "__main__":
+    main()
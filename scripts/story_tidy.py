@@ -1,11 +1,16 @@
 import argparse
+import hashlib
 import json
+import multiprocessing
+import os
 import re
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from pathlib import Path
 
 from paddleocr import PaddleOCRVL
 
-from utils import scan_files
+from utils import ScanCache, iter_files, scan_files
 
 PROJECT_ROOT = Path(__file__).resolve().parent.parent
 
@@ -13,6 +18,16 @@ PROJECT_ROOT = Path(__file__).resolve().parent.parent
 RE_MD = re.compile(r"^(.+)_(\d+)\.md$")
 RE_JSON = re.compile(r"^(.+)_(\d+)_res\.json$")
 
+# OCR 清单：{PDF 相对路径: {sha256, pages, seconds, page_seconds}}，位于 output 目录
+OCR_MANIFEST_NAME = ".ocr_manifest.json"
+# 单个 PDF 全部页面写完后生成的完成标记 .<stem>.done，内容为 PDF 的 sha256
+DONE_SUFFIX = ".done"
+# 合并日志 .<stem>.merge：记录待替换的临时文件与待删除的分页文件，保证中断后可恢复
+MERGE_JOURNAL_SUFFIX = ".merge"
+SCAN_CACHE_NAME = ".scan_cache.json"
+
+_pipeline = None
+
 
 def collect_page_files(output_dir: Path) -> dict[tuple[str, str], dict]:
     """
@@ -25,15 +40,9 @@ def collect_page_files(output_dir: Path) -> dict[tuple[str, str], dict]:
 
     groups: dict[tuple[str, str], dict] = {}
 
-    for f in output_dir.rglob("*"):
-        if not f.is_file():
-            continue
-        try:
-            rel = f.relative_to(output_dir)
-        except ValueError:
-            continue
-        parent_rel = str(rel.parent) if rel.parent.parts else ""
-        name = f.name
+    for relpath in iter_files(output_dir, (".md", ".json")):
+        parent_rel, _, name = relpath.rpartition("/")
+        f = output_dir / relpath
 
         m = RE_MD.match(name)
         if m:
@@ -54,57 +63,280 @@ def collect_page_files(output_dir: Path) -> dict[tuple[str, str], dict]:
     return groups
 
 
-def run_merge(story_id: str, add_page_break: bool = True) -> None:
-    """将 output 下同 stem 的分页 .md / _res.json 合并为单个文件。"""
+def _tmp_path(path: Path) -> Path:
+    return path.with_name(f".{path.name}.{os.getpid()}.tmp")
+
+
+def _journal_path(parent_dir: Path, stem: str) -> Path:
+    return parent_dir / f".{stem}{MERGE_JOURNAL_SUFFIX}"
+
+
+def _write_merged_md(md_list: list[tuple[int, Path]], out_md: Path, add_page_break: bool) -> Path:
+    """逐页读取并写入临时文件，返回临时文件路径。"""
+    tmp = _tmp_path(out_md)
+    with open(tmp, "w", encoding="utf-8") as fp:
+        for n, (idx, path) in enumerate(md_list):
+            text = path.read_text(encoding="utf-8").strip()
+            if n:
+                fp.write("\n\n")
+                if add_page_break:
+                    fp.write("\n\n---\n\n## 第 {} 页\n\n".format(idx + 1) + "\n\n")
+            fp.write(text)
+        fp.flush()
+        os.fsync(fp.fileno())
+    return tmp
+
+
+def _write_merged_json(json_list: list[tuple[int, Path]], out_json: Path, stem: str, fmt: str) -> Path:
+    """
+    逐页读取并写入临时文件，返回临时文件路径。fmt="json" 时输出 {"pages": [...], "source_stem": stem}，
+    数组元素逐个写出；fmt="jsonl" 时每行一页。
+    """
+    tmp = _tmp_path(out_json)
+    with open(tmp, "w", encoding="utf-8") as fp:
+        if fmt == "json":
+            fp.write('{"pages": [\n')
+        for n, (_idx, path) in enumerate(json_list):
+            with open(path, "r", encoding="utf-8") as page_fp:
+                page = json.load(page_fp)
+            if n and fmt == "json":
+                fp.write(",\n")
+            fp.write(json.dumps(page, ensure_ascii=False))
+            if fmt == "jsonl":
+                fp.write("\n")
+        if fmt == "json":
+            fp.write("\n], " + json.dumps({"source_stem": stem}, ensure_ascii=False)[1:])
+        fp.flush()
+        os.fsync(fp.fileno())
+    return tmp
+
+
+def _apply_merge_journal(journal: Path) -> None:
+    """
+    执行合并日志：把临时文件替换为正式输出，删除分页源文件，最后删除日志。
+    幂等，中断后重新执行可得到一致的结果。
+    """
+    entry = json.loads(journal.read_text(encoding="utf-8"))
+    for tmp, target in entry["outputs"]:
+        if Path(tmp).exists():
+            os.replace(tmp, target)
+    for source in entry["sources"]:
+        try:
+            Path(source).unlink(missing_ok=True)
+        except OSError as e:
+            print(f"  删除失败 {source}: {e}")
+    journal.unlink()
+
+
+def _merge_group(
+    out_dir: Path,
+    parent_rel: str,
+    stem: str,
+    files: dict,
+    add_page_break: bool,
+    fmt: str,
+) -> list[str]:
+    """
+    合并一组分页文件：先流式写临时文件，再写合并日志并按日志原子替换输出、删除源文件。
+    返回输出日志行。
+    """
+    parent_dir = out_dir / parent_rel if parent_rel else out_dir
+    md_list = sorted(files["md"], key=lambda x: x[0])
+    json_list = sorted(files["json"], key=lambda x: x[0])
+    outputs = []
+    lines = []
+    if md_list:
+        out_md = parent_dir / f"{stem}_merged.md"
+        outputs.append((str(_write_merged_md(md_list, out_md, add_page_break)), str(out_md)))
+        lines.append(f"  MD: {parent_rel or '.'}/{out_md.name} ({len(md_list)} 页)")
+    if json_list:
+        out_json = parent_dir / f"{stem}_merged.{fmt}"
+        outputs.append((str(_write_merged_json(json_list, out_json, stem, fmt)), str(out_json)))
+        lines.append(f"  JSON: {parent_rel or '.'}/{out_json.name} ({len(json_list)} 页)")
+
+    journal = _journal_path(parent_dir, stem)
+    tmp = _tmp_path(journal)
+    tmp.write_text(json.dumps({
+        "outputs": outputs,
+        "sources": [str(path) for _idx, path in md_list + json_list],
+    }, ensure_ascii=False), encoding="utf-8")
+    os.replace(tmp, journal)
+    _apply_merge_journal(journal)
+    return lines
+
+
+def run_merge(story_id: str, add_page_break: bool = True, fmt: str = "json", workers: int = 4) -> None:
+    """
+    将 output 下同 stem 的分页 .md / _res.json 合并为单个文件，逐页流式写出，不在内存中拼接整份文档。
+    各组并行处理；上次中断遗留的合并日志会先被执行完。
+    """
     out_dir = PROJECT_ROOT / "stories" / story_id / "output"
     if not out_dir.is_dir():
         print(f"目录不存在: {out_dir}")
         return
 
+    for relpath in iter_files(out_dir, MERGE_JOURNAL_SUFFIX):
+        print(f"  恢复未完成的合并: {relpath}")
+        _apply_merge_journal(out_dir / relpath)
+
     groups = collect_page_files(out_dir)
     if not groups:
         print("未找到可分页合并的 OCR 输出文件（stem_N.md / stem_N_res.json）")
         return
 
-    for (parent_rel, stem), files in sorted(groups.items()):
-        parent_dir = out_dir / parent_rel if parent_rel else out_dir
-        md_list = sorted(files["md"], key=lambda x: x[0])
-        json_list = sorted(files["json"], key=lambda x: x[0])
-
-        if md_list:
-            parts = []
-            for idx, path in md_list:
-                text = path.read_text(encoding="utf-8").strip()
-                if add_page_break and parts:
-                    parts.append("\n\n---\n\n## 第 {} 页\n\n".format(idx + 1))
-                parts.append(text)
-            merged_md = "\n\n".join(parts)
-            out_md = parent_dir / f"{stem}_merged.md"
-            out_md.write_text(merged_md, encoding="utf-8")
-            print(f"  MD: {parent_rel or '.'}/{stem}_merged.md ({len(md_list)} 页)")
-
-        if json_list:
-            pages = []
-            for _idx, path in json_list:
-                with open(path, "r", encoding="utf-8") as fp:
-                    pages.append(json.load(fp))
-            merged_json = {"pages": pages, "source_stem": stem}
-            out_json = parent_dir / f"{stem}_merged.json"
-            with open(out_json, "w", encoding="utf-8") as fp:
-                json.dump(merged_json, fp, ensure_ascii=False, indent=2)
-            print(f"  JSON: {parent_rel or '.'}/{stem}_merged.json ({len(json_list)} 页)")
-
-        # 合并成功后删除原分页文件
-        for _idx, path in md_list:
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = [
+            pool.submit(_merge_group, out_dir, parent_rel, stem, files, add_page_break, fmt)
+            for (parent_rel, stem), files in sorted(groups.items())
+        ]
+        for future in futures:
             try:
-                path.unlink()
-            except OSError as e:
-                print(f"  删除失败 {path}: {e}")
-        for _idx, path in json_list:
+                for line in future.result():
+                    print(line)
+            except (OSError, json.JSONDecodeError) as e:
+                print(f"  合并失败: {e}")
+
+
+def _file_sha256(path: Path) -> str:
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def _done_marker(out_dir: Path, relpath: str) -> Path:
+    rel = Path(relpath)
+    return out_dir / rel.parent / f".{rel.stem}{DONE_SUFFIX}"
+
+
+def _load_ocr_manifest(out_dir: Path) -> dict[str, dict]:
+    try:
+        return json.loads((out_dir / OCR_MANIFEST_NAME).read_text(encoding="utf-8"))
+    except (OSError, json.JSONDecodeError):
+        return {}
+
+
+def _save_ocr_manifest(out_dir: Path, manifest: dict[str, dict]) -> None:
+    path = out_dir / OCR_MANIFEST_NAME
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    tmp.write_text(json.dumps(manifest, ensure_ascii=False, indent=2, sort_keys=True), encoding="utf-8")
+    os.replace(tmp, path)
+
+
+def _is_ocr_done(out_dir: Path, relpath: str, digest: str, manifest: dict[str, dict]) -> bool:
+    """清单记录的哈希一致，或完成标记（上次中断前已写出）内容一致，即视为已识别。"""
+    entry = manifest.get(relpath)
+    if entry is not None and entry.get("sha256") == digest:
+        return True
+    marker = _done_marker(out_dir, relpath)
+    try:
+        return marker.read_text(encoding="utf-8").strip() == digest
+    except OSError:
+        return False
+
+
+def _init_worker() -> None:
+    """每个工作进程只加载一次 PaddleOCRVL 模型。"""
+    global _pipeline
+    if _pipeline is None:
+        _pipeline = PaddleOCRVL()
+
+
+def _ocr_one(story_path: Path, out_dir: Path, relpath: str, digest: str) -> dict:
+    """识别单个 PDF 并逐页保存结果，全部完成后写完成标记。返回本次识别的统计信息。"""
+    _init_worker()
+    sub_out = out_dir / Path(relpath).parent
+    sub_out.mkdir(parents=True, exist_ok=True)
+    marker = _done_marker(out_dir, relpath)
+    marker.unlink(missing_ok=True)
+    start = last = time.perf_counter()
+    page_seconds = []
+    for res in _pipeline.predict(input=str(story_path / relpath)):
+        res.save_to_json(save_path=str(sub_out))
+        res.save_to_markdown(save_path=str(sub_out))
+        now = time.perf_counter()
+        page_seconds.append(round(now - last, 3))
+        last = now
+    marker.write_text(digest, encoding="utf-8")
+    return {
+        "sha256": digest,
+        "pages": len(page_seconds),
+        "seconds": round(time.perf_counter() - start, 3),
+        "page_seconds": page_seconds,
+    }
+
+
+def run_ocr(story_id: str, workers: int = 1, force: bool = False) -> None:
+    """
+    对 stories/<id> 下 PDF 做 PaddleOCRVL 识别，按文件分片到 workers 个进程。
+    源文件哈希与清单或完成标记一致的 PDF 跳过，中断后重跑会从未完成的文件继续。
+    """
+    story_path = PROJECT_ROOT / "stories" / story_id
+    if not story_path.is_dir():
+        print(f"目录不存在: {story_path}")
+        exit(1)
+
+    out_dir = story_path / "output"
+    out_dir.mkdir(parents=True, exist_ok=True)
+    # OCR 输出目录不含 PDF，直接跳过；目录列表按 mtime 缓存，未变化的目录不再读取
+    cache = ScanCache(out_dir / SCAN_CACHE_NAME)
+    pdf_list = scan_files(story_path, ".pdf", recursive=True, prune={"output"}, cache=cache)
+    cache.save()
+    if not pdf_list:
+        print("未找到 PDF 文件")
+        exit(0)
+    manifest = {} if force else _load_ocr_manifest(out_dir)
+
+    todo = []
+    for item in pdf_list:
+        relpath = item["relpath"]
+        digest = _file_sha256(story_path / relpath)
+        if not force and _is_ocr_done(out_dir, relpath, digest, manifest):
+            print(f"  跳过（已识别）: {relpath}")
+            continue
+        todo.append((relpath, digest))
+    if not todo:
+        print("所有 PDF 均已识别")
+        return
+
+    print(f"待识别 {len(todo)} 个 PDF，进程数 {workers}")
+    wall_start = time.perf_counter()
+    total_pages = 0
+    failed = 0
+
+    def finish(i: int, relpath: str, result: dict | None, error: Exception | None) -> None:
+        nonlocal total_pages, failed
+        if error is not None:
+            failed += 1
+            print(f"[{i}/{len(todo)}] {relpath}\n  解析失败: {error}")
+            return
+        manifest[relpath] = result
+        _save_ocr_manifest(out_dir, manifest)
+        total_pages += result["pages"]
+        per_page = result["seconds"] / result["pages"] if result["pages"] else 0.0
+        print(f"[{i}/{len(todo)}] {relpath}  {result['pages']} 页  "
+              f"{result['seconds']:.1f} 秒  平均 {per_page:.2f} 秒/页")
+
+    if workers <= 1:
+        for i, (relpath, digest) in enumerate(todo, 1):
             try:
-                path.unlink()
-            except OSError as e:
-                print(f"  删除失败 {path}: {e}")
+                finish(i, relpath, _ocr_one(story_path, out_dir, relpath, digest), None)
+            except Exception as e:
+                finish(i, relpath, None, e)
+    else:
+        # PaddlePaddle 不保证 fork 安全，使用 spawn 启动工作进程
+        ctx = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=workers, mp_context=ctx, initializer=_init_worker) as pool:
+            futures = {pool.submit(_ocr_one, story_path, out_dir, relpath, digest): relpath
+                       for relpath, digest in todo}
+            for i, future in enumerate(as_completed(futures), 1):
+                error = future.exception()
+                finish(i, futures[future], None if error else future.result(), error)
+
+    wall = time.perf_counter() - wall_start
+    print(f"完成 {len(todo) - failed}/{len(todo)} 个 PDF，共 {total_pages} 页，"
+          f"耗时 {wall:.1f} 秒，吞吐 {total_pages / wall if wall else 0:.2f} 页/秒")
 
 
 def run_clean(story_id: str) -> None:
@@ -135,6 +367,9 @@ def main():
     # 默认：对 stories/<id> 下 PDF 做 PaddleOCRVL 识别
     parser_ocr = sub.add_parser("ocr", help="对剧本目录下 PDF 进行 OCR（默认子命令）")
     parser_ocr.add_argument("--id", default="shou_huo_ri", help="剧本 ID")
+    parser_ocr.add_argument(
+        "--workers", type=int, default=1, help="OCR 进程数，每个进程各加载一份模型")
+    parser_ocr.add_argument("--force", action="store_true", help="忽略清单，全部重新识别")
 
     # merge：合并 output 下同 stem 的分页 md/json
     parser_merge = sub.add_parser("merge", help="合并 output 下 PaddleOCRVL 分页结果为单个文件")
@@ -144,6 +379,15 @@ def main():
         action="store_true",
         help="合并 MD 时不插入「第 N 页」分隔",
     )
+    parser_merge.add_argument(
+        "--format", choices=["json", "jsonl"], default="json", help="合并 JSON 的输出格式（jsonl 为每行一页）")
+    parser_merge.add_argument("--workers", type=int, default=4, help="并行合并的组数")
+
+    # compile：把合并结果编译为 data/story__<id>.json
+    parser_compile = sub.add_parser("compile", help="把 merge 后的结果编译为剧本 JSON（见 story_compile.py）")
+    parser_compile.add_argument("--id", default="shou_huo_ri", help="剧本 ID")
+    parser_compile.add_argument("--force", action="store_true", help="忽略缓存，全部重新编译")
+    parser_compile.add_argument("--overwrite", action="store_true", help="覆盖 data 目录下已存在的剧本")
 
     # clean：清除 output 下所有 json 文件
     parser_clean = sub.add_parser("clean", help="清除指定剧本 output 目录下所有 JSON 文件")
@@ -154,41 +398,18 @@ def main():
     command = args.command if args.command else "ocr"
 
     if command == "merge":
-        run_merge(story_id, add_page_break=not getattr(args, "no_page_break", False))
+        run_merge(story_id, add_page_break=not getattr(args, "no_page_break", False),
+                  fmt=args.format, workers=args.workers)
         return
+    if command == "compile":
+        from story_compile import run_compile
+        exit(run_compile(story_id, force=args.force, overwrite=args.overwrite))
     if command == "clean":
         run_clean(story_id)
         return
 
     # 默认 OCR 流程
-    story_path = PROJECT_ROOT / "stories" / story_id
-    if not story_path.is_dir():
-        print(f"目录不存在: {story_path}")
-        exit(1)
-
-    pdf_list = scan_files(story_path, ".pdf", recursive=True)
-    if not pdf_list:
-        print("未找到 PDF 文件")
-        exit(0)
-
-    pipeline = PaddleOCRVL()
-    out_dir = story_path / "output"
-    out_dir.mkdir(parents=True, exist_ok=True)
-
-    for i, item in enumerate(pdf_list, 1):
-        name, relpath = item["name"], item["relpath"]
-        full_path = story_path / relpath
-        print(f"[{i}/{len(pdf_list)}] {relpath}")
-        try:
-            output = pipeline.predict(input=str(full_path))
-            for res in output:
-                stem = Path(relpath).stem
-                sub_out = out_dir / Path(relpath).parent
-                sub_out.mkdir(parents=True, exist_ok=True)
-                res.save_to_json(save_path=str(sub_out))
-                res.save_to_markdown(save_path=str(sub_out))
-        except Exception as e:
-            print(f"  解析失败: {e}")
+    run_ocr(story_id, workers=getattr(args, "workers", 1), force=getattr(args, "force", False))
 
 
 if __name__ == "__main__":
@@ -1,7 +1,116 @@
 """脚本工具函数。"""
 
+import json
+import os
 from pathlib import Path
-from typing import Union
+from typing import Callable, Iterator, Optional, Union
+
+Suffixes = Union[str, list[str], tuple[str, ...], None]
+Prune = Union[set[str], frozenset[str], Callable[[str, str], bool], None]
+
+
+def _suffix_set(suffix: Suffixes) -> Optional[frozenset[str]]:
+    """把后缀参数规范为小写、带点号的集合；None 表示不过滤。"""
+    if suffix is None:
+        return None
+    if isinstance(suffix, str):
+        suffix = [suffix]
+    return frozenset((s if s.startswith(".") else f".{s}").lower() for s in suffix)
+
+
+class ScanCache:
+    """
+    目录列表缓存：{目录: (mtime_ns, 文件名列表, 子目录名列表)}。
+    目录内新增、删除、重命名条目都会改变该目录的 mtime，mtime 不变时直接复用上次的列表。
+    给出 path 时可通过 save() 持久化，供下次运行使用。
+    """
+
+    def __init__(self, path: Union[str, Path, None] = None):
+        self.path = Path(path) if path else None
+        self.dirs: dict[str, tuple[int, list[str], list[str]]] = {}
+        self.hits = 0
+        self.misses = 0
+        if self.path is not None:
+            try:
+                data = json.loads(self.path.read_text(encoding="utf-8"))
+                self.dirs = {k: (v[0], v[1], v[2]) for k, v in data.items()}
+            except (OSError, json.JSONDecodeError, IndexError, TypeError):
+                self.dirs = {}
+
+    def listing(self, directory: str) -> tuple[list[str], list[str]]:
+        """返回 (文件名列表, 子目录名列表)。"""
+        mtime = os.stat(directory).st_mtime_ns
+        cached = self.dirs.get(directory)
+        if cached is not None and cached[0] == mtime:
+            self.hits += 1
+            return cached[1], cached[2]
+        self.misses += 1
+        files, subdirs = _list_dir(directory)
+        self.dirs[directory] = (mtime, files, subdirs)
+        return files, subdirs
+
+    def save(self) -> None:
+        if self.path is None:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_name(f".{self.path.name}.{os.getpid()}.tmp")
+        tmp.write_text(json.dumps(self.dirs, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp, self.path)
+
+
+def _list_dir(directory: str) -> tuple[list[str], list[str]]:
+    files, subdirs = [], []
+    with os.scandir(directory) as it:
+        for entry in it:
+            # is_dir / is_file 优先使用 scandir 已读到的类型信息，通常无需额外 stat
+            if entry.is_dir(follow_symlinks=False):
+                subdirs.append(entry.name)
+            elif entry.is_file():
+                files.append(entry.name)
+    return files, subdirs
+
+
+def iter_files(
+    root: Union[str, Path],
+    suffix: Suffixes = None,
+    *,
+    recursive: bool = True,
+    prune: Prune = None,
+    cache: Optional[ScanCache] = None,
+) -> Iterator[str]:
+    """
+    基于 os.scandir 遍历 root 下的文件，逐个产出相对于 root 的 POSIX 路径。
+
+    Args:
+        root: 根目录路径。
+        suffix: 后缀，如 ".json" 或 [".json", ".py"]，可带或不带点号，不区分大小写；None 表示全部文件。
+        recursive: 是否递归子目录，默认 True。
+        prune: 跳过的子目录：目录名集合，或 callable(父目录相对路径, 目录名) 返回 True 时跳过。
+        cache: 目录列表缓存，目录 mtime 未变时不再读取目录。
+    """
+    root = os.path.abspath(root)
+    if not os.path.isdir(root):
+        return
+    suffixes = _suffix_set(suffix)
+    if prune is None:
+        skip = None
+    elif callable(prune):
+        skip = prune
+    else:
+        names = frozenset(prune)
+        skip = lambda _parent, name: name in names  # noqa: E731
+    stack = [("", root)]
+    while stack:
+        rel, directory = stack.pop()
+        files, subdirs = cache.listing(directory) if cache is not None else _list_dir(directory)
+        for name in files:
+            if suffixes is None or os.path.splitext(name)[1].lower() in suffixes:
+                yield f"{rel}/{name}" if rel else name
+        if recursive:
+            for name in reversed(subdirs):
+                if skip is not None and skip(rel, name):
+                    continue
+                stack.append((f"{rel}/{name}" if rel else name, os.path.join(directory, name)))
 
 
 def scan_files(
@@ -9,6 +118,8 @@ def scan_files(
     suffix: Union[str, list[str]],
     *,
     recursive: bool = True,
+    prune: Prune = None,
+    cache: Optional[ScanCache] = None,
 ) -> list[dict]:
     """
     扫描指定路径下所有指定后缀的文件。
@@ -17,26 +128,13 @@ def scan_files(
         root: 根目录路径。
         suffix: 后缀，如 ".json" 或 [".json", ".py"]。可带或不带点号。
         recursive: 是否递归子目录，默认 True。
+        prune: 跳过的子目录，见 iter_files。
+        cache: 目录列表缓存，见 iter_files。
 
     Returns:
-        列表，每项为 {"name": 文件名, "relpath": 相对于 root 的路径}。
+        列表，每项为 {"name": 文件名, "relpath": 相对于 root 的路径}，按 relpath 排序。
     """
-    root = Path(root).resolve()
-    if not root.is_dir():
-        return []
-    if isinstance(suffix, str):
-        suffix = [suffix]
-    suffixes = [s if s.startswith(".") else f".{s}" for s in suffix]
-    result = []
-    it = root.rglob("*") if recursive else root.iterdir()
-    for p in it:
-        if not p.is_file():
-            continue
-        if p.suffix.lower() not in [s.lower() for s in suffixes]:
-            continue
-        try:
-            rel = p.relative_to(root)
-        except ValueError:
-            continue
-        result.append({"name": p.name, "relpath": rel.as_posix()})
-    return result
+    return [
+        {"name": relpath.rsplit("/", 1)[-1], "relpath": relpath}
+        for relpath in sorted(iter_files(root, suffix, recursive=recursive, prune=prune, cache=cache))
+    ]
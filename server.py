@@ -1,36 +1,69 @@
-"""剧本信息展示网站：首页列出剧本，详情页展示场景与角色。"""
+"""
+剧本信息展示网站：首页列出剧本，详情页展示场景与角色，观战页通过 SSE 实时展示对局输出。
+/api/sessions 下为对局服务接口：一个网站进程在同一事件循环中托管多局游戏（见 sessions.py）。
+"""
 
+import argparse
+import hashlib
 import json
+import os
+import shutil
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
 from pathlib import Path
+from typing import Callable
 
-from flask import Flask, abort, render_template, send_from_directory
+from flask import Flask, Response, abort, jsonify, render_template, request, send_from_directory
+from werkzeug.http import is_resource_modified
+
+from events import bus, sse_format
+from store.compiled import CompiledStory
+from store.model import Scene, Step, StoryError
+from store.stories import repository
+from thumbnails import THUMBS_DIRNAME, resolve_thumbnail, source_signature, thumbnail_url
 
 app = Flask(__name__)
-# 剧本 JSON 在 data 目录；results 按 story_id 分子目录
+app.jinja_env.globals["thumbnail_url"] = thumbnail_url
+# 剧本 JSON 在 data 目录，由 store.stories 仓库读取并缓存；results 按 story_id 分子目录
 PROJECT_ROOT = Path(__file__).resolve().parent
-DATA_DIR = PROJECT_ROOT / "data"
 RESULTS_DIR = PROJECT_ROOT / "results"
+TEMPLATES_DIR = PROJECT_ROOT / "templates"
+# 渲染结果 LRU 缓存的条目上限
+RENDER_CACHE_SIZE = 64
+# 缩略图文件名含源文件哈希，内容不会变化，可长期缓存
+THUMBNAIL_MAX_AGE = 365 * 24 * 3600
+# SSE 空闲时发送注释行的间隔（秒），防止代理断开长连接
+SSE_KEEPALIVE = 15
+# 对局服务使用的模型配置（同 story_roadmap 的 --config）
+GAME_CONFIG = os.environ.get("GAME_CONFIG", "config.yaml")
+
+_render_cache: "OrderedDict[tuple, str]" = OrderedDict()
+_render_lock = threading.Lock()
+_game_service = None
+_game_service_lock = threading.Lock()
+
+
+def _story_summary(story_id: str) -> dict:
+    """由编译后的剧本取名称与数量，不解析 JSON。"""
+    story = repository.story(story_id)
+    counts = story.counts()
+    return {
+        "id": story_id,
+        "name": story.name or story_id,
+        "cover_url": f"/results/{story_id}/covers/{story_id}.jpg",
+        "character_count": counts["characters"],
+        "scene_count": counts["scenes"],
+    }
 
 
 def scan_stories() -> list[dict]:
-    """扫描 data 目录下所有 story__*.json，返回 [{id, name, cover_url, character_count, scene_count}, ...]。"""
+    """列出 data 目录下所有 story__*.json，返回 [{id, name, cover_url, character_count, scene_count}, ...]。"""
     result = []
-    if not DATA_DIR.is_dir():
-        return result
-    for path in sorted(DATA_DIR.glob("story__*.json")):
+    for story_id in repository.list_ids():
         try:
-            data = json.loads(path.read_text(encoding="utf-8"))
-            story_id = path.stem.replace("story__", "", 1)
-            characters = data.get("characters") or []
-            scenes = data.get("scenes") or data.get("master") or []
-            result.append({
-                "id": story_id,
-                "name": data.get("name", story_id),
-                "cover_url": f"/results/{story_id}/covers/{story_id}.jpg",
-                "character_count": len(characters),
-                "scene_count": len(scenes),
-            })
-        except (json.JSONDecodeError, OSError):
+            result.append(_story_summary(story_id))
+        except (json.JSONDecodeError, OSError, StoryError):
             continue
     return result
 
@@ -39,91 +72,110 @@ def scan_stories() -> list[dict]:
 STEP_TYPE_LABELS = {"memory": "【自动上下文】", "user": "【用户提示词】"}
 
 
-def _extract_step_blocks(step) -> list[dict]:
-    """从单个 step 中按 type 拆成块，返回 [{ type, label, lines }, ...]。"""
-    blocks = []
-    if isinstance(step, list):
-        for item in step:
-            if not isinstance(item, dict) or "value" not in item:
-                continue
-            lines = [v for v in item["value"] if isinstance(v, str)]
-            if not lines:
-                continue
-            t = item.get("type") or "memory"
-            blocks.append({
-                "type": t,
-                "label": STEP_TYPE_LABELS.get(t, f"【{t}】"),
-                "lines": lines,
-            })
-    elif isinstance(step, dict):
-        lines = []
-        if "value" in step:
-            lines.extend(v for v in step["value"] if isinstance(v, str))
-        if "prompts" in step:
-            for p in step["prompts"]:
-                if isinstance(p, dict) and "value" in p:
-                    lines.extend(v for v in p["value"] if isinstance(v, str))
-                elif isinstance(p, str):
-                    lines.append(p)
-        if "tasks" in step:
-            lines.extend(t for t in step["tasks"] if isinstance(t, str))
-        if lines:
-            t = step.get("type") or "memory"
-            blocks.append({
-                "type": t,
-                "label": STEP_TYPE_LABELS.get(t, f"【{t}】"),
-                "lines": lines,
-            })
-    return blocks
-
-
-def _build_scene_steps_display(scene: dict) -> list[dict]:
+def _extract_step_blocks(step: Step) -> list[dict]:
+    """把单个 step 的各块转为 [{ type, label, lines }, ...]。"""
+    return [
+        {"type": b.type, "label": STEP_TYPE_LABELS.get(b.type, f"【{b.type}】"), "lines": list(b.lines)}
+        for b in step.blocks
+    ]
+
+
+def _build_scene_steps_display(scene: Scene) -> list[dict]:
     """将场景的 steps 转为 [{ blocks: [{ type, label, lines }, ...] }, ...]，每个 step 可含多块。"""
-    steps = scene.get("steps") or []
-    result = []
-    for step in steps:
-        blocks = _extract_step_blocks(step)
-        if blocks:
-            result.append({"blocks": blocks})
-    # 兼容旧版：无 steps 但有 prompts 时视为一个步骤，单块为自动上下文
-    if not result and scene.get("prompts"):
-        prompts = [p for p in scene["prompts"] if isinstance(p, str)]
-        if prompts:
-            result.append({
-                "blocks": [{"type": "memory", "label": STEP_TYPE_LABELS["memory"], "lines": prompts}],
-            })
-    return result
+    return [{"blocks": _extract_step_blocks(step)} for step in scene.steps]
 
 
-def load_story(story_id: str) -> dict:
-    """加载 data 目录下单个剧本 JSON，不存在或无效则 abort 404。统一使用 scenes 字段并规范化展示。"""
-    path = DATA_DIR / f"story__{story_id}.json"
-    if not path.is_file():
-        abort(404)
-    try:
-        data = json.loads(path.read_text(encoding="utf-8"))
-    except (json.JSONDecodeError, OSError):
-        abort(404)
-    # 场景：优先 scenes，兼容旧版 master
-    raw_scenes = data.get("scenes") or data.get("master") or []
+def _normalize_story(story_id: str, story: CompiledStory) -> dict:
+    """统一使用 scenes 字段并规范化展示；场景取自编译后剧本的模型（兼容旧版 master / prompts）。"""
     scenes = []
-    for s in raw_scenes:
+    for s in story.model(story_id).scenes:
         scenes.append({
-            "id": s.get("id"),
-            "name": s.get("name") or "",
+            "id": s.id,
+            "name": s.name,
             "steps_display": _build_scene_steps_display(s),
-            "notes": s.get("notes") or [],
-            "choices": s.get("choices") or {},
+            "notes": list(s.notes),
+            "choices": {key: {"description": c.description, "next": c.next} for key, c in s.choices.items()},
         })
-    data["scenes"] = scenes
-    data["cover_url"] = f"/results/{story_id}/covers/{story_id}.jpg"
-    return data
+    return {
+        **story.to_dict(),
+        "scenes": scenes,
+        "cover_url": f"/results/{story_id}/covers/{story_id}.jpg",
+    }
+
+
+def load_story(story_id: str) -> dict:
+    """加载 data 目录下单个剧本（经仓库缓存），不存在或无效则 abort 404。"""
+    try:
+        return repository.view(story_id, "detail", _normalize_story)
+    except (json.JSONDecodeError, OSError, StoryError):
+        abort(404)
+
+
+def _template_mtime(name: str) -> int:
+    return (TEMPLATES_DIR / name).stat().st_mtime_ns
+
+
+def _render_cached(name: str, key: tuple, build_context: Callable[[], dict]) -> str:
+    """渲染模板，输出按 (模板, 模板 mtime, key) 缓存，超过 RENDER_CACHE_SIZE 时淘汰最久未用的。"""
+    cache_key = (name, _template_mtime(name), key)
+    with _render_lock:
+        html = _render_cache.get(cache_key)
+        if html is not None:
+            _render_cache.move_to_end(cache_key)
+            return html
+    html = render_template(name, **build_context())
+    with _render_lock:
+        _render_cache[cache_key] = html
+        while len(_render_cache) > RENDER_CACHE_SIZE:
+            _render_cache.popitem(last=False)
+    return html
+
+
+def _cached_page(name: str, key: tuple, modified: float, build_context: Callable[[], dict]) -> Response:
+    """
+    返回带强 ETag 与 Last-Modified 的页面，条件请求命中时直接 304，不再渲染。
+    ETag 由模板 mtime 与 key（包含剧本文件内容哈希与页面所用原图的签名）派生。
+    """
+    mtime_ns = _template_mtime(name)
+    etag = hashlib.sha256(repr((name, mtime_ns, key)).encode("utf-8")).hexdigest()[:32]
+    last_modified = datetime.fromtimestamp(max(modified, mtime_ns / 1e9), tz=timezone.utc)
+    if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        response = Response(status=304)
+    else:
+        response = Response(_render_cached(name, key, build_context), mimetype="text/html")
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    response.cache_control.no_cache = True
+    return response
 
 
 @app.route("/")
 def index():
-    stories = scan_stories()
-    return render_template("index.html", stories=stories)
+    story_ids = repository.list_ids()
+    key = []
+    modified = 0.0
+    for story_id in story_ids:
+        try:
+            images, images_modified = source_signature(story_id, ("covers",))
+            key.append((story_id, repository.digest(story_id), images))
+            modified = max(modified, repository.modified(story_id), images_modified)
+        except (json.JSONDecodeError, OSError, StoryError):
+            continue
+    return _cached_page("index.html", tuple(key), modified, lambda: {"stories": scan_stories()})
+
+
+@app.route(f"/results/<story_id>/characters/{THUMBS_DIRNAME}/<name>", defaults={"kind": "characters"})
+@app.route(f"/results/<story_id>/covers/{THUMBS_DIRNAME}/<name>", defaults={"kind": "covers"})
+@app.route(f"/results/<story_id>/scenes/{THUMBS_DIRNAME}/<name>", defaults={"kind": "scenes"})
+def thumbnail(story_id: str, kind: str, name: str):
+    """提供缩略图，首次请求时生成。"""
+    path = resolve_thumbnail(story_id, kind, name)
+    if path is None:
+        abort(404)
+    response = send_from_directory(path.parent, path.name, max_age=THUMBNAIL_MAX_AGE)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
 
 
 @app.route("/results/<story_id>/characters/<path:filename>")
@@ -146,9 +198,178 @@ def cover_image(story_id: str, filename: str):
 
 @app.route("/story/<story_id>")
 def story_detail(story_id: str):
-    story = load_story(story_id)
-    return render_template("detail.html", story_id=story_id, story=story)
+    try:
+        images, images_modified = source_signature(story_id, ("covers", "characters"))
+        key = (story_id, repository.digest(story_id), images)
+        modified = max(repository.modified(story_id), images_modified)
+    except (json.JSONDecodeError, OSError, StoryError):
+        abort(404)
+    return _cached_page("detail.html", key, modified,
+                        lambda: {"story_id": story_id, "story": load_story(story_id)})
+
+
+def _sse_response(channel: str) -> Response:
+    """订阅 channel 的事件流（text/event-stream）；断线重连按 Last-Event-ID 补发。"""
+    last_id = request.headers.get("Last-Event-ID", type=int) or request.args.get("last_id", 0, type=int)
+
+    def stream():
+        with bus.subscribe(channel, last_id) as subscription:
+            yield "retry: 2000\n\n"
+            while True:
+                event = subscription.get(timeout=SSE_KEEPALIVE)
+                yield sse_format(event) if event is not None else ": keepalive\n\n"
+
+    return Response(stream(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.route("/events/<channel>")
+def live_events(channel: str):
+    """对局事件流：token 为流式增量，replace 为改写后的整段文本，reply 为完整发言。"""
+    return _sse_response(channel)
+
+
+@app.route("/live/<channel>")
+def live_page(channel: str):
+    return render_template("live.html", channel=channel)
+
+
+def _service():
+    """对局服务（首次调用时创建），依赖 agentscope，只在使用对局接口时导入。"""
+    global _game_service
+    with _game_service_lock:
+        if _game_service is None:
+            import yaml
+            from sessions import GameService
+            with open(GAME_CONFIG, "r") as f:
+                _game_service = GameService(yaml.safe_load(f))
+        return _game_service
+
+
+# 创建对局时请求体可带的参数，含义同 story_roadmap 的命令行参数
+SESSION_OPTIONS = ("session_id", "humans", "autostart", "turn_mode", "concurrency", "reply_mode",
+                   "context_budget", "initial_money", "star_cost")
+
+
+def _session_call(fn: Callable, *args, status: int = 200, **kwargs) -> tuple[Response, int]:
+    """
+    调用对局服务并转为 JSON 响应：对局或剧本不存在返回 404，参数或操作不合法返回 400，
+    对局服务在 CALL_TIMEOUT 内没有响应返回 504。
+    """
+    from pydantic import ValidationError
+    from sessions import SessionError, SessionNotFound
+    try:
+        return jsonify(fn(*args, **kwargs)), status
+    except TimeoutError:
+        # TimeoutError 是 OSError 的子类，需在其之前处理
+        return jsonify(error="对局服务响应超时"), 504
+    except (SessionNotFound, OSError, StoryError) as e:
+        return jsonify(error=str(e)), 404
+    except ValidationError as e:
+        return jsonify(error=e.errors(include_url=False)), 400
+    except (SessionError, ValueError) as e:
+        return jsonify(error=str(e)), 400
+
+
+@app.route("/api/sessions", methods=["GET"])
+def list_sessions():
+    return _session_call(_service().list_sessions)
+
+
+@app.route("/api/sessions", methods=["POST"])
+def create_session():
+    """创建对局，请求体 {story_id, humans: [由真人操控的角色 ID], ...SESSION_OPTIONS}，默认立即开始。"""
+    body = request.get_json(silent=True) or {}
+    if not body.get("story_id"):
+        return jsonify(error="缺少 story_id"), 400
+    options = {k: body[k] for k in SESSION_OPTIONS if k in body}
+    return _session_call(_service().create, body["story_id"], status=201, **options)
+
+
+@app.route("/api/sessions/<session_id>", methods=["GET"])
+def get_session(session_id: str):
+    return _session_call(_service().get, session_id)
+
+
+@app.route("/api/sessions/<session_id>", methods=["DELETE"])
+def stop_session(session_id: str):
+    return _session_call(_service().stop, session_id)
+
+
+@app.route("/api/sessions/<session_id>/pause", methods=["POST"])
+def pause_session(session_id: str):
+    """当前发言结束后暂停。"""
+    return _session_call(_service().pause, session_id)
+
+
+@app.route("/api/sessions/<session_id>/resume", methods=["POST"])
+def resume_session(session_id: str):
+    return _session_call(_service().resume, session_id)
+
+
+@app.route("/api/sessions/<session_id>/moves", methods=["POST"])
+def post_move(session_id: str):
+    """真人玩家提交一步，请求体 {character_id, speech, vote?, props?, gives?, transfers?}（同 PlayerAction）。"""
+    body = request.get_json(silent=True) or {}
+    character_id = body.pop("character_id", "")
+    if not character_id:
+        return jsonify(error="缺少 character_id"), 400
+    return _session_call(_service().move, session_id, character_id, body, status=202)
+
+
+@app.route("/api/sessions/<session_id>/events")
+def session_events(session_id: str):
+    """对局事件流：除 token / reply 外，还有 status（状态变化）与 turn（轮到真人玩家）事件。"""
+    result = _session_call(_service().get, session_id)
+    if result[1] != 200:
+        return result
+    return _sse_response(result[0].json["channel"])
+
+
+def export_site(out_dir: Path) -> None:
+    """
+    将整站导出为静态 HTML：index.html、story/<id>/index.html 以及 results 下的图片，
+    可直接由 nginx 提供（/story/<id> 需配置 try_files $uri $uri/index.html）。
+    """
+    out_dir.mkdir(parents=True, exist_ok=True)
+    # 缩略图平时在首次请求时才生成，导出时记下页面引用的每个规格，预先生成后随 results 一起复制
+    thumbnails: dict[tuple[str, str, str], None] = {}
+
+    def _export_thumbnail_url(story_id: str, kind: str, stem: str, width: int, fmt: str = "webp") -> str:
+        url = thumbnail_url(story_id, kind, stem, width, fmt)
+        if url:
+            thumbnails[(story_id, kind, url.rsplit("/", 1)[1])] = None
+        return url
+
+    with app.test_request_context():
+        stories = scan_stories()
+        (out_dir / "index.html").write_text(
+            render_template("index.html", stories=stories, thumbnail_url=_export_thumbnail_url), encoding="utf-8")
+        print(f"  index.html ({len(stories)} 个剧本)")
+        for s in stories:
+            story_dir = out_dir / "story" / s["id"]
+            story_dir.mkdir(parents=True, exist_ok=True)
+            html = render_template("detail.html", story_id=s["id"], story=load_story(s["id"]),
+                                   thumbnail_url=_export_thumbnail_url)
+            (story_dir / "index.html").write_text(html, encoding="utf-8")
+            print(f"  story/{s['id']}/index.html")
+    generated = sum(resolve_thumbnail(story_id, kind, name) is not None for story_id, kind, name in thumbnails)
+    print(f"  缩略图 {generated}/{len(thumbnails)}")
+    if RESULTS_DIR.is_dir():
+        # 生成缓存与生成记录只供本机使用，不发布
+        shutil.copytree(RESULTS_DIR, out_dir / "results", dirs_exist_ok=True,
+                        ignore=shutil.ignore_patterns(".cache", ".generations.json"))
+        print("  results/")
 
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5000, debug=True)
+    parser = argparse.ArgumentParser(description="剧本信息展示网站")
+    sub = parser.add_subparsers(dest="command", required=False, help="子命令")
+    sub.add_parser("serve", help="启动网站（默认子命令）")
+    parser_export = sub.add_parser("export", help="导出整站静态 HTML")
+    parser_export.add_argument("--out", default="site", help="输出目录")
+    args = parser.parse_args()
+    if args.command == "export":
+        export_site(Path(args.out))
+    else:
+        app.run(host="0.0.0.0", port=5000, debug=True)
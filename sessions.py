@@ -0,0 +1,367 @@
+"""
+对局服务：在一个后台事件循环中托管多局游戏。
+
+所有对局共享同一个事件循环、entity.model_registry 中的模型客户端池，以及每个剧本一个的
+StoryMemoryPool（按 session_id 分区）；对局进度、状态都在记忆中，暂停或进程重启后可从最后完成的步骤继续。
+网站线程通过 GameService 的同步方法操作对局，方法内部把协程投递到事件循环执行，
+因此对局数据只在事件循环线程上读写。
+"""
+
+import asyncio
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Coroutine, Optional
+
+from agentscope.agent import UserInputBase, UserInputData
+from agentscope.message import Msg, TextBlock
+
+from entity import Character, HumanAgent, PlayerAction
+from events import EventBus, bus, live_channel
+from store.context import ContextBuilder
+from store.memory import StoryMemoryPool
+from store.props import GameState
+from store.model import Story
+from store.stories import repository
+from story_roadmap import (ActionValidator, LiveView, _msg_content, create_characters, create_moderator,
+                           run_scenes)
+
+# 同步方法等待事件循环返回结果的超时（秒）
+CALL_TIMEOUT = 30
+# 停止对局时等待进行中的发言响应中断的时间（秒），超时后才直接取消任务
+STOP_TIMEOUT = 10
+# 已结束（finished / failed / stopped）的对局保留多久（秒）后从服务中移除，期间仍可查看或重新开始
+ENDED_TTL = 600
+TURN_MODES = ("sequential", "concurrent")
+REPLY_MODES = ("structured", "text")
+
+
+class SessionError(ValueError):
+    """对局操作不合法，如角色不存在或对局不在可暂停的状态。"""
+
+
+class SessionNotFound(SessionError):
+    """对局不存在。"""
+
+
+class SessionStopped(Exception):
+    """对局被停止，由 gate 在发言之间抛出，结束 run_scenes。"""
+
+
+def _options(options: dict) -> dict:
+    """校验并规范化对局参数，不合法时抛出 SessionError。"""
+    result = {
+        "turn_mode": options.get("turn_mode", "sequential"),
+        "reply_mode": options.get("reply_mode", "structured"),
+    }
+    if result["turn_mode"] not in TURN_MODES:
+        raise SessionError(f"turn_mode 必须是 {' / '.join(TURN_MODES)}")
+    if result["reply_mode"] not in REPLY_MODES:
+        raise SessionError(f"reply_mode 必须是 {' / '.join(REPLY_MODES)}")
+    for key, default in (("concurrency", 5), ("context_budget", 0), ("initial_money", 0), ("star_cost", 0)):
+        try:
+            value = int(options.get(key, default))
+        except (TypeError, ValueError):
+            raise SessionError(f"{key} 必须是整数") from None
+        if value < 0 or (key == "concurrency" and value < 1):
+            raise SessionError(f"{key} 超出范围: {value}")
+        result[key] = value
+    return result
+
+
+class WebInput(UserInputBase):
+    """网页真人玩家的输入：轮到该玩家时等待下一次提交的 PlayerAction。"""
+
+    def __init__(self):
+        self.moves: asyncio.Queue[PlayerAction] = asyncio.Queue()
+        self.waiting = False
+
+    async def __call__(self, agent_id: str, agent_name: str, *args: Any, structured_model=None,
+                       **kwargs: Any) -> UserInputData:
+        self.waiting = True
+        try:
+            move = await self.moves.get()
+        finally:
+            self.waiting = False
+        return UserInputData(
+            blocks_input=[TextBlock(type="text", text=move.speech)],
+            structured_input=move.model_dump() if structured_model is not None else None,
+        )
+
+
+class GameSession:
+    """一局游戏：角色、对局状态、运行中的任务与暂停开关，只在事件循环线程上访问。"""
+
+    def __init__(self, session_id: str, story_id: str, options: dict):
+        self.id = session_id
+        self.story_id = story_id
+        self.options = options
+        self.channel = live_channel(story_id, session_id)
+        # created / running / paused / finished / failed / stopped
+        self.status = "created"
+        self.error = ""
+        self.created_at = time.time()
+        # 推演任务结束的时间，运行中为 None
+        self.ended_at: Optional[float] = None
+        self.humans: dict[str, WebInput] = {}
+        self.characters: dict[str, Character] = {}
+        self.moderator: Optional[Character] = None
+        self.state: Optional[GameState] = None
+        self.task: Optional[asyncio.Task] = None
+        # set 表示可以继续推演，clear 表示暂停
+        self.running = asyncio.Event()
+        # 停止后 gate 在下一次发言前抛出 SessionStopped
+        self.stopping = False
+
+    async def gate(self) -> None:
+        """run_scenes 在步骤与发言之间调用：暂停时等待，停止时结束推演。"""
+        await self.running.wait()
+        if self.stopping:
+            raise SessionStopped(self.id)
+
+    def info(self) -> dict:
+        return {
+            "id": self.id,
+            "story_id": self.story_id,
+            "status": self.status,
+            "error": self.error,
+            "channel": self.channel,
+            "created_at": self.created_at,
+            "options": self.options,
+            "characters": [
+                {"id": c.id, "name": c.name, "human": c.id in self.humans,
+                 "waiting": c.id in self.humans and self.humans[c.id].waiting}
+                for c in self.characters.values()
+            ],
+            "state": self.state.summary() if self.state is not None else "",
+        }
+
+
+class GameService:
+    """
+    多局对局服务。config 与 story_roadmap 的 config.yaml 相同；
+    max_sessions 限制未结束的对局数，db_dir 为记忆数据库所在目录；
+    已结束的对局不占名额，超过 ended_ttl 秒后移除。
+    """
+
+    def __init__(self, config: dict, db_dir: str | Path = ".", *, max_sessions: int = 64,
+                 ended_ttl: float = ENDED_TTL, event_bus: EventBus = bus):
+        self.config = config
+        self.db_dir = db_dir
+        self.max_sessions = max_sessions
+        self.ended_ttl = ended_ttl
+        self.bus = event_bus
+        self._sessions: dict[str, GameSession] = {}
+        self._pools: dict[str, StoryMemoryPool] = {}
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, name="game-service", daemon=True)
+        self._thread.start()
+
+    def _call(self, coro: Coroutine) -> Any:
+        """在事件循环上执行协程并等待结果。"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result(CALL_TIMEOUT)
+
+    def _session(self, session_id: str) -> GameSession:
+        session = self._sessions.get(session_id)
+        if session is None:
+            raise SessionNotFound(f"对局不存在: {session_id}")
+        return session
+
+    def _evict_ended(self) -> None:
+        """移除结束超过 ended_ttl 的对局，并丢弃其频道历史。"""
+        now = time.time()
+        for session_id, session in list(self._sessions.items()):
+            if session.ended_at is not None and now - session.ended_at > self.ended_ttl:
+                del self._sessions[session_id]
+                self.bus.drop(session.channel)
+
+    def _publish_status(self, session: GameSession) -> None:
+        self.bus.publish(session.channel, "status", session_id=session.id, status=session.status,
+                         error=session.error)
+
+    # ---- 同步接口（供网站线程调用） ----
+
+    def create(self, story_id: str, *, session_id: str = "", humans: list[str] = (), autostart: bool = True,
+               **options: Any) -> dict:
+        """
+        创建对局。humans 为由真人操控的角色 ID；options 同 story_roadmap 的命令行参数：
+        turn_mode、concurrency、reply_mode、context_budget、initial_money、star_cost。
+        同一 session_id 再次创建时从记忆中的进度继续。参数不合法时抛出 SessionError。
+        """
+        return self._call(self._create(story_id, session_id or uuid.uuid4().hex[:12], list(humans),
+                                       autostart, _options(options)))
+
+    def list_sessions(self) -> list[dict]:
+        return self._call(self._list_sessions())
+
+    def get(self, session_id: str) -> dict:
+        return self._call(self._get(session_id))
+
+    def pause(self, session_id: str) -> dict:
+        return self._call(self._pause(session_id))
+
+    def resume(self, session_id: str) -> dict:
+        return self._call(self._resume(session_id))
+
+    def stop(self, session_id: str) -> dict:
+        return self._call(self._stop(session_id))
+
+    def move(self, session_id: str, character_id: str, move: dict) -> dict:
+        """提交真人玩家的一步（PlayerAction 字段），轮到该玩家时使用；提前提交的会排队。"""
+        action = PlayerAction.model_validate(move)
+        return self._call(self._move(session_id, character_id, action))
+
+    def close(self) -> None:
+        self._call(self._close())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(timeout=CALL_TIMEOUT)
+
+    # ---- 事件循环上的实现 ----
+
+    async def _create(self, story_id: str, session_id: str, humans: list[str], autostart: bool,
+                      options: dict) -> dict:
+        # 剧本首次加载要读文件、编译 sqlite，放到线程中避免阻塞其他对局
+        story = await asyncio.to_thread(repository.model, story_id)
+        playable = {c.id for c in story.characters if c.scenes}
+        unknown = [cid for cid in humans if cid not in playable]
+        if unknown:
+            raise SessionError(f"角色不存在: {', '.join(unknown)}")
+        self._evict_ended()
+        if session_id in self._sessions:
+            raise SessionError(f"对局已存在: {session_id}")
+        if sum(s.ended_at is None for s in self._sessions.values()) >= self.max_sessions:
+            raise SessionError(f"对局数已达上限 {self.max_sessions}")
+        session = GameSession(session_id, story_id, options)
+        session.humans = {cid: WebInput() for cid in humans}
+        self._sessions[session_id] = session
+        if autostart:
+            self._start(session, story)
+        return session.info()
+
+    def _human(self, session: GameSession, char: Character) -> Character:
+        """把角色换成由网页输入操控的 HumanAgent，轮到其发言时发布 turn 事件。"""
+        agent = HumanAgent(char.name, session.humans[char.id])
+        agent.on_turn = lambda human, msg: self.bus.publish(
+            session.channel, "turn", character_id=char.id, agent=human.name,
+            prompt=_msg_content(msg) if isinstance(msg, Msg) else "")
+        return Character(self.config["characters"], char.id, char.name, char.system_prompt, agent,
+                         background=char.background)
+
+    def _start(self, session: GameSession, story: Story) -> None:
+        pool = self._pools.get(session.story_id)
+        if pool is None:
+            pool = self._pools[session.story_id] = StoryMemoryPool(session.story_id, self.db_dir)
+        memory = pool.session(session.id)
+        options = session.options
+        # 每次启动都新建智能体与状态，由 run_scenes 从记忆恢复进度和状态
+        characters = create_characters(story.characters, self.config,
+                                       background_in_prompt=options["context_budget"] <= 0)
+        session.characters = {cid: self._human(session, c) if cid in session.humans else c
+                              for cid, c in characters.items()}
+        session.state = GameState.from_story(
+            story, initial_money=options["initial_money"], star_cost=options["star_cost"])
+        context = (ContextBuilder(memory, budget=options["context_budget"])
+                   if options["context_budget"] > 0 else None)
+        validator = (ActionValidator(story, session.characters, session.state)
+                     if options["reply_mode"] == "structured" else None)
+        moderator = session.moderator = create_moderator(self.config)
+        view = LiveView(session.channel, self.bus, echo=False)
+        for agent in [moderator.agent, *[c.agent for c in session.characters.values()]]:
+            agent.stream_listener = view
+        session.running.set()
+        session.stopping = False
+        session.ended_at = None
+        session.status = "running"
+        session.error = ""
+        self._publish_status(session)
+
+        async def run() -> None:
+            try:
+                await run_scenes(story, moderator, session.characters, memory,
+                                 turn_mode=options["turn_mode"], concurrency=options["concurrency"],
+                                 context=context, validator=validator, state=session.state,
+                                 gate=session.gate)
+                session.status = "finished"
+            except SessionStopped:
+                session.status = "stopped"
+            except asyncio.CancelledError:
+                session.status = "stopped"
+                raise
+            except Exception as e:
+                session.status = "failed"
+                session.error = f"{type(e).__name__}: {e}"
+            finally:
+                view.close()
+                await memory.flush()
+                session.ended_at = time.time()
+                self._publish_status(session)
+
+        session.task = self.loop.create_task(run())
+
+    async def _list_sessions(self) -> list[dict]:
+        self._evict_ended()
+        return [s.info() for s in self._sessions.values()]
+
+    async def _get(self, session_id: str) -> dict:
+        return self._session(session_id).info()
+
+    async def _pause(self, session_id: str) -> dict:
+        """当前发言结束后暂停。"""
+        session = self._session(session_id)
+        if session.status != "running":
+            raise SessionError(f"对局未在运行: {session.status}")
+        session.running.clear()
+        session.status = "paused"
+        self._publish_status(session)
+        return session.info()
+
+    async def _resume(self, session_id: str) -> dict:
+        """继续暂停的对局；未启动或失败的对局重新启动，从记忆中最后完成的步骤继续。"""
+        session = self._session(session_id)
+        if session.status == "paused":
+            session.running.set()
+            session.status = "running"
+            self._publish_status(session)
+        elif session.status in ("created", "failed"):
+            self._start(session, await asyncio.to_thread(repository.model, session.story_id))
+        elif session.status == "finished":
+            raise SessionError("对局已结束")
+        return session.info()
+
+    async def _stop(self, session_id: str) -> dict:
+        """
+        停止对局：置停止标记并中断进行中的发言，gate 在下一次发言前结束推演，未完成的步骤被丢弃。
+        agentscope 的智能体在 __call__ 内部处理取消，因此用 interrupt() 而不是直接取消任务；
+        只有超过 STOP_TIMEOUT 仍未结束时才取消任务。
+        """
+        session = self._session(session_id)
+        task = session.task
+        if task is not None and not task.done():
+            session.stopping = True
+            session.running.set()
+            agents = [c.agent for c in session.characters.values()]
+            if session.moderator is not None:
+                agents.append(session.moderator.agent)
+            await asyncio.gather(*(agent.interrupt() for agent in agents))
+            await asyncio.wait({task}, timeout=STOP_TIMEOUT)
+            if not task.done():
+                task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        self.bus.drop(session.channel)
+        return self._sessions.pop(session_id).info()
+
+    async def _move(self, session_id: str, character_id: str, action: PlayerAction) -> dict:
+        session = self._session(session_id)
+        web_input = session.humans.get(character_id)
+        if web_input is None:
+            raise SessionError(f"角色 {character_id} 不是真人玩家")
+        web_input.moves.put_nowait(action)
+        return {"queued": web_input.moves.qsize(), "waiting": web_input.waiting}
+
+    async def _close(self) -> None:
+        for session_id in list(self._sessions):
+            await self._stop(session_id)
+        for pool in self._pools.values():
+            pool.close()
+        self._pools.clear()
@@ -0,0 +1,209 @@
+"""编译后的剧本：把剧本 JSON 按角色 / 场景 / 道具拆行写入 SQLite，按 id 懒加载，不必解析整份 JSON。"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Any, Callable, Iterator, Optional
+
+from store.model import Story, StoryError, validate_story
+
+# 编译格式版本，结构变化时递增，旧文件会被重新编译
+FORMAT_VERSION = 1
+
+_SCHEMA = """
+CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE characters (idx INTEGER PRIMARY KEY, id TEXT NOT NULL UNIQUE, name TEXT NOT NULL, body TEXT NOT NULL);
+CREATE TABLE scenes (idx INTEGER PRIMARY KEY, id TEXT, name TEXT NOT NULL, body TEXT NOT NULL);
+CREATE INDEX idx_scenes_id ON scenes(id);
+CREATE TABLE props (idx INTEGER PRIMARY KEY, name TEXT NOT NULL, body TEXT NOT NULL);
+CREATE INDEX idx_props_name ON props(name);
+"""
+
+
+def _signature(path: Path) -> str:
+    st = path.stat()
+    return f"{st.st_mtime_ns}:{st.st_size}"
+
+
+def compile_story(json_path: str | Path, db_path: str | Path) -> None:
+    """
+    把剧本 JSON 编译为 SQLite：每个角色 / 场景 / 道具一行，body 为该条目的 JSON。
+    先用 validate_story 校验，结构不合法（如角色 id 缺失或重复）时抛 StoryError，不写任何文件。
+    先写临时文件再原子替换，读者不会看到写了一半的文件。
+    """
+    json_path, db_path = Path(json_path), Path(db_path)
+    raw = json_path.read_bytes()
+    data = json.loads(raw.decode("utf-8"))
+    errors = validate_story(data)
+    if errors:
+        raise StoryError(f"剧本 {json_path.name} 结构不合法: " + "; ".join(errors))
+    scenes = data.get("scenes") or data.get("master") or []
+    tmp = db_path.with_name(f".{db_path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    tmp.unlink(missing_ok=True)
+    conn = sqlite3.connect(tmp)
+    try:
+        conn.executescript(_SCHEMA)
+        dumps = lambda value: json.dumps(value, ensure_ascii=False, separators=(",", ":"))  # noqa: E731
+        meta = {
+            "format": str(FORMAT_VERSION),
+            "name": data.get("name", ""),
+            "source_signature": _signature(json_path),
+            "source_digest": hashlib.sha256(raw).hexdigest(),
+            "scene_key": "scenes" if data.get("scenes") else "master",
+            "extra": dumps({k: v for k, v in data.items() if k not in ("name", "characters", "scenes", "master", "props")}),
+        }
+        conn.executemany("INSERT INTO meta (key, value) VALUES (?, ?)", meta.items())
+        conn.executemany(
+            "INSERT INTO characters (idx, id, name, body) VALUES (?, ?, ?, ?)",
+            ((i, c.get("id", ""), c.get("name", ""), dumps(c)) for i, c in enumerate(data.get("characters") or [])),
+        )
+        conn.executemany(
+            "INSERT INTO scenes (idx, id, name, body) VALUES (?, ?, ?, ?)",
+            ((i, s.get("id"), s.get("name") or "", dumps(s)) for i, s in enumerate(scenes)),
+        )
+        conn.executemany(
+            "INSERT INTO props (idx, name, body) VALUES (?, ?, ?)",
+            ((i, p.get("name", ""), dumps(p)) for i, p in enumerate(data.get("props") or [])),
+        )
+        conn.commit()
+    finally:
+        conn.close()
+    os.replace(tmp, db_path)
+
+
+def is_fresh(json_path: str | Path, db_path: str | Path) -> bool:
+    """编译结果存在、格式版本一致且源 JSON 的 (mtime, size) 未变。"""
+    json_path, db_path = Path(json_path), Path(db_path)
+    if not db_path.is_file():
+        return False
+    try:
+        conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+        try:
+            meta = dict(conn.execute("SELECT key, value FROM meta WHERE key IN ('format', 'source_signature')"))
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        return False
+    return meta.get("format") == str(FORMAT_VERSION) and meta.get("source_signature") == _signature(json_path)
+
+
+class CompiledStory:
+    """
+    编译后剧本的只读视图。角色、场景、道具在首次访问时才从 SQLite 读取并解析，
+    按 id / 序号缓存，内存占用只与实际访问的条目有关。线程安全。
+    返回的 dict 为共享对象，不要原地修改。
+    剧本重新编译时旧实例不会被关闭，仍在使用它的线程继续读到旧版本，最后一个引用释放时连接随之关闭。
+    """
+
+    def __init__(self, db_path: str | Path):
+        self.db_path = Path(db_path)
+        self._conn = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._meta = dict(self._conn.execute("SELECT key, value FROM meta"))
+        self._characters: dict[str, dict] = {}
+        self._scenes: dict[int, dict] = {}
+        self._props: Optional[list[dict]] = None
+        self._views: dict[str, Any] = {}
+
+    def _query(self, sql: str, params: tuple = ()) -> list[tuple]:
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    @property
+    def name(self) -> str:
+        return self._meta["name"]
+
+    @property
+    def digest(self) -> str:
+        """源 JSON 内容的 SHA-256。"""
+        return self._meta["source_digest"]
+
+    @property
+    def scene_key(self) -> str:
+        """源 JSON 中场景所在字段：scenes 或旧版 master。"""
+        return self._meta["scene_key"]
+
+    def counts(self) -> dict[str, int]:
+        """角色 / 场景 / 道具数量，不加载任何条目。"""
+        return {
+            table: self._query(f"SELECT COUNT(*) FROM {table}")[0][0]
+            for table in ("characters", "scenes", "props")
+        }
+
+    def character_ids(self) -> list[tuple[str, str]]:
+        """[(id, name)]，按剧本中的顺序。"""
+        return self._query("SELECT id, name FROM characters ORDER BY idx")
+
+    def character(self, character_id: str) -> Optional[dict]:
+        cached = self._characters.get(character_id)
+        if cached is None:
+            rows = self._query("SELECT body FROM characters WHERE id = ?", (character_id,))
+            if not rows:
+                return None
+            cached = self._characters[character_id] = json.loads(rows[0][0])
+        return cached
+
+    def characters(self) -> Iterator[dict]:
+        for character_id, _name in self.character_ids():
+            yield self.character(character_id)
+
+    def scene_count(self) -> int:
+        return self._query("SELECT COUNT(*) FROM scenes")[0][0]
+
+    def scene_at(self, index: int) -> Optional[dict]:
+        """按序号取场景（场景 id 可能缺省，序号总是可用）。"""
+        cached = self._scenes.get(index)
+        if cached is None:
+            rows = self._query("SELECT body FROM scenes WHERE idx = ?", (index,))
+            if not rows:
+                return None
+            cached = self._scenes[index] = json.loads(rows[0][0])
+        return cached
+
+    def scene(self, scene_id: str) -> Optional[dict]:
+        rows = self._query("SELECT idx FROM scenes WHERE id = ?", (scene_id,))
+        return self.scene_at(rows[0][0]) if rows else None
+
+    def scenes(self) -> Iterator[dict]:
+        for index in range(self.scene_count()):
+            yield self.scene_at(index)
+
+    def props(self) -> list[dict]:
+        if self._props is None:
+            self._props = [json.loads(body) for (body,) in self._query("SELECT body FROM props ORDER BY idx")]
+        return self._props
+
+    def prop(self, name: str) -> Optional[dict]:
+        rows = self._query("SELECT body FROM props WHERE name = ? ORDER BY idx LIMIT 1", (name,))
+        return json.loads(rows[0][0]) if rows else None
+
+    def to_dict(self) -> dict:
+        """还原完整剧本 JSON（会加载全部条目）。"""
+        return {
+            **json.loads(self._meta.get("extra") or "{}"),
+            "name": self.name,
+            "props": self.props(),
+            self.scene_key: list(self.scenes()),
+            "characters": list(self.characters()),
+        }
+
+    def view(self, name: str, build: Callable[["CompiledStory"], Any]) -> Any:
+        """返回由本剧本派生的视图 build(self)，按 name 缓存，随编译版本一起失效。"""
+        with self._lock:
+            if name in self._views:
+                return self._views[name]
+        value = build(self)
+        with self._lock:
+            return self._views.setdefault(name, value)
+
+    def model(self, story_id: str) -> Story:
+        """剧本模型 Story，由逐行条目构建（编译时已校验），不解析源 JSON。"""
+        return self.view("model", lambda story: Story.from_parts(
+            story_id, story.name, story.characters(), story.scenes(), story.props()))
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
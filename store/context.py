@@ -0,0 +1,133 @@
+"""按 token 预算从 StoryMemory 组装角色上下文：近期对话保留原文，更早的对话按场景摘要。"""
+
+import re
+from collections import deque
+from typing import Awaitable, Callable, Optional
+
+from store.memory import AsyncStoryMemory
+
+_CJK = re.compile(r"[\u3000-\u9fff\uff00-\uffef]")
+
+# (场景名称, 该场景已有的摘要, 本次新移出原文窗口的记录, token 上限) -> 合并后的摘要
+Summarizer = Callable[[str, str, list[dict], int], Awaitable[str]]
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算 token 数：中文及全角字符按 1 个计，其余按 4 个字符 1 个计。"""
+    cjk = len(_CJK.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def _truncate(text: str, max_tokens: int) -> str:
+    """保留 text 末尾不超过 max_tokens 的部分，截掉的开头以省略号代替。"""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    while text and estimate_tokens(text) > max_tokens - 1:
+        text = text[len(text) - int(len(text) * 0.9):]
+    return "…" + text
+
+
+def _clip(text: str, max_tokens: int) -> str:
+    """保留 text 开头不超过 max_tokens 的部分，截掉的结尾以省略号代替。"""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    while text and estimate_tokens(text) > max_tokens - 1:
+        text = text[:int(len(text) * 0.9)]
+    return text + "…"
+
+
+async def extract_summary(scene_name: str, summary: str, rows: list[dict], max_tokens: int) -> str:
+    """默认摘要：新记录每条取首句追加到已有摘要之后，超出上限时丢弃最早的内容，不调用模型。"""
+    lines = [summary] if summary else []
+    for row in rows:
+        first = re.split(r"(?<=[。！？!?\n])", row["content"].strip(), maxsplit=1)[0]
+        lines.append(f"{row['character_name']}：{first.strip()}")
+    return _truncate("；".join(lines), max_tokens)
+
+
+class ContextBuilder:
+    """
+    单局游戏的滚动上下文窗口。
+
+    每次 update 只读取上次之后新增的记录；原文窗口超出 budget - summary_budget 时，
+    最早的记录移出窗口，按场景把新移出的记录并入该场景已有的摘要后即丢弃，其余摘要直接复用，
+    每次压缩的开销只与新移出的记录数有关。每个场景摘要不超过 scene_summary_tokens，超出时保留最新的内容；render 输出「前情摘要 + 近期对话」，
+    摘要部分不超过 summary_budget，从最新的场景往前取。
+    同一局的全部角色共享一个实例，历史只计算一次；render(profile) 在最前面附上调用方角色自己的背景，
+    截断到 profile_budget，因此角色背景不必写进 system_prompt，窗口总量仍不超过 budget。
+    """
+
+    def __init__(
+        self,
+        memory: AsyncStoryMemory,
+        *,
+        budget: int = 4000,
+        summary_budget: int = 800,
+        scene_summary_tokens: int = 200,
+        profile_budget: int = 600,
+        summarizer: Optional[Summarizer] = None,
+    ):
+        self.memory = memory
+        self.budget = budget
+        self.summary_budget = min(summary_budget, budget)
+        self.profile_budget = max(0, min(profile_budget, budget - self.summary_budget))
+        self.scene_summary_tokens = min(scene_summary_tokens, self.summary_budget)
+        self.summarizer = summarizer or extract_summary
+        self._last_id = 0
+        self._recent: deque[dict] = deque()
+        self._recent_tokens = 0
+        self._scene_names: dict[str, str] = {}
+        self._summaries: dict[str, str] = {}
+
+    async def update(self) -> int:
+        """读取新增记录并压缩窗口，返回新增条数。"""
+        count = 0
+        async for row in self.memory.iter_all(after_id=self._last_id):
+            row["tokens"] = estimate_tokens(f"{row['character_name']}：{row['content']}")
+            self._recent.append(row)
+            self._recent_tokens += row["tokens"]
+            self._last_id = row["id"]
+            count += 1
+        if count:
+            await self._compact()
+        return count
+
+    async def _compact(self) -> None:
+        evicted: dict[str, list[dict]] = {}
+        limit = self.budget - self.summary_budget - self.profile_budget
+        # 至少保留最后一条原文
+        while len(self._recent) > 1 and self._recent_tokens > limit:
+            row = self._recent.popleft()
+            self._recent_tokens -= row["tokens"]
+            scene_id = row["scene_id"]
+            evicted.setdefault(scene_id, []).append(row)
+            self._scene_names[scene_id] = row["scene_name"]
+        for scene_id, rows in evicted.items():
+            self._summaries[scene_id] = await self.summarizer(
+                self._scene_names[scene_id], self._summaries.get(scene_id, ""), rows, self.scene_summary_tokens)
+
+    def render(self, profile: str = "") -> str:
+        """组装当前上下文文本，profile 为调用方角色的背景；都为空时返回空字符串。"""
+        summaries = []
+        used = 0
+        for scene_id in reversed(list(self._summaries)):
+            line = f"{self._scene_names[scene_id]}：{self._summaries[scene_id]}"
+            tokens = estimate_tokens(line)
+            if used + tokens > self.summary_budget:
+                break
+            summaries.append(line)
+            used += tokens
+        parts = []
+        if profile and self.profile_budget:
+            parts.append("【你的背景】\n" + _clip(profile, self.profile_budget))
+        if summaries:
+            parts.append("【前情摘要】\n" + "\n".join(reversed(summaries)))
+        if self._recent:
+            parts.append("【近期对话】\n" + "\n".join(
+                f"{row['character_name']}：{row['content']}" for row in self._recent))
+        return "\n\n".join(parts)
+
+    @property
+    def tokens(self) -> int:
+        """当前窗口的估算 token 数。"""
+        return estimate_tokens(self.render())
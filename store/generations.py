@@ -0,0 +1,114 @@
+"""绘图结果缓存：按请求内容寻址保存生成的图片与元数据，相同请求直接取本地结果，不再重复付费。"""
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+
+RESULTS_DIR = Path(__file__).resolve().parent.parent / "results"
+CACHE_DIR = RESULTS_DIR / ".cache" / "generations"
+# 记录 results 下每个输出文件由哪个请求生成，用于判断提示词是否已变化
+MANIFEST_PATH = RESULTS_DIR / ".generations.json"
+
+
+def request_key(model: str, prompt: str, urls: list[str], aspect_ratio: str, image_size: str) -> str:
+    """请求内容的 SHA-256：模型、提示词、参考图 URL（有序）、宽高比、尺寸任一变化都会得到新 key。"""
+    payload = json.dumps([model, prompt, list(urls), aspect_ratio, image_size], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _atomic_copy(source: Path, target: Path) -> None:
+    target.parent.mkdir(parents=True, exist_ok=True)
+    tmp = target.with_name(f".{target.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        shutil.copyfile(source, tmp)
+        os.replace(tmp, target)
+    finally:
+        tmp.unlink(missing_ok=True)
+
+
+def _atomic_write_json(path: Path, data) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    tmp.write_text(json.dumps(data, ensure_ascii=False, indent=2, sort_keys=True), encoding="utf-8")
+    os.replace(tmp, path)
+
+
+class GenerationCache:
+    """
+    内容寻址的绘图缓存：图片存放在 cache_dir/<key 前 2 位>/<key>.png，元数据在同名 .json。
+
+    另维护一份输出清单 {results 下相对路径: key}，记录每个输出文件对应的请求，
+    据此区分「已是最新」「提示词已变化」「可从缓存恢复」「需要付费生成」。线程安全。
+    """
+
+    def __init__(
+        self,
+        cache_dir: str | Path = CACHE_DIR,
+        manifest_path: str | Path = MANIFEST_PATH,
+        results_dir: str | Path = RESULTS_DIR,
+    ):
+        self.cache_dir = Path(cache_dir)
+        self.manifest_path = Path(manifest_path)
+        self.results_dir = Path(results_dir)
+        self._lock = threading.Lock()
+        self._manifest: Optional[dict[str, str]] = None
+
+    def path(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / f"{key}.png"
+
+    def has(self, key: str) -> bool:
+        return self.path(key).is_file()
+
+    def meta(self, key: str) -> Optional[dict]:
+        """读取缓存元数据，不存在返回 None。"""
+        try:
+            return json.loads(self.path(key).with_suffix(".json").read_text(encoding="utf-8"))
+        except (OSError, json.JSONDecodeError):
+            return None
+
+    def put(self, key: str, image: Path, meta: dict) -> Path:
+        """把已生成的图片及元数据存入缓存，返回缓存路径。"""
+        target = self.path(key)
+        _atomic_copy(image, target)
+        _atomic_write_json(target.with_suffix(".json"), {"key": key, "created_at": time.time(), **meta})
+        return target
+
+    def restore(self, key: str, target: Path) -> bool:
+        """从缓存复制图片到 target，缓存不存在返回 False。"""
+        source = self.path(key)
+        if not source.is_file():
+            return False
+        _atomic_copy(source, target)
+        return True
+
+    def _relpath(self, target: Path) -> str:
+        target = Path(target).resolve()
+        try:
+            return target.relative_to(self.results_dir.resolve()).as_posix()
+        except ValueError:
+            return target.as_posix()
+
+    def _load_manifest(self) -> dict[str, str]:
+        if self._manifest is None:
+            try:
+                self._manifest = json.loads(self.manifest_path.read_text(encoding="utf-8"))
+            except (OSError, json.JSONDecodeError):
+                self._manifest = {}
+        return self._manifest
+
+    def recorded(self, target: Path) -> Optional[str]:
+        """输出文件上次由哪个请求 key 生成，未记录返回 None。"""
+        with self._lock:
+            return self._load_manifest().get(self._relpath(target))
+
+    def record(self, target: Path, key: str) -> None:
+        """记录输出文件对应的请求 key 并落盘。"""
+        with self._lock:
+            manifest = self._load_manifest()
+            manifest[self._relpath(target)] = key
+            _atomic_write_json(self.manifest_path, manifest)
@@ -1,29 +1,104 @@
 """剧本杀对话记忆：使用 SQLite3 存储场景内角色对话。"""
 
+import asyncio
+import queue
 import sqlite3
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
 from pathlib import Path
-from typing import Optional
+from typing import Any, AsyncIterator, Callable, Iterable, Iterator, NamedTuple, Optional
+
+_COLUMNS = "id, scene_id, scene_name, character_id, character_name, content, created_at"
+_ACTION_COLUMNS = "id, message_id, scene_id, character_id, kind, name, target, amount, created_at"
+
+
+class ActionRecord(NamedTuple):
+    """
+    一条已校验的动作。玩家：vote（name=选项）/ prop 使用道具（name=道具，target=作用对象角色 ID，amount=数量）
+    / give 交出道具（name=道具，target=接收角色 ID，amount=数量）/ transfer（target=收款角色 ID，amount=金额）；
+    主持人：grant 发放资金（target=角色 ID，amount=金额，负数为扣款）/ deal 发放道具（name、target、amount）
+    / stars 星级变化（amount）。
+    """
+    kind: str
+    name: Optional[str] = None
+    target: Optional[str] = None
+    amount: Optional[int] = None
+
+
+# (scene_id, scene_name, character_id, character_name, content, actions)
+Turn = tuple[str, str, str, str, str, Iterable[ActionRecord]]
 
 
 class StoryMemory:
-    """使用 SQLite3 存储对话过程，包含场景 ID/名称、角色 ID/名称、消息内容。"""
+    """
+    使用 SQLite3 存储对话过程，包含场景 ID/名称、角色 ID/名称、消息内容。
 
-    def __init__(self, story_id: str, db_dir: str | Path = "."):
+    写入采用批量提交：add 立即执行 INSERT（可立刻拿到 id，同连接读取可见），
+    累计 batch_size 条或距上次提交超过 flush_interval 秒时才 commit；
+    mark_step、flush、close 会立即提交。batch_size=1 即每条提交一次。
+
+    同一剧本的多局游戏以 session_id 区分：构造时给出默认会话，
+    各方法也可通过 session_id 参数指定。实例本身不是线程安全的，
+    多局并发请使用 StoryMemoryPool。
+    """
+
+    def __init__(
+        self,
+        story_id: str,
+        db_dir: str | Path = ".",
+        *,
+        batch_size: int = 64,
+        flush_interval: float = 1.0,
+        wal: bool = True,
+        session_id: str = "",
+        check_same_thread: bool = True,
+    ):
         self.db_path = Path(db_dir) / f"{story_id}.db"
+        self.session_id = session_id
+        self.check_same_thread = check_same_thread
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.wal = wal
         self._conn: Optional[sqlite3.Connection] = None
+        self._pending = 0
+        self._last_commit = time.monotonic()
         self._ensure_table()
 
     def _get_conn(self) -> sqlite3.Connection:
         if self._conn is None:
-            self._conn = sqlite3.connect(str(self.db_path))
+            self._conn = sqlite3.connect(str(self.db_path), check_same_thread=self.check_same_thread)
             self._conn.row_factory = sqlite3.Row
+            if self.wal:
+                # WAL 下写入不阻塞读取，synchronous=NORMAL 只在检查点时 fsync
+                self._conn.execute("PRAGMA journal_mode=WAL")
+                self._conn.execute("PRAGMA synchronous=NORMAL")
         return self._conn
 
+    def _sid(self, session_id: Optional[str]) -> str:
+        return self.session_id if session_id is None else session_id
+
+    def _maybe_commit(self, count: int) -> None:
+        self._pending += count
+        if (self._pending >= self.batch_size
+                or time.monotonic() - self._last_commit >= self.flush_interval):
+            self.flush()
+
+    def flush(self) -> None:
+        """提交尚未提交的写入。"""
+        if self._conn is not None and self._pending:
+            self._conn.commit()
+        self._pending = 0
+        self._last_commit = time.monotonic()
+
     def _ensure_table(self) -> None:
         conn = self._get_conn()
+        existing = {row["name"] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
         conn.execute("""
             CREATE TABLE IF NOT EXISTS messages (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
+                session_id TEXT NOT NULL DEFAULT '',
                 scene_id TEXT NOT NULL,
                 scene_name TEXT NOT NULL,
                 character_id TEXT NOT NULL,
@@ -32,6 +107,79 @@ class StoryMemory:
                 created_at TEXT DEFAULT (datetime('now', 'localtime'))
             )
         """)
+        # 推演进度：每完成一个步骤写入一条，用于中断后续跑；
+        # message_id 为完成时本局最后一条对话的 id，之后的对话属于未完成的步骤
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS steps (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                session_id TEXT NOT NULL DEFAULT '',
+                scene_id TEXT NOT NULL,
+                step_index INTEGER NOT NULL,
+                choice TEXT,
+                message_id INTEGER,
+                created_at TEXT DEFAULT (datetime('now', 'localtime'))
+            )
+        """)
+        # 每局已确认的历史边界：id 不超过 message_id 的对话不属于任何未完成步骤，discard_unfinished 不删除
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS history_marks (
+                session_id TEXT PRIMARY KEY,
+                message_id INTEGER NOT NULL
+            ) WITHOUT ROWID
+        """)
+        # 结构化回合中解析出的动作，按类型分列，可直接用 SQL 统计
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS actions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                session_id TEXT NOT NULL DEFAULT '',
+                message_id INTEGER NOT NULL REFERENCES messages (id),
+                scene_id TEXT NOT NULL,
+                character_id TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                name TEXT,
+                target TEXT,
+                amount INTEGER,
+                created_at TEXT DEFAULT (datetime('now', 'localtime'))
+            )
+        """)
+        # 对局状态（道具 / 金钱 / 星级）的当前值，按键增量覆盖，见 store.props.GameState
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS game_state (
+                session_id TEXT NOT NULL DEFAULT '',
+                kind TEXT NOT NULL,
+                holder TEXT NOT NULL,
+                name TEXT NOT NULL,
+                value INTEGER NOT NULL,
+                PRIMARY KEY (session_id, kind, holder, name)
+            ) WITHOUT ROWID
+        """)
+        # 旧库没有 session_id 列，补列后原有记录归入默认会话 ''
+        for table in ("messages", "steps"):
+            columns = {row["name"] for row in conn.execute(f"PRAGMA table_info({table})")}
+            if "session_id" not in columns:
+                conn.execute(f"ALTER TABLE {table} ADD COLUMN session_id TEXT NOT NULL DEFAULT ''")
+        columns = {row["name"] for row in conn.execute("PRAGMA table_info(steps)")}
+        if "message_id" not in columns:
+            conn.execute("ALTER TABLE steps ADD COLUMN message_id INTEGER")
+        if "history_marks" not in existing:
+            # 升级前写入的对话（旧库没有进度记录）整体视为已完成的历史，续跑时保留
+            conn.execute("""
+                INSERT INTO history_marks (session_id, message_id)
+                SELECT session_id, MAX(id) FROM messages GROUP BY session_id
+            """)
+        # 按会话 + 场景 / 角色回放时走索引，id 作为最后一列支持 keyset 分页
+        conn.execute("DROP INDEX IF EXISTS idx_messages_scene")
+        conn.execute("DROP INDEX IF EXISTS idx_messages_character")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_session ON messages (session_id, id)")
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_messages_session_scene ON messages (session_id, scene_id, id)")
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_messages_session_character ON messages (session_id, character_id, id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_steps_session ON steps (session_id, id)")
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_actions_session_scene ON actions (session_id, scene_id, kind, id)")
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_actions_session_character ON actions (session_id, character_id, id)")
         conn.commit()
 
     def add(
@@ -41,47 +189,293 @@ class StoryMemory:
         character_id: str,
         character_name: str,
         content: str,
+        *,
+        session_id: Optional[str] = None,
     ) -> int:
         """写入一条对话记录，返回自增 id。"""
         conn = self._get_conn()
         cur = conn.execute(
             """
-            INSERT INTO messages (scene_id, scene_name, character_id, character_name, content)
-            VALUES (?, ?, ?, ?, ?)
+            INSERT INTO messages (session_id, scene_id, scene_name, character_id, character_name, content)
+            VALUES (?, ?, ?, ?, ?, ?)
             """,
-            (scene_id, scene_name, character_id, character_name, content),
+            (self._sid(session_id), scene_id, scene_name, character_id, character_name, content),
         )
-        conn.commit()
+        self._maybe_commit(1)
         return cur.lastrowid or 0
 
-    def list_by_scene(self, scene_id: str) -> list[dict]:
-        """按场景 ID 查询该场景下所有对话，按时间顺序。"""
+    def add_many(
+        self,
+        rows: Iterable[tuple[str, str, str, str, str]],
+        *,
+        session_id: Optional[str] = None,
+    ) -> int:
+        """
+        批量写入对话记录，rows 每项为 (scene_id, scene_name, character_id, character_name, content)。
+        返回写入条数。
+        """
         conn = self._get_conn()
-        cur = conn.execute(
+        sid = self._sid(session_id)
+        cur = conn.executemany(
             """
-            SELECT id, scene_id, scene_name, character_id, character_name, content, created_at
-            FROM messages
-            WHERE scene_id = ?
-            ORDER BY id
+            INSERT INTO messages (session_id, scene_id, scene_name, character_id, character_name, content)
+            VALUES (?, ?, ?, ?, ?, ?)
             """,
-            (scene_id,),
+            ((sid, *row) for row in rows),
         )
+        count = cur.rowcount if cur.rowcount > 0 else 0
+        self._maybe_commit(count)
+        return count
+
+    def add_turns(self, turns: Iterable[Turn], *, session_id: Optional[str] = None) -> list[int]:
+        """
+        写入结构化回合：每项为 (scene_id, scene_name, character_id, character_name, content, actions)，
+        发言写入 messages，动作写入 actions 并关联到该发言。返回各发言的 id。
+        """
+        conn = self._get_conn()
+        sid = self._sid(session_id)
+        ids = []
+        count = 0
+        for scene_id, scene_name, character_id, character_name, content, actions in turns:
+            cur = conn.execute(
+                """
+                INSERT INTO messages (session_id, scene_id, scene_name, character_id, character_name, content)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                (sid, scene_id, scene_name, character_id, character_name, content),
+            )
+            message_id = cur.lastrowid or 0
+            ids.append(message_id)
+            rows = [(sid, message_id, scene_id, character_id, *action) for action in actions]
+            conn.executemany(
+                """
+                INSERT INTO actions (session_id, message_id, scene_id, character_id, kind, name, target, amount)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                rows,
+            )
+            count += 1 + len(rows)
+        self._maybe_commit(count)
+        return ids
+
+    def list_actions(
+        self,
+        scene_id: Optional[str] = None,
+        kind: Optional[str] = None,
+        *,
+        character_id: Optional[str] = None,
+        session_id: Optional[str] = None,
+    ) -> list[dict]:
+        """按场景 / 类型 / 角色筛选动作，按 id 升序。"""
+        where = ["session_id = ?"]
+        params: list = [self._sid(session_id)]
+        for column, value in (("scene_id", scene_id), ("kind", kind), ("character_id", character_id)):
+            if value is not None:
+                where.append(f"{column} = ?")
+                params.append(value)
+        cur = self._get_conn().execute(
+            f"SELECT {_ACTION_COLUMNS} FROM actions WHERE {' AND '.join(where)} ORDER BY id", params)
         return [dict(row) for row in cur.fetchall()]
 
-    def list_all(self) -> list[dict]:
-        """查询全部对话，按 id 升序。"""
+    def vote_counts(self, scene_id: str, *, session_id: Optional[str] = None) -> dict[str, int]:
+        """统计某场景的投票 {选项: 票数}。"""
+        cur = self._get_conn().execute(
+            """
+            SELECT name, COUNT(*) AS votes FROM actions
+            WHERE session_id = ? AND scene_id = ? AND kind = 'vote'
+            GROUP BY name
+            """,
+            (self._sid(session_id), scene_id),
+        )
+        return {row["name"]: row["votes"] for row in cur.fetchall()}
+
+    def save_state(self, rows: Iterable[tuple[str, str, str, int]], *, session_id: Optional[str] = None) -> int:
+        """增量写入对局状态，rows 每项为 (kind, holder, name, value)，已有的键覆盖。返回写入条数。"""
+        sid = self._sid(session_id)
+        rows = [(sid, *row) for row in rows]
+        if rows:
+            self._get_conn().executemany(
+                """
+                INSERT INTO game_state (session_id, kind, holder, name, value) VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (session_id, kind, holder, name) DO UPDATE SET value = excluded.value
+                """,
+                rows,
+            )
+            self._maybe_commit(len(rows))
+        return len(rows)
+
+    def load_state(self, *, session_id: Optional[str] = None) -> list[tuple[str, str, str, int]]:
+        """读取对局状态 [(kind, holder, name, value)]。"""
+        cur = self._get_conn().execute(
+            "SELECT kind, holder, name, value FROM game_state WHERE session_id = ?", (self._sid(session_id),))
+        return [tuple(row) for row in cur.fetchall()]
+
+    def _page(self, where: str, params: tuple, after_id: int, limit: int) -> list[dict]:
         conn = self._get_conn()
         cur = conn.execute(
-            """
-            SELECT id, scene_id, scene_name, character_id, character_name, content, created_at
+            f"""
+            SELECT {_COLUMNS}
             FROM messages
+            WHERE session_id = ? AND {where} id > ?
             ORDER BY id
-            """
+            LIMIT ?
+            """,
+            (*params, after_id, limit),
         )
         return [dict(row) for row in cur.fetchall()]
 
+    def _iter(
+        self,
+        where: str,
+        params: tuple,
+        after_id: int,
+        limit: Optional[int],
+        page_size: int,
+    ) -> Iterator[dict]:
+        """按 id 做 keyset 分页逐页读取，内存中最多只保留一页。"""
+        remaining = limit
+        while remaining is None or remaining > 0:
+            size = page_size if remaining is None else min(page_size, remaining)
+            rows = self._page(where, params, after_id, size)
+            yield from rows
+            if len(rows) < size:
+                return
+            after_id = rows[-1]["id"]
+            if remaining is not None:
+                remaining -= len(rows)
+
+    def page_by_scene(
+        self,
+        scene_id: str,
+        after_id: int = 0,
+        limit: int = 100,
+        *,
+        session_id: Optional[str] = None,
+    ) -> list[dict]:
+        """按场景分页查询：返回 id > after_id 的前 limit 条，下一页以最后一条的 id 作为 after_id。"""
+        return self._page("scene_id = ? AND", (self._sid(session_id), scene_id), after_id, limit)
+
+    def iter_by_scene(
+        self,
+        scene_id: str,
+        after_id: int = 0,
+        limit: Optional[int] = None,
+        *,
+        page_size: int = 500,
+        session_id: Optional[str] = None,
+    ) -> Iterator[dict]:
+        """按场景逐条遍历 id > after_id 的对话，最多 limit 条（None 为不限）。"""
+        return self._iter("scene_id = ? AND", (self._sid(session_id), scene_id), after_id, limit, page_size)
+
+    def page_by_character(
+        self,
+        character_id: str,
+        after_id: int = 0,
+        limit: int = 100,
+        *,
+        session_id: Optional[str] = None,
+    ) -> list[dict]:
+        """按角色分页查询，用法同 page_by_scene。"""
+        return self._page("character_id = ? AND", (self._sid(session_id), character_id), after_id, limit)
+
+    def iter_by_character(
+        self,
+        character_id: str,
+        after_id: int = 0,
+        limit: Optional[int] = None,
+        *,
+        page_size: int = 500,
+        session_id: Optional[str] = None,
+    ) -> Iterator[dict]:
+        """按角色逐条遍历 id > after_id 的对话。"""
+        return self._iter("character_id = ? AND", (self._sid(session_id), character_id), after_id, limit, page_size)
+
+    def page_all(
+        self,
+        after_id: int = 0,
+        limit: int = 100,
+        *,
+        session_id: Optional[str] = None,
+    ) -> list[dict]:
+        """分页查询全部对话，用法同 page_by_scene。"""
+        return self._page("", (self._sid(session_id),), after_id, limit)
+
+    def iter_all(
+        self,
+        after_id: int = 0,
+        limit: Optional[int] = None,
+        *,
+        page_size: int = 500,
+        session_id: Optional[str] = None,
+    ) -> Iterator[dict]:
+        """逐条遍历全部对话，按 id 升序。"""
+        return self._iter("", (self._sid(session_id),), after_id, limit, page_size)
+
+    def list_by_scene(self, scene_id: str, *, session_id: Optional[str] = None) -> list[dict]:
+        """按场景 ID 查询该场景下所有对话，按时间顺序。"""
+        return list(self.iter_by_scene(scene_id, session_id=session_id))
+
+    def list_all(self, *, session_id: Optional[str] = None) -> list[dict]:
+        """查询全部对话，按 id 升序。"""
+        return list(self.iter_all(session_id=session_id))
+
+    def mark_step(
+        self,
+        scene_id: str,
+        step_index: int,
+        choice: Optional[str] = None,
+        *,
+        session_id: Optional[str] = None,
+    ) -> None:
+        """记录某场景的某个步骤已完成；choice 为该步骤选定的分支。"""
+        conn = self._get_conn()
+        sid = self._sid(session_id)
+        conn.execute(
+            """
+            INSERT INTO steps (session_id, scene_id, step_index, choice, message_id)
+            VALUES (?, ?, ?, ?, (SELECT COALESCE(MAX(id), 0) FROM messages WHERE session_id = ?))
+            """,
+            (sid, scene_id, step_index, choice, sid),
+        )
+        # 进度标记与之前的对话一起落盘，保证续跑时两者一致
+        self._pending += 1
+        self.flush()
+
+    def last_step(self, *, session_id: Optional[str] = None) -> Optional[dict]:
+        """返回最近完成的步骤 {scene_id, step_index, choice}，没有则返回 None。"""
+        conn = self._get_conn()
+        row = conn.execute(
+            "SELECT scene_id, step_index, choice FROM steps WHERE session_id = ? ORDER BY id DESC LIMIT 1",
+            (self._sid(session_id),),
+        ).fetchone()
+        return dict(row) if row else None
+
+    def discard_unfinished(self, *, session_id: Optional[str] = None) -> int:
+        """
+        删除最后一个已完成步骤之后写入的对话与动作（未完成步骤的残留），并立即提交。
+        没有任何已完成步骤时以升级时记录的历史边界为准，新局没有边界时删除本局全部对话。
+        旧库中没有 message_id 的进度记录无法判断边界，不做删除。
+        返回删除的对话条数。
+        """
+        conn = self._get_conn()
+        sid = self._sid(session_id)
+        row = conn.execute(
+            "SELECT message_id FROM steps WHERE session_id = ? ORDER BY id DESC LIMIT 1", (sid,)).fetchone()
+        if row is not None and row["message_id"] is None:
+            return 0
+        after = row["message_id"] if row is not None else 0
+        mark = conn.execute("SELECT message_id FROM history_marks WHERE session_id = ?", (sid,)).fetchone()
+        if mark is not None:
+            after = max(after, mark["message_id"])
+        conn.execute("DELETE FROM actions WHERE session_id = ? AND message_id > ?", (sid, after))
+        cur = conn.execute("DELETE FROM messages WHERE session_id = ? AND id > ?", (sid, after))
+        self._pending += 1
+        self.flush()
+        return cur.rowcount if cur.rowcount > 0 else 0
+
     def close(self) -> None:
         if self._conn is not None:
+            self.flush()
             self._conn.close()
             self._conn = None
 
@@ -90,3 +484,207 @@ class StoryMemory:
 
     def __exit__(self, *args: object) -> None:
         self.close()
+
+
+
+class StoryMemoryPool:
+    """
+    同一剧本多局并发时共享的记忆后端。
+
+    SQLite 同一时刻只允许一个写者，因此所有写入由单个写线程上的连接批量提交；
+    写线程有未提交写入时最多等待 flush_interval，期间没有新写入也会提交，丢失窗口不超过该时长。
+    查询使用最多 readers 个只读连接，在线程池中执行。均不占用事件循环，
+    通过 session(session_id) 取得每局游戏的 AsyncStoryMemory。
+    写连接上有未提交写入的会话记为脏，只有查询脏会话时才先提交，其余查询与写入互不等待。
+    """
+
+    def __init__(
+        self,
+        story_id: str,
+        db_dir: str | Path = ".",
+        *,
+        readers: int = 4,
+        batch_size: int = 64,
+        flush_interval: float = 1.0,
+    ):
+        self.story_id = story_id
+        self.db_dir = db_dir
+        self._writer = StoryMemory(
+            story_id, db_dir,
+            batch_size=batch_size, flush_interval=flush_interval, check_same_thread=False)
+        # 写入队列，元素为 (future, fn, args, kwargs)，None 表示关闭
+        self._writes: queue.Queue[Optional[tuple]] = queue.Queue()
+        self._write_thread = threading.Thread(target=self._write_loop, name="story-memory-writer", daemon=True)
+        self._write_thread.start()
+        self._read_executor = ThreadPoolExecutor(max_workers=readers, thread_name_prefix="story-memory-reader")
+        # 读连接按需创建，队列容量即连接上限
+        self._readers: queue.Queue[Optional[StoryMemory]] = queue.Queue(maxsize=readers)
+        for _ in range(readers):
+            self._readers.put(None)
+        # 写连接上有未提交写入的 session_id，只在写线程上修改
+        self._dirty: set[str] = set()
+
+    def session(self, session_id: str = "") -> "AsyncStoryMemory":
+        return AsyncStoryMemory(self, session_id)
+
+    def _write_sync(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        try:
+            return fn(self._writer, *args, **kwargs)
+        finally:
+            # 写连接只有一个事务，提交后所有会话都不再脏
+            if self._writer._pending:
+                self._dirty.add(kwargs.get("session_id") or "")
+            else:
+                self._dirty.clear()
+
+    def _write_loop(self) -> None:
+        """写线程：依次执行写入；有未提交写入时按 flush_interval 的剩余时间等待，超时即提交。"""
+        writer = self._writer
+        while True:
+            timeout = None
+            if writer._pending:
+                timeout = max(0.0, writer.flush_interval - (time.monotonic() - writer._last_commit))
+            try:
+                item = self._writes.get(timeout=timeout)
+            except queue.Empty:
+                self._write_sync(StoryMemory.flush)
+                continue
+            if item is None:
+                return
+            future, fn, args, kwargs = item
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(self._write_sync(fn, *args, **kwargs))
+            except Exception as e:
+                future.set_exception(e)
+
+    async def write(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """在写线程上以写连接调用 fn(writer, *args, **kwargs)，会话由 session_id 关键字参数给出。"""
+        future: Future = Future()
+        self._writes.put((future, fn, args, kwargs))
+        return await asyncio.wrap_future(future)
+
+    def _read_sync(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        reader = self._readers.get()
+        try:
+            if reader is None:
+                reader = StoryMemory(self.story_id, self.db_dir, check_same_thread=False)
+            return fn(reader, *args, **kwargs)
+        finally:
+            self._readers.put(reader)
+
+    async def read(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """
+        在读连接池中调用 fn(reader, *args, **kwargs)。session_id 所在会话有未提交的写入时先提交，
+        保证读到本局自己的写入。
+        """
+        if (kwargs.get("session_id") or "") in self._dirty:
+            await self.write(StoryMemory.flush)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._read_executor, partial(self._read_sync, fn, *args, **kwargs))
+
+    def close(self) -> None:
+        self._writes.put(None)
+        self._write_thread.join()
+        self._read_executor.shutdown(wait=True)
+        self._writer.close()
+        while not self._readers.empty():
+            reader = self._readers.get_nowait()
+            if reader is not None:
+                reader.close()
+
+    def __enter__(self) -> "StoryMemoryPool":
+        return self
+
+    def __exit__(self, *args: object) -> None:
+        self.close()
+
+
+class AsyncStoryMemory:
+    """StoryMemoryPool 上单局游戏的异步视图，接口与 StoryMemory 对应，全部限定在 session_id 内。"""
+
+    def __init__(self, pool: StoryMemoryPool, session_id: str = ""):
+        self.pool = pool
+        self.session_id = session_id
+
+    async def add(
+        self,
+        scene_id: str,
+        scene_name: str,
+        character_id: str,
+        character_name: str,
+        content: str,
+    ) -> int:
+        return await self.pool.write(
+            StoryMemory.add, scene_id, scene_name, character_id, character_name, content,
+            session_id=self.session_id)
+
+    async def add_many(self, rows: Iterable[tuple[str, str, str, str, str]]) -> int:
+        return await self.pool.write(StoryMemory.add_many, list(rows), session_id=self.session_id)
+
+    async def add_turns(self, turns: Iterable[Turn]) -> list[int]:
+        return await self.pool.write(
+            StoryMemory.add_turns, [(*turn[:5], list(turn[5])) for turn in turns], session_id=self.session_id)
+
+    async def list_actions(
+        self,
+        scene_id: Optional[str] = None,
+        kind: Optional[str] = None,
+        *,
+        character_id: Optional[str] = None,
+    ) -> list[dict]:
+        return await self.pool.read(
+            StoryMemory.list_actions, scene_id, kind, character_id=character_id, session_id=self.session_id)
+
+    async def vote_counts(self, scene_id: str) -> dict[str, int]:
+        return await self.pool.read(StoryMemory.vote_counts, scene_id, session_id=self.session_id)
+
+    async def save_state(self, rows: Iterable[tuple[str, str, str, int]]) -> int:
+        return await self.pool.write(StoryMemory.save_state, list(rows), session_id=self.session_id)
+
+    async def load_state(self) -> list[tuple[str, str, str, int]]:
+        return await self.pool.read(StoryMemory.load_state, session_id=self.session_id)
+
+    async def mark_step(self, scene_id: str, step_index: int, choice: Optional[str] = None) -> None:
+        await self.pool.write(StoryMemory.mark_step, scene_id, step_index, choice, session_id=self.session_id)
+
+    async def discard_unfinished(self) -> int:
+        return await self.pool.write(StoryMemory.discard_unfinished, session_id=self.session_id)
+
+    async def flush(self) -> None:
+        await self.pool.write(StoryMemory.flush)
+
+    async def last_step(self) -> Optional[dict]:
+        return await self.pool.read(StoryMemory.last_step, session_id=self.session_id)
+
+    async def page_by_scene(self, scene_id: str, after_id: int = 0, limit: int = 100) -> list[dict]:
+        return await self.pool.read(StoryMemory.page_by_scene, scene_id, after_id, limit, session_id=self.session_id)
+
+    async def page_by_character(self, character_id: str, after_id: int = 0, limit: int = 100) -> list[dict]:
+        return await self.pool.read(
+            StoryMemory.page_by_character, character_id, after_id, limit, session_id=self.session_id)
+
+    async def page_all(self, after_id: int = 0, limit: int = 100) -> list[dict]:
+        return await self.pool.read(StoryMemory.page_all, after_id, limit, session_id=self.session_id)
+
+    async def _iter(self, page: Callable[..., Any], after_id: int, page_size: int) -> AsyncIterator[dict]:
+        while True:
+            rows = await page(after_id=after_id, limit=page_size)
+            for row in rows:
+                yield row
+            if len(rows) < page_size:
+                return
+            after_id = rows[-1]["id"]
+
+    def iter_by_scene(self, scene_id: str, after_id: int = 0, *, page_size: int = 500) -> AsyncIterator[dict]:
+        """按场景逐页异步遍历对话。"""
+        return self._iter(partial(self.page_by_scene, scene_id), after_id, page_size)
+
+    def iter_by_character(self, character_id: str, after_id: int = 0, *, page_size: int = 500) -> AsyncIterator[dict]:
+        """按角色逐页异步遍历对话。"""
+        return self._iter(partial(self.page_by_character, character_id), after_id, page_size)
+
+    def iter_all(self, after_id: int = 0, *, page_size: int = 500) -> AsyncIterator[dict]:
+        """逐页异步遍历本局全部对话。"""
+        return self._iter(self.page_all, after_id, page_size)
@@ -0,0 +1,289 @@
+"""剧本数据模型：加载时一次性校验并规范化剧本 JSON（含旧版 master / prompts 格式），之后只读使用。"""
+
+from dataclasses import dataclass, field
+from typing import Any, Optional
+
+
+class StoryError(ValueError):
+    """剧本结构不合法。"""
+
+
+STEP_TYPES = ("memory", "user")
+
+
+def _is_str_list(value) -> bool:
+    return isinstance(value, list) and all(isinstance(v, str) for v in value)
+
+
+def validate_story(data: Any) -> list[str]:
+    """校验剧本 JSON 结构（name / characters / scenes / props），返回错误描述列表，为空表示通过。"""
+    if not isinstance(data, dict):
+        return ["剧本必须是 JSON 对象"]
+    errors = []
+    if not isinstance(data.get("name"), str) or not data["name"]:
+        errors.append("name 必须是非空字符串")
+
+    ids: set[str] = set()
+    for i, character in enumerate(data.get("characters") or []):
+        where = f"characters[{i}]"
+        if not isinstance(character, dict):
+            errors.append(f"{where} 必须是对象")
+            continue
+        for key in ("id", "name"):
+            if not isinstance(character.get(key), str) or not character[key]:
+                errors.append(f"{where}.{key} 必须是非空字符串")
+        if isinstance(character.get("id"), str):
+            if character["id"] in ids:
+                errors.append(f"{where}.id 重复: {character['id']}")
+            ids.add(character["id"])
+        for j, scene in enumerate(character.get("scenes") or []):
+            if not isinstance(scene, dict):
+                errors.append(f"{where}.scenes[{j}] 必须是对象")
+                continue
+            for key in ("prompts", "tasks", "skills"):
+                if key in scene and not _is_str_list(scene[key]):
+                    errors.append(f"{where}.scenes[{j}].{key} 必须是字符串列表")
+
+    ids = set()
+    for i, scene in enumerate(data.get("scenes") or data.get("master") or []):
+        where = f"scenes[{i}]"
+        if not isinstance(scene, dict):
+            errors.append(f"{where} 必须是对象")
+            continue
+        if scene.get("id") is not None:
+            if not isinstance(scene["id"], str):
+                errors.append(f"{where}.id 必须是字符串")
+            elif scene["id"] in ids:
+                errors.append(f"{where}.id 重复: {scene['id']}")
+            else:
+                ids.add(scene["id"])
+        if scene.get("choices") is not None and not isinstance(scene["choices"], dict):
+            errors.append(f"{where}.choices 必须是对象")
+        if "steps" not in scene and not _is_str_list(scene.get("prompts")):
+            errors.append(f"{where} 缺少 steps")
+        for j, step in enumerate(scene.get("steps") or []):
+            if isinstance(step, dict):
+                # 旧版单个 dict 步骤，由模型层规范化
+                continue
+            if not isinstance(step, list):
+                errors.append(f"{where}.steps[{j}] 必须是列表")
+                continue
+            for k, block in enumerate(step):
+                if not isinstance(block, dict) or not _is_str_list(block.get("value")):
+                    errors.append(f"{where}.steps[{j}][{k}].value 必须是字符串列表")
+                elif block.get("type", "memory") not in STEP_TYPES:
+                    errors.append(f"{where}.steps[{j}][{k}].type 未知: {block['type']}")
+
+    for i, prop in enumerate(data.get("props") or []):
+        where = f"props[{i}]"
+        if not isinstance(prop, dict) or not isinstance(prop.get("name"), str):
+            errors.append(f"{where}.name 必须是字符串")
+            continue
+        if not isinstance(prop.get("count", 1), int) or prop.get("count", 1) < 0:
+            errors.append(f"{where}.count 必须是非负整数")
+        for j, child in enumerate(prop.get("children") or []):
+            if not isinstance(child, dict) or not isinstance(child.get("name"), str):
+                errors.append(f"{where}.children[{j}].name 必须是字符串")
+    return errors
+
+
+@dataclass(slots=True, frozen=True)
+class Block:
+    """步骤中的一段：memory 为自动上下文（旁白），user 为主持人提示词。"""
+    type: str
+    lines: tuple[str, ...]
+
+
+@dataclass(slots=True, frozen=True)
+class Step:
+    blocks: tuple[Block, ...]
+
+    def lines(self, block_type: str) -> list[str]:
+        return [line for b in self.blocks if b.type == block_type for line in b.lines]
+
+
+@dataclass(slots=True, frozen=True)
+class Choice:
+    key: str
+    description: str
+    next: Optional[str] = None
+
+
+@dataclass(slots=True, frozen=True)
+class Scene:
+    index: int
+    id: Optional[str]
+    name: str
+    steps: tuple[Step, ...]
+    notes: tuple[str, ...] = ()
+    choices: dict[str, Choice] = field(default_factory=dict)
+    # 旧版场景的原始 prompts，绘制场景图时用作描述
+    prompts: tuple[str, ...] = ()
+
+    @property
+    def key(self) -> str:
+        """场景 ID，缺失时以序号代替，用于记忆与进度记录。"""
+        return self.id or f"scene-{self.index}"
+
+    @property
+    def title(self) -> str:
+        return self.name or f"场景 {self.index + 1}"
+
+
+@dataclass(slots=True, frozen=True)
+class CharacterScene:
+    """角色在某一幕的剧本：背景提示词、任务、技能，branches 保留原始分支数据。"""
+    prompts: tuple[str, ...] = ()
+    tasks: tuple[str, ...] = ()
+    skills: tuple[str, ...] = ()
+    branches: dict[str, Any] = field(default_factory=dict)
+
+
+@dataclass(slots=True, frozen=True)
+class Character:
+    id: str
+    name: str
+    description: str
+    introduction: str
+    scenes: tuple[CharacterScene, ...] = ()
+
+    @property
+    def background(self) -> str:
+        """第一幕的背景故事。"""
+        return ", ".join(self.scenes[0].prompts) if self.scenes else ""
+
+
+@dataclass(slots=True, frozen=True)
+class Prop:
+    name: str
+    count: Optional[int] = None
+    description: str = ""
+    children: tuple["Prop", ...] = ()
+
+
+@dataclass(slots=True, frozen=True)
+class Story:
+    id: str
+    name: str
+    characters: tuple[Character, ...]
+    scenes: tuple[Scene, ...]
+    props: tuple[Prop, ...]
+    _characters_by_id: dict[str, Character] = field(default_factory=dict, repr=False, compare=False)
+    _scenes_by_id: dict[str, Scene] = field(default_factory=dict, repr=False, compare=False)
+
+    def character(self, character_id: str) -> Optional[Character]:
+        return self._characters_by_id.get(character_id)
+
+    def scene(self, scene_id: str) -> Optional[Scene]:
+        return self._scenes_by_id.get(scene_id)
+
+    def scene_index(self, scene_id: str) -> Optional[int]:
+        scene = self._scenes_by_id.get(scene_id)
+        return scene.index if scene is not None else None
+
+    @classmethod
+    def from_dict(cls, story_id: str, data: dict) -> "Story":
+        """校验并规范化剧本 JSON，结构不合法时抛 StoryError。"""
+        errors = validate_story(data)
+        if errors:
+            raise StoryError(f"剧本 {story_id} 结构不合法: " + "; ".join(errors))
+        return cls.from_parts(story_id, data.get("name") or "", data.get("characters") or [],
+                              data.get("scenes") or data.get("master") or [], data.get("props") or [])
+
+    @classmethod
+    def from_parts(cls, story_id: str, name: str, characters, scenes, props) -> "Story":
+        """由已校验的角色 / 场景 / 道具条目构建（如编译后剧本的逐行数据），不再校验。"""
+        characters = tuple(_character(c) for c in characters)
+        scenes = tuple(_scene(i, s) for i, s in enumerate(scenes))
+        return cls(
+            id=story_id,
+            name=name or story_id,
+            characters=characters,
+            scenes=scenes,
+            props=tuple(_prop(p) for p in props),
+            _characters_by_id={c.id: c for c in characters},
+            _scenes_by_id={s.id: s for s in scenes if s.id},
+        )
+
+
+def _strings(values) -> tuple[str, ...]:
+    return tuple(v for v in values or () if isinstance(v, str))
+
+
+def _block(item: dict, lines: tuple[str, ...]) -> Block:
+    return Block(item.get("type") or "memory", lines)
+
+
+def _step(raw) -> Optional[Step]:
+    """
+    规范化单个步骤：新版为 [{type, value}, ...]；
+    旧版为单个 dict，文本可能在 value、prompts（字符串或 {value}）、tasks 中，合为一块。
+    """
+    blocks = []
+    if isinstance(raw, list):
+        for item in raw:
+            if isinstance(item, dict):
+                lines = _strings(item.get("value"))
+                if lines:
+                    blocks.append(_block(item, lines))
+    elif isinstance(raw, dict):
+        lines = list(_strings(raw.get("value")))
+        for p in raw.get("prompts") or []:
+            if isinstance(p, dict):
+                lines.extend(_strings(p.get("value")))
+            elif isinstance(p, str):
+                lines.append(p)
+        lines.extend(_strings(raw.get("tasks")))
+        if lines:
+            blocks.append(_block(raw, tuple(lines)))
+    return Step(tuple(blocks)) if blocks else None
+
+
+def _scene(index: int, raw: dict) -> Scene:
+    steps = tuple(s for s in (_step(step) for step in raw.get("steps") or []) if s is not None)
+    prompts = _strings(raw.get("prompts"))
+    if not steps and prompts:
+        # 旧版：无 steps 但有 prompts 时视为单个 memory 步骤
+        steps = (Step((Block("memory", prompts),)),)
+    choices = {}
+    for key, value in (raw.get("choices") or {}).items():
+        if isinstance(value, dict):
+            choices[key] = Choice(key, value.get("description", ""), value.get("next"))
+        else:
+            choices[key] = Choice(key, str(value))
+    return Scene(
+        index=index,
+        id=raw.get("id"),
+        name=raw.get("name") or "",
+        steps=steps,
+        notes=_strings(raw.get("notes")),
+        choices=choices,
+        prompts=prompts,
+    )
+
+
+def _character(raw: dict) -> Character:
+    return Character(
+        id=raw["id"],
+        name=raw["name"],
+        description=raw.get("description") or "",
+        introduction=raw.get("introduction") or "",
+        scenes=tuple(
+            CharacterScene(
+                prompts=_strings(s.get("prompts")),
+                tasks=_strings(s.get("tasks")),
+                skills=_strings(s.get("skills")),
+                branches=s.get("branches") or {},
+            )
+            for s in raw.get("scenes") or []
+        ),
+    )
+
+
+def _prop(raw: dict) -> Prop:
+    return Prop(
+        name=raw["name"],
+        count=raw.get("count"),
+        description=raw.get("description") or "",
+        children=tuple(_prop(c) for c in raw.get("children") or []),
+    )
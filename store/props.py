@@ -0,0 +1,218 @@
+"""
+对局状态：道具库存、角色金钱与犯罪星级。
+
+状态保存在内存的扁平字典 {(kind, holder, name): value} 中，转账、发放道具都是 O(1) 的字典读写；
+每次修改记入撤销日志，checkpoint / rollback 只回放本步骤内的改动，不复制整份状态。
+修改过的键记为脏数据，由 dirty_rows 取出后增量写入 SQLite（见 StoryMemory.save_state）。
+"""
+
+from typing import Iterable, Optional
+
+from store.model import Prop, Story
+
+# 尚未发给任何角色的道具所在的公共池
+POOL = ""
+PROP, MONEY, STARS = "prop", "money", "stars"
+
+Key = tuple[str, str, str]
+# (kind, holder, name, value)
+StateRow = tuple[str, str, str, int]
+
+
+class GameStateError(ValueError):
+    """状态操作不合法，如余额或道具不足。"""
+
+
+def _initial_props(props: tuple[Prop, ...]) -> Iterable[tuple[str, int]]:
+    """剧本道具的初始数量：带 children 的道具按子项逐个计数（每项默认 1），否则取 count（默认 1）。"""
+    for prop in props:
+        if prop.children:
+            yield from _initial_props(prop.children)
+        else:
+            yield prop.name, 1 if prop.count is None else prop.count
+
+
+class GameState:
+    """
+    单局游戏的状态引擎。星级达到 max_stars 时案件失败，所有角色金钱清零；
+    star_cost 为每升一星每名角色需支付的金额，余额不足时扣到 0。
+    """
+
+    def __init__(self, names: Optional[dict[str, str]] = None, *, max_stars: int = 5, star_cost: int = 0):
+        self.names = dict(names or {})
+        self.max_stars = max_stars
+        self.star_cost = star_cost
+        self._values: dict[Key, int] = {}
+        self._journal: list[tuple[Key, Optional[int]]] = []
+        self._dirty: set[Key] = set()
+
+    @classmethod
+    def from_story(
+        cls,
+        story: Story,
+        *,
+        initial_money: int = 0,
+        max_stars: int = 5,
+        star_cost: int = 0,
+    ) -> "GameState":
+        """按剧本建立初始状态：道具全部放入公共池，每个角色持有 initial_money。"""
+        state = cls({c.id: c.name for c in story.characters}, max_stars=max_stars, star_cost=star_cost)
+        for name, count in _initial_props(story.props):
+            key = (PROP, POOL, name)
+            state._set(key, state._get(key) + count)
+        for character in story.characters:
+            state._set((MONEY, character.id, ""), initial_money)
+        state._set((STARS, "", ""), 0)
+        state.commit()
+        return state
+
+    def _get(self, key: Key) -> int:
+        return self._values.get(key, 0)
+
+    def _set(self, key: Key, value: int) -> None:
+        old = self._values.get(key)
+        if old == value:
+            return
+        self._journal.append((key, old))
+        self._values[key] = value
+        self._dirty.add(key)
+
+    # ---- 查询 ----
+
+    @property
+    def stars(self) -> int:
+        return self._get((STARS, "", ""))
+
+    @property
+    def failed(self) -> bool:
+        return self.stars >= self.max_stars
+
+    def money(self, character_id: str) -> int:
+        return self._get((MONEY, character_id, ""))
+
+    def count(self, holder: str, prop: str) -> int:
+        return self._get((PROP, holder, prop))
+
+    def inventory(self, holder: str) -> dict[str, int]:
+        """holder 持有的道具 {名称: 数量}，不含数量为 0 的。"""
+        return {name: v for (kind, h, name), v in self._values.items() if kind == PROP and h == holder and v}
+
+    def characters(self) -> list[str]:
+        """有金钱记录的角色 ID，按加入顺序。"""
+        return [h for (kind, h, _), _v in self._values.items() if kind == MONEY]
+
+    # ---- 操作 ----
+
+    def grant_money(self, character_id: str, amount: int) -> int:
+        """给角色发钱（amount 为负表示扣款），余额不能为负。返回新余额。"""
+        key = (MONEY, character_id, "")
+        balance = self._get(key) + amount
+        if balance < 0:
+            raise GameStateError(f"{self.names.get(character_id, character_id)} 余额不足")
+        self._set(key, balance)
+        return balance
+
+    def transfer_money(self, source: str, target: str, amount: int) -> None:
+        if amount <= 0:
+            raise GameStateError("转账金额必须大于 0")
+        if source == target:
+            raise GameStateError("不能给自己转账")
+        src, dst = (MONEY, source, ""), (MONEY, target, "")
+        if self._get(src) < amount:
+            raise GameStateError(f"{self.names.get(source, source)} 余额不足")
+        self._set(src, self._get(src) - amount)
+        self._set(dst, self._get(dst) + amount)
+
+    def give(self, prop: str, target: str, count: int = 1, source: str = POOL) -> None:
+        """把 count 个道具从 source（默认公共池）交给 target。"""
+        if count <= 0:
+            raise GameStateError("道具数量必须大于 0")
+        src, dst = (PROP, source, prop), (PROP, target, prop)
+        if self._get(src) < count:
+            raise GameStateError(f"{self.names.get(source, source) or '道具池'} 的 {prop} 不足")
+        self._set(src, self._get(src) - count)
+        self._set(dst, self._get(dst) + count)
+
+    def add_stars(self, n: int = 1) -> int:
+        """星级加 n（不超过 max_stars），每名角色按升星数支付 star_cost；达到上限时案件失败、金钱清零。"""
+        before = self.stars
+        after = min(self.max_stars, max(0, before + n))
+        self._set((STARS, "", ""), after)
+        raised = after - before
+        for character_id in self.characters():
+            key = (MONEY, character_id, "")
+            if after >= self.max_stars:
+                self._set(key, 0)
+            elif raised > 0 and self.star_cost:
+                self._set(key, max(0, self._get(key) - raised * self.star_cost))
+        return after
+
+    # ---- 快照与回滚 ----
+
+    def checkpoint(self) -> int:
+        """返回当前撤销日志位置，供 rollback 回到此处。"""
+        return len(self._journal)
+
+    def rollback(self, mark: int = 0) -> None:
+        """撤销 mark 之后的全部修改。"""
+        while len(self._journal) > mark:
+            key, old = self._journal.pop()
+            if old is None:
+                self._values.pop(key, None)
+            else:
+                self._values[key] = old
+            self._dirty.add(key)
+
+    def commit(self) -> None:
+        """丢弃撤销日志：此前的修改不再可回滚（步骤完成并持久化之后调用）。"""
+        self._journal.clear()
+
+    def snapshot(self) -> dict[Key, int]:
+        return dict(self._values)
+
+    def restore(self, snapshot: dict[Key, int]) -> None:
+        """恢复到 snapshot，改动记入撤销日志。"""
+        for key in [k for k in self._values if k not in snapshot]:
+            self._set(key, 0)
+        for key, value in snapshot.items():
+            self._set(key, value)
+
+    # ---- 持久化 ----
+
+    def dirty_rows(self) -> list[StateRow]:
+        """取出自上次调用以来修改过的键，用于增量写入。"""
+        rows = [(*key, self._get(key)) for key in self._dirty]
+        self._dirty.clear()
+        return rows
+
+    def load_rows(self, rows: Iterable[StateRow]) -> None:
+        """用持久化的行覆盖当前状态，不记入撤销日志与脏数据。"""
+        for kind, holder, name, value in rows:
+            self._values[(kind, holder, name)] = value
+        self._journal.clear()
+        self._dirty.clear()
+
+    # ---- 摘要 ----
+
+    def _items(self, holder: str) -> str:
+        return "、".join(name if n == 1 else f"{name}×{n}" for name, n in self.inventory(holder).items()) or "无"
+
+    def summary(self, viewer: Optional[str] = None) -> str:
+        """
+        给智能体的简短状态说明。viewer 为角色 ID 时只给出其本人的资金与道具及他人资金，
+        为 None 时（主持人）列出全部角色。
+        """
+        lines = [f"当前星级：{self.stars}/{self.max_stars}" + ("（案件失败）" if self.failed else "")]
+        others = []
+        for character_id in self.characters():
+            name = self.names.get(character_id, character_id)
+            if character_id == viewer:
+                lines.append(f"你的资金：{self.money(character_id)}")
+                lines.append(f"你的道具：{self._items(character_id)}")
+            elif viewer is None:
+                lines.append(f"{name}：资金 {self.money(character_id)}，道具 {self._items(character_id)}")
+            else:
+                others.append(f"{name} {self.money(character_id)}")
+        if others:
+            lines.append("其他人资金：" + "，".join(others))
+        return "\n".join(lines)
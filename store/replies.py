@@ -0,0 +1,93 @@
+"""智能体回复的录制 / 回放缓存：按 (智能体, 模型, 系统提示词, 消息历史) 寻址保存回复，回放时不调用模型。"""
+
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Any, Iterable, Optional
+
+RESULTS_DIR = Path(__file__).resolve().parent.parent / "results"
+CACHE_DIR = RESULTS_DIR / ".cache" / "replies"
+# off 不使用缓存；record 总是调用模型并保存；replay 只读缓存，未命中报错（离线运行）；
+# auto 命中时回放，未命中时调用模型并保存
+MODES = ("off", "record", "replay", "auto")
+
+
+class ReplayMissError(LookupError):
+    """replay 模式下缓存中没有对应的回复。"""
+
+
+def _msg_payload(msg: Any) -> dict:
+    # 只取参与对话的字段，id / 时间戳每次运行都不同，不能进入 key
+    return {
+        "name": getattr(msg, "name", None),
+        "role": getattr(msg, "role", None),
+        "content": getattr(msg, "content", msg),
+    }
+
+
+def reply_key(
+    agent_name: str,
+    model_name: str,
+    sys_prompt: str,
+    history: Iterable[Any],
+    structured: Optional[str] = None,
+) -> str:
+    """回复的缓存 key：系统提示词与消息历史各自哈希，任一变化都会得到新 key。"""
+    prompt_hash = hashlib.sha256(sys_prompt.encode("utf-8")).hexdigest()
+    history_hash = hashlib.sha256(json.dumps(
+        [_msg_payload(m) for m in history], ensure_ascii=False, sort_keys=True, default=str,
+    ).encode("utf-8")).hexdigest()
+    payload = json.dumps([agent_name, model_name, prompt_hash, history_hash, structured], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ReplyCache:
+    """
+    回复缓存，每条回复存为 cache_dir/<key 前 2 位>/<key>.json：
+    {reply: 回复的 Msg.to_dict, memory: [本次回复写入智能体记忆的全部消息]}。
+    写入先写临时文件再原子替换，多个智能体并发录制也不会留下半个文件。线程安全。
+    """
+
+    def __init__(self, mode: str = "auto", cache_dir: str | Path = CACHE_DIR):
+        if mode not in MODES:
+            raise ValueError(f"未知的回放模式: {mode}")
+        self.mode = mode
+        self.cache_dir = Path(cache_dir)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode != "off"
+
+    def path(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / f"{key}.json"
+
+    def lookup(self, key: str) -> Optional[dict]:
+        """取出可回放的回复；record 模式总是返回 None，replay 模式未命中时抛 ReplayMissError。"""
+        if self.mode in ("off", "record"):
+            return None
+        try:
+            data = json.loads(self.path(key).read_text(encoding="utf-8"))
+        except (OSError, json.JSONDecodeError):
+            data = None
+        with self._lock:
+            if data is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if data is None and self.mode == "replay":
+            raise ReplayMissError(f"回放缓存未命中: {key}")
+        return data
+
+    def store(self, key: str, data: dict) -> None:
+        if self.mode not in ("record", "auto"):
+            return
+        path = self.path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp.write_text(json.dumps(data, ensure_ascii=False, indent=2, default=str), encoding="utf-8")
+        os.replace(tmp, path)
@@ -0,0 +1,135 @@
+"""剧本仓库：进程内缓存编译后的剧本与其派生视图，文件 mtime/大小变化时自动失效。"""
+
+import hashlib
+import json
+import threading
+from pathlib import Path
+from typing import Any, Callable, Optional
+
+from store.compiled import CompiledStory, compile_story, is_fresh
+from store.model import Story
+
+DATA_DIR = Path(__file__).resolve().parent.parent / "data"
+
+
+class _Entry:
+    __slots__ = ("signature", "digest", "data")
+
+    def __init__(self, signature: tuple[int, int], digest: str, data: dict):
+        self.signature = signature
+        self.digest = digest
+        self.data = data
+
+
+class StoryRepository:
+    """
+    按 story_id 缓存 data/story__<id>.json 的解析结果，以及由其派生的视图（如网站展示用的规范化结构）。
+
+    每次访问只做一次 stat，(mtime_ns, size) 不变时直接返回缓存对象，不再解析 JSON。
+    返回的 dict 为各调用方共享，不要原地修改。
+
+    story() 返回编译后的 CompiledStory（data/story__<id>.sqlite，按需编译），只需个别角色 / 场景
+    或只需名称、数量、哈希时使用它，不必解析整份 JSON；model() 与 view() 同样基于编译结果，
+    每个文件版本只在编译时解析一次 JSON，之后进程重启也直接读取编译结果。
+    get() 返回原始 JSON，仅供需要未规范化数据的工具使用。
+    """
+
+    def __init__(self, data_dir: str | Path = DATA_DIR):
+        self.data_dir = Path(data_dir)
+        self._entries: dict[str, _Entry] = {}
+        self._ids: Optional[tuple[int, list[str]]] = None
+        self._stories: dict[str, tuple[tuple[int, int], CompiledStory]] = {}
+        self._lock = threading.Lock()
+
+    def path(self, story_id: str) -> Path:
+        return self.data_dir / f"story__{story_id}.json"
+
+    def compiled_path(self, story_id: str) -> Path:
+        return self.data_dir / f"story__{story_id}.sqlite"
+
+    def _signature(self, story_id: str) -> tuple[int, int]:
+        st = self.path(story_id).stat()
+        return st.st_mtime_ns, st.st_size
+
+    def story(self, story_id: str) -> CompiledStory:
+        """
+        返回编译后的剧本，JSON 变化时重新编译。旧实例不主动关闭，其他线程可继续使用到释放为止。
+        不存在抛 FileNotFoundError，格式错误抛 JSONDecodeError，结构不合法抛 StoryError。
+        """
+        signature = self._signature(story_id)
+        with self._lock:
+            cached = self._stories.get(story_id)
+            if cached is not None and cached[0] == signature:
+                return cached[1]
+        path, db_path = self.path(story_id), self.compiled_path(story_id)
+        if not is_fresh(path, db_path):
+            compile_story(path, db_path)
+        story = CompiledStory(db_path)
+        with self._lock:
+            self._stories[story_id] = (signature, story)
+        return story
+
+    def _entry(self, story_id: str) -> _Entry:
+        """取缓存条目，文件变化或首次访问时重新解析。不存在抛 FileNotFoundError，格式错误抛 JSONDecodeError。"""
+        path = self.path(story_id)
+        st = path.stat()
+        signature = (st.st_mtime_ns, st.st_size)
+        with self._lock:
+            entry = self._entries.get(story_id)
+            if entry is not None and entry.signature == signature:
+                return entry
+        raw = path.read_bytes()
+        data = json.loads(raw.decode("utf-8"))
+        entry = _Entry(signature, hashlib.sha256(raw).hexdigest(), data)
+        with self._lock:
+            self._entries[story_id] = entry
+        return entry
+
+    def get(self, story_id: str) -> dict:
+        """返回剧本原始 JSON 解析结果。"""
+        return self._entry(story_id).data
+
+    def digest(self, story_id: str) -> str:
+        """剧本文件内容的 SHA-256，可用作强 ETag。取自编译结果，不解析 JSON。"""
+        return self.story(story_id).digest
+
+    def modified(self, story_id: str) -> float:
+        """剧本文件的修改时间戳（秒）。"""
+        return self._signature(story_id)[0] / 1e9
+
+    def model(self, story_id: str) -> Story:
+        """返回剧本模型（取自编译结果），结构不合法抛 StoryError。"""
+        return self.story(story_id).model(story_id)
+
+    def view(self, story_id: str, name: str, build: Callable[[str, CompiledStory], Any]) -> Any:
+        """
+        返回剧本的派生视图 build(story_id, compiled)，按 name 缓存，随剧本文件一起失效。
+        """
+        return self.story(story_id).view(name, lambda story: build(story_id, story))
+
+    def list_ids(self) -> list[str]:
+        """列出 data 目录下全部 story_id（按文件名排序），目录 mtime 不变时复用上次结果。"""
+        if not self.data_dir.is_dir():
+            return []
+        mtime = self.data_dir.stat().st_mtime_ns
+        with self._lock:
+            if self._ids is not None and self._ids[0] == mtime:
+                return self._ids[1]
+        ids = [p.stem.replace("story__", "", 1) for p in sorted(self.data_dir.glob("story__*.json"))]
+        with self._lock:
+            self._ids = (mtime, ids)
+        return ids
+
+    def invalidate(self, story_id: Optional[str] = None) -> None:
+        """丢弃指定剧本（或全部）的缓存；已取出的 CompiledStory 仍可使用。"""
+        with self._lock:
+            if story_id is None:
+                self._entries.clear()
+                self._stories.clear()
+                self._ids = None
+            else:
+                self._entries.pop(story_id, None)
+                self._stories.pop(story_id, None)
+
+
+repository = StoryRepository()
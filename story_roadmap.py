@@ -1,108 +1,99 @@
 import argparse
 import asyncio
-import json
-from pathlib import Path
+import contextlib
+import threading
 from agentscope.message import Msg
 import yaml
-from typing import Dict
+from typing import Awaitable, Callable, Dict
+from pydantic import BaseModel, ValidationError
 
 from agentscope.pipeline import MsgHub
 
+from rich.console import Console, Group
+from rich.live import Live
+from rich.panel import Panel
 from rich.rule import Rule
 from rich.table import Table
-from rich.console import Console
-from rich.panel import Panel
 
-from entity import Character, PlayerAgent
-from store.memory import StoryMemory
+from entity import Character, ModeratorAction, PlayerAction, PlayerAgent, model_registry
+from events import EventBus, bus, live_channel
+from store.context import ContextBuilder
+from store.memory import ActionRecord, AsyncStoryMemory, StoryMemoryPool
+from store.model import Character as StoryCharacter, Prop, Scene, Step, Story
+from store.props import GameState, GameStateError
+from store.replies import MODES as REPLAY_MODES, ReplyCache
+from store.stories import repository
 
 parser = argparse.ArgumentParser()
 console = Console()
-DATA_DIR = Path(__file__).resolve().parent / "data"
-
-
-def parse_story(story_id: str) -> dict:
-    # 读取 data 目录下剧本文件
-    path = DATA_DIR / f"story__{story_id}.json"
-    with open(path, "r", encoding="utf-8") as f:
-        story = json.load(f)
-        console.print("Story: " + story["name"],
-                      justify="center", style="bold magenta")
-        console.print(Rule())
-        # 处理角色
-        characters_table = Table(title="Characters", expand=True)
-        characters_table.add_column("Name")
-        characters_table.add_column("Description")
-        characters_table.add_column("Introduction")
-        characters_table.add_column("Background")
-        for character in story["characters"]:
-            background = "[bold magenta]Null"
-            if "scenes" in character:
-                if len(character["scenes"]) > 0:
-                    background = ", ".join(character["scenes"][0]["prompts"])
-            characters_table.add_row(
-                character["name"], character["description"], character["introduction"], background)
-        # 处理场景
-        scenes_table = Table(title="Scenes", expand=True)
-        scenes_table.add_column("Name")
-        scenes_table.add_column("Prompts")
-        scenes_table.add_column("Notes")
-        scenes_table.add_column("Choices")
-        for index, scene in enumerate(story["master"]):
-            scene_name = f"场景{index + 1}"
-            if "name" in scene:
-                scene_name = scene["name"]
-            scene_prompts = "[bold magenta]Null"
-            if "prompts" in scene:
-                scene_prompts = ", ".join([p for p in scene["prompts"]])
-            scene_notes = "[bold magenta]Null"
-            if "notes" in scene:
-                scene_notes = ", ".join([n for n in scene["notes"]])
-            scene_choices = "[bold magenta]Null"
-            if "choices" in scene:
-                scene_choices = ", ".join(scene["choices"].keys())
-            scenes_table.add_row(
-                scene_name,
-                str(scene_prompts),
-                str(scene_notes),
-                scene_choices)
-        console.print(characters_table)
-        console.print(Rule())
-        console.print(scenes_table)
-        return story
+
+
+def parse_story(story_id: str) -> Story:
+    # 读取编译后的剧本（JSON 只在编译时解析并校验一次）
+    story = repository.story(story_id).model(story_id)
+    console.print("Story: " + story.name,
+                  justify="center", style="bold magenta")
+    console.print(Rule())
+    # 处理角色
+    characters_table = Table(title="Characters", expand=True)
+    characters_table.add_column("Name")
+    characters_table.add_column("Description")
+    characters_table.add_column("Introduction")
+    characters_table.add_column("Background")
+    for character in story.characters:
+        characters_table.add_row(
+            character.name, character.description, character.introduction,
+            character.background or "[bold magenta]Null")
+    # 处理场景
+    scenes_table = Table(title="Scenes", expand=True)
+    scenes_table.add_column("Name")
+    scenes_table.add_column("Prompts")
+    scenes_table.add_column("Steps")
+    scenes_table.add_column("Notes")
+    scenes_table.add_column("Choices")
+    for scene in story.scenes:
+        scenes_table.add_row(
+            scene.name or f"场景{scene.index + 1}",
+            ", ".join(scene.prompts) or "[bold magenta]Null",
+            str(len(scene.steps)),
+            ", ".join(scene.notes) or "[bold magenta]Null",
+            ", ".join(scene.choices) or "[bold magenta]Null")
+    console.print(characters_table)
+    console.print(Rule())
+    console.print(scenes_table)
+    return story
 
 
 def create_moderator(config: dict) -> Character:
     return Character(config["moderator"], "moderator", "moderator", f"""你现在是一名剧本杀的主持人""")
 
 
-def create_characters(characters: list[dict], config: dict) -> Dict[str, Character]:
-
+def create_characters(
+    characters: tuple[StoryCharacter, ...],
+    config: dict,
+    *,
+    background_in_prompt: bool = True,
+) -> Dict[str, Character]:
+    """background_in_prompt 为 False 时（启用上下文窗口）背景不写进 system_prompt，由窗口按预算附上。"""
     result: Dict[str, Character] = {}
     for character in characters:
-        id = character["id"]
-        name = character["name"]
-        description = character["description"]
-        introduction = character["introduction"]
-        if "scenes" not in character:
+        if not character.scenes:
             continue
-        if len(character["scenes"]) == 0:
-            continue
-        background = ", ".join(character["scenes"][0]["prompts"])
-        tasks = "\n".join(character["scenes"][0]["tasks"])
-        character_obj = Character(config["characters"], id, name, f"""你现在是一名剧本杀的玩家.
-你的名字叫{name},
+        tasks = "\n".join(character.scenes[0].tasks)
+        background = f"""
+你的背景故事如下:
+{character.background}
+""" if background_in_prompt else ""
+        character_obj = Character(config["characters"], character.id, character.name, f"""你现在是一名剧本杀的玩家.
+你的名字叫{character.name},
 
 你的个人信息如下:
-{description}
-{introduction}
-
-你的背景故事如下:
+{character.description}
+{character.introduction}
 {background}
-
 你目前的任务如下:
 {tasks}
-""")
+""", background=character.background)
         result[character_obj.id] = character_obj
     return result
 
@@ -115,41 +106,630 @@ def _msg_content(reply_msg) -> str:
     return content if isinstance(content, str) else str(content)
 
 
-async def run_scenes(story: dict, moderator: Character, characters: Dict[str, Character], memory: StoryMemory):
+def _panel_style(agent_name: str) -> tuple[str, str]:
+    if agent_name == "moderator":
+        return "[bold]主持人[/bold]", "yellow"
+    return f"[bold green]{agent_name}[/bold green]", "green"
+
+
+class LiveView:
+    """
+    流式回复的展示：进行中的回复在控制台底部的 Live 区域逐字刷新，完成后固定输出为面板；
+    同时把 token 增量与完整回复发布到事件总线的 channel 频道，供网站通过 SSE 观战；
+    新的分块不是上一次文本的延续时（模型改写了已输出的内容）发布 replace 事件替换整段文本。
+    作为 PlayerAgent.stream_listener 使用；echo 为 False 时只发布事件，不输出到控制台。
+    """
+
+    def __init__(self, channel: str, event_bus: EventBus = bus, *, echo: bool = True):
+        self.channel = channel
+        self.bus = event_bus
+        self.echo = echo
+        self._active: dict[str, tuple[str, str]] = {}
+        self._live: Live | None = None
+
+    def __call__(self, agent: PlayerAgent, msg: Msg, last: bool) -> None:
+        text = _msg_content(msg)
+        previous = self._active.get(msg.id, (agent.name, ""))[1]
+        if not text.startswith(previous):
+            self.bus.publish(self.channel, "replace", agent=agent.name, msg_id=msg.id, text=text)
+        elif len(text) > len(previous):
+            self.bus.publish(self.channel, "token", agent=agent.name, msg_id=msg.id, text=text[len(previous):])
+        if last:
+            self._active.pop(msg.id, None)
+            self.bus.publish(self.channel, "reply", agent=agent.name, msg_id=msg.id, text=text)
+            if self.echo:
+                title, border = _panel_style(agent.name)
+                console.print(Panel(text, title=title, border_style=border))
+        else:
+            self._active[msg.id] = (agent.name, text)
+        self._refresh()
+
+    def _refresh(self) -> None:
+        if not self.echo:
+            return
+        if not self._active:
+            if self._live is not None:
+                self._live.stop()
+                self._live = None
+            return
+        panels = []
+        for name, text in self._active.values():
+            title, border = _panel_style(name)
+            panels.append(Panel(text, title=title, border_style=border))
+        if self._live is None:
+            self._live = Live(Group(*panels), console=console, refresh_per_second=12, transient=True)
+            self._live.start()
+        else:
+            self._live.update(Group(*panels))
+
+    def close(self) -> None:
+        self._active.clear()
+        self._refresh()
+
+
+def _streaming(agent: PlayerAgent) -> bool:
+    """回复已由 stream_listener 展示时，调用方不再重复打印面板。"""
+    return agent.stream_listener is not None
+
+
+def _prop_names(props: tuple[Prop, ...]) -> set[str]:
+    names = set()
+    for prop in props:
+        names.add(prop.name)
+        names |= _prop_names(prop.children)
+    return names
+
+
+class ActionValidator:
+    """
+    结构化回合的动作校验：玩家按名字或 ID 匹配，道具必须出现在剧本道具表中，
+    投票只在需要做选择时有效。不合法的动作丢弃并给出原因，不再向模型追问。
+    使用道具（props）只记录作用对象，不改变库存；只有交出道具（gives）才把道具转给他人。
+    给出 state 时转账与交出的道具立即在对局状态中结算，余额或持有量不足的同样丢弃；
+    主持人的发放与星级变化由 moderate 结算。
+    """
+
+    def __init__(self, story: Story, characters: Dict[str, Character], state: GameState | None = None):
+        self.prop_names = _prop_names(story.props)
+        self.characters = characters
+        self.players = {c.id: c.id for c in characters.values()}
+        self.players.update({c.name: c.id for c in characters.values()})
+        self.state = state
+
+    def _settle(self, char: Character, record: ActionRecord) -> str | None:
+        """在对局状态中结算一条动作，失败时返回原因。"""
+        if self.state is None:
+            return None
+        try:
+            if record.kind == "transfer":
+                self.state.transfer_money(char.id, record.target, record.amount)
+            elif record.kind == "give":
+                self.state.give(record.name, record.target, record.amount, source=char.id)
+        except GameStateError as e:
+            return str(e)
+        return None
+
+    def validate(
+        self,
+        char: Character,
+        action: PlayerAction,
+        choices: dict | None = None,
+    ) -> tuple[list[ActionRecord], list[str]]:
+        """返回 (合法动作, 被丢弃动作的原因)；合法动作已在 state 中结算。"""
+        records, issues = [], []
+        if action.vote:
+            key = _parse_vote(action.vote, choices) if choices else None
+            if key is None:
+                issues.append(f"无效投票 {action.vote}")
+            else:
+                records.append(ActionRecord("vote", name=key))
+        for use in action.props:
+            target = self.players.get(use.target) if use.target else None
+            if use.name not in self.prop_names:
+                issues.append(f"未知道具 {use.name}")
+            elif use.target and target is None:
+                issues.append(f"道具 {use.name} 的对象 {use.target} 不存在")
+            elif self.state is not None and self.state.count(char.id, use.name) < use.count:
+                issues.append(f"未持有足够的道具 {use.name}")
+            else:
+                records.append(ActionRecord("prop", name=use.name, target=target, amount=use.count))
+        for give in action.gives:
+            target = self.players.get(give.to)
+            if give.name not in self.prop_names:
+                issues.append(f"未知道具 {give.name}")
+            elif target is None or target == char.id:
+                issues.append(f"道具 {give.name} 的接收人 {give.to} 无效")
+            else:
+                records.append(ActionRecord("give", name=give.name, target=target, amount=give.count))
+        for transfer in action.transfers:
+            target = self.players.get(transfer.to)
+            if target is None or target == char.id:
+                issues.append(f"无效转账对象 {transfer.to}")
+            else:
+                records.append(ActionRecord("transfer", target=target, amount=transfer.amount))
+        settled = []
+        for record in records:
+            issue = self._settle(char, record)
+            if issue is None:
+                settled.append(record)
+            else:
+                issues.append(issue)
+        return settled, issues
+
+    def moderate(self, action: ModeratorAction) -> tuple[list[ActionRecord], list[str]]:
+        """
+        结算主持人的发放与星级变化：资金发给玩家（负数为扣款），道具从公共池发出，
+        返回 (已结算的动作, 被丢弃动作的原因)。
+        """
+        records, issues = [], []
+        for grant in action.grants:
+            target = self.players.get(grant.to)
+            if target is None:
+                issues.append(f"发放对象 {grant.to} 不存在")
+                continue
+            if grant.money:
+                records.append(ActionRecord("grant", target=target, amount=grant.money))
+            for prop in grant.props:
+                if prop.name not in self.prop_names:
+                    issues.append(f"未知道具 {prop.name}")
+                else:
+                    records.append(ActionRecord("deal", name=prop.name, target=target, amount=prop.count))
+        if action.stars:
+            records.append(ActionRecord("stars", amount=action.stars))
+        if self.state is None:
+            return records, issues
+        settled = []
+        for record in records:
+            try:
+                if record.kind == "grant":
+                    self.state.grant_money(record.target, record.amount)
+                elif record.kind == "deal":
+                    self.state.give(record.name, record.target, record.amount)
+                else:
+                    self.state.add_stars(record.amount)
+            except GameStateError as e:
+                issues.append(str(e))
+            else:
+                settled.append(record)
+        return settled, issues
+
+
+def _reply_action(reply_msg: Msg, model: type[BaseModel] = PlayerAction) -> BaseModel | None:
+    """取出结构化回复中的动作（默认 PlayerAction），缺失或不合法时返回 None。"""
+    metadata = getattr(reply_msg, "metadata", None)
+    if not metadata:
+        return None
+    try:
+        return model.model_validate(metadata)
+    except ValidationError:
+        return None
+
+
+def _action_text(records: list[ActionRecord], characters: Dict[str, Character]) -> str:
+    parts = []
+    for r in records:
+        target = characters[r.target].name if r.target in characters else r.target
+        if r.kind == "vote":
+            parts.append(f"投票 {r.name}")
+        elif r.kind == "prop":
+            parts.append(f"使用 {r.name}×{r.amount}" + (f" → {target}" if target else ""))
+        elif r.kind == "give":
+            parts.append(f"交出 {r.name}×{r.amount} → {target}")
+        elif r.kind == "grant":
+            parts.append(f"发放 {r.amount} → {target}")
+        elif r.kind == "deal":
+            parts.append(f"发放 {r.name}×{r.amount} → {target}")
+        elif r.kind == "stars":
+            parts.append(f"星级 {r.amount:+d}")
+        else:
+            parts.append(f"转账 {r.amount} → {target}")
+    return "，".join(parts)
+
+
+async def _prompt_players(
+    players: list[Character],
+    msgs: list[Msg],
+    concurrency: int,
+    structured: bool = False,
+) -> list[Msg]:
+    """并发向玩家各自发送对应的消息，最多 concurrency 个同时进行，按 players 顺序返回回复。"""
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def _ask(char: Character, msg: Msg) -> Msg:
+        async with semaphore:
+            return await _ask_player(char, msg, structured)
+
+    return list(await asyncio.gather(*(_ask(c, m) for c, m in zip(players, msgs))))
+
+
+async def _ask_player(char: Character, msg: Msg, structured: bool) -> Msg:
+    if structured:
+        return await char.agent(msg, structured_model=PlayerAction)
+    return await char.agent(msg)
+
+
+async def _with_context(agent: PlayerAgent, text: str, context: ContextBuilder | None, profile: str = "") -> str:
+    """
+    启用上下文窗口时清空 agent 自身记忆，把窗口内容（profile 为该角色的背景）拼在本次消息之前。
+    调用前需先 context.update()。
+    """
+    if context is None:
+        return text
+    memory = getattr(agent, "memory", None)
+    if memory is not None:
+        # 真人玩家（HumanAgent）没有自身记忆
+        await memory.clear()
+    window = context.render(profile)
+    return f"{window}\n\n{text}" if window else text
+
+
+async def _broadcast_replies(participants: list[PlayerAgent], replies: list[tuple[PlayerAgent, Msg]]) -> None:
+    """按固定顺序把本轮回复广播给除发送者外的其他参与者。"""
+    for agent in participants:
+        msgs = [reply for sender, reply in replies if sender is not agent]
+        if msgs:
+            await agent.observe(msgs)
+
+
+async def _run_round(
+    hub: MsgHub,
+    prompt: str,
+    scene_id: str,
+    scene_name: str,
+    characters: Dict[str, Character],
+    memory: AsyncStoryMemory,
+    turn_mode: str,
+    concurrency: int,
+    context: ContextBuilder | None = None,
+    validator: ActionValidator | None = None,
+    choices: dict | None = None,
+    state: GameState | None = None,
+    gate: Callable[[], Awaitable[None]] | None = None,
+) -> list[tuple[Character, str, list[ActionRecord]]]:
+    """
+    一轮玩家发言，返回 [(角色, 回复文本, 动作), ...]。
+    sequential 时依次发言，每条回复立即写入记忆并广播给其他人；
+    concurrent 时并发发言，结束后按角色顺序统一写入记忆并广播。
+    启用 context 时不再广播，每次发言前由上下文窗口提供历史。
+    给出 validator 时玩家以 PlayerAction 结构化回复，动作校验后与发言一起写入记忆；
+    choices 为本轮可投的选项。给出 state 时每名玩家的消息附带其视角的状态摘要。
+    给出 gate 时每次发言前（concurrent 时本轮开始前）先 await gate()。
+    """
+    players = [c for c in characters.values() if c.agent in hub.participants]
+    structured = validator is not None
+
+    def _text(char: Character) -> str:
+        status = f"\n\n{state.summary(char.id)}" if state is not None else ""
+        # 主持人的这段话已写入记忆，启用上下文窗口时已在近期对话中，不再重复
+        head = "请根据以上主持人的发言行动。" if context is not None else prompt
+        return f"{head}{status}\n\n注意：时刻要注意自己当前要完成的任务，不要偏离任务目标！"
+
+    def _collect(char: Character, reply_msg: Msg) -> tuple[Character, str, list[ActionRecord]]:
+        content = _msg_content(reply_msg)
+        records: list[ActionRecord] = []
+        if structured:
+            action = _reply_action(reply_msg)
+            if action is None:
+                console.print(f"[dim]{char.name} 未给出结构化动作[/dim]")
+            else:
+                records, issues = validator.validate(char, action, choices)
+                for issue in issues:
+                    console.print(f"[dim]{char.name} {issue}，已忽略[/dim]")
+        actions = _action_text(records, characters)
+        if not _streaming(char.agent):
+            console.print(Panel(
+                content, title=f"[bold green]{char.name}[/bold green]", border_style="green",
+                subtitle=actions or None))
+        elif actions:
+            console.print(f"[dim]{char.name}：{actions}[/dim]")
+        return char, content, records
+
+    if turn_mode == "concurrent":
+        if gate is not None:
+            await gate()
+        if context is not None:
+            await context.update()
+        msgs = [Msg("moderator", await _with_context(c.agent, _text(c), context, c.background), "user")
+                for c in players]
+        replies = await _prompt_players(players, msgs, concurrency, structured)
+        result = [_collect(char, reply_msg) for char, reply_msg in zip(players, replies)]
+        await memory.add_turns([(scene_id, scene_name, char.id, char.name, content, records)
+                                for char, content, records in result])
+        if context is None:
+            await _broadcast_replies(
+                hub.participants,
+                [(char.agent, reply_msg) for char, reply_msg in zip(players, replies)])
+        return result
+    result = []
+    for char in players:
+        if gate is not None:
+            await gate()
+        if context is not None:
+            await context.update()
+        reply_msg = await _ask_player(
+            char, Msg("moderator", await _with_context(char.agent, _text(char), context, char.background), "user"),
+            structured)
+        char, content, records = _collect(char, reply_msg)
+        await memory.add_turns([(scene_id, scene_name, char.id, char.name, content, records)])
+        if context is None:
+            await _broadcast_replies(hub.participants, [(char.agent, reply_msg)])
+        result.append((char, content, records))
+    return result
+
+
+async def _announce(moderator: Character, text: str, scene_id: str, scene_name: str, memory: AsyncStoryMemory) -> None:
+    """输出并记录主持人旁白；玩家通过随后的发言轮收到该内容，主持人自身直接记入记忆。"""
+    msg = Msg("moderator", text, "assistant")
+    if _streaming(moderator.agent):
+        await moderator.agent.print(msg, True)
+    else:
+        console.print(
+            Panel(text, title="[bold]主持人[/bold]", border_style="yellow"))
+    await memory.add(scene_id, scene_name, moderator.id, moderator.name, text)
+    await moderator.agent.observe(msg)
+
+
+async def _narrate(
+    moderator: Character,
+    step: Step,
+    scene_id: str,
+    scene_name: str,
+    memory: AsyncStoryMemory,
+    context: ContextBuilder | None = None,
+    state: GameState | None = None,
+    validator: ActionValidator | None = None,
+) -> str:
+    """
+    主持人处理一个步骤：memory 块原样作为旁白；含 user 块时交给主持人按提示词组织发言，
+    给出 state 时附上全体状态摘要。给出 validator 时主持人以 ModeratorAction 结构化回复，
+    提示中要求的资金、道具发放与星级变化经 validator.moderate 结算后与旁白一起写入记忆。
+    返回主持人对玩家说的话。
+    """
+    lines = step.lines("memory")
+    instructions = [line for b in step.blocks if b.type != "memory" for line in b.lines]
+    if not instructions:
+        narration = "\n".join(lines)
+        await _announce(moderator, narration, scene_id, scene_name, memory)
+        return narration
+    if context is not None:
+        await context.update()
+    msg = Msg(
+        "user",
+        await _with_context(moderator.agent, "\n".join([
+            *lines, "", "主持人提示：", *instructions,
+            *(["", "对局状态：", state.summary()] if state is not None else []),
+            *(["", "提示中要求发放资金、道具或升降星级时，在 grants 与 stars 中填写，由系统结算。"]
+              if validator is not None else []),
+        ]), context),
+        "user")
+    records: list[ActionRecord] = []
+    if validator is None:
+        reply_msg = await moderator.agent(msg)
+    else:
+        reply_msg = await moderator.agent(msg, structured_model=ModeratorAction)
+        action = _reply_action(reply_msg, ModeratorAction)
+        if action is not None:
+            records, issues = validator.moderate(action)
+            for issue in issues:
+                console.print(f"[dim]主持人 {issue}，已忽略[/dim]")
+    narration = _msg_content(reply_msg)
+    actions = _action_text(records, validator.characters if validator is not None else {})
+    if not _streaming(moderator.agent):
+        console.print(Panel(narration, title="[bold]主持人[/bold]", border_style="yellow",
+                            subtitle=actions or None))
+    elif actions:
+        console.print(f"[dim]主持人：{actions}[/dim]")
+    await memory.add_turns([(scene_id, scene_name, moderator.id, moderator.name, narration, records)])
+    return narration
+
+
+def _parse_vote(content: str, choices: dict[str, object]) -> str | None:
+    """在回复中找出最先出现的选项 key。"""
+    hits = [(content.find(key), key) for key in choices if key in content]
+    return min(hits)[1] if hits else None
+
+
+async def _run_choice(
+    hub: MsgHub,
+    moderator: Character,
+    scene: Scene,
+    scene_id: str,
+    scene_name: str,
+    characters: Dict[str, Character],
+    memory: AsyncStoryMemory,
+    turn_mode: str,
+    concurrency: int,
+    context: ContextBuilder | None = None,
+    validator: ActionValidator | None = None,
+    state: GameState | None = None,
+    gate: Callable[[], Awaitable[None]] | None = None,
+) -> str:
+    """让玩家对场景 choices 投票，多数票胜出，平票取靠前的选项。结构化回复直接取 vote 动作。"""
+    choices = scene.choices
+    options = "\n".join(f"{key}: {choice.description}" for key, choice in choices.items())
+    prompt = f"现在需要大家做出选择，请在回复中写明选项编号：\n{options}"
+    await _announce(moderator, prompt, scene_id, scene_name, memory)
+    replies = await _run_round(hub, prompt, scene_id, scene_name,
+                               characters, memory, turn_mode, concurrency, context, validator, choices, state, gate)
+    votes = {key: 0 for key in choices}
+    for _char, content, records in replies:
+        voted = [r.name for r in records if r.kind == "vote"]
+        key = voted[0] if voted else _parse_vote(content, choices)
+        if key is not None:
+            votes[key] += 1
+    choice = max(votes, key=lambda k: votes[k])
+    console.print(f"[bold cyan]选择结果[/bold cyan] {choice} {votes}")
+    return choice
+
+
+def _next_scene_index(story: Story, index: int, choice: str | None) -> int:
+    """选项指定了 next 场景时跳转，否则进入下一个场景。"""
+    target = story.scenes[index].choices.get(choice) if choice is not None else None
+    if target is not None and target.next:
+        next_index = story.scene_index(target.next)
+        if next_index is not None:
+            return next_index
+    return index + 1
+
+
+def _resume_position(story: Story, last: dict | None) -> tuple[int, int]:
+    """根据记忆中最后完成的步骤 last 计算续跑位置 (场景序号, 步骤序号)。"""
+    if last is None:
+        return 0, 0
+    for scene in story.scenes:
+        if scene.key != last["scene_id"]:
+            continue
+        if last["step_index"] + 1 < len(scene.steps):
+            return scene.index, last["step_index"] + 1
+        if last["step_index"] < len(scene.steps) and scene.choices:
+            return scene.index, len(scene.steps)
+        return _next_scene_index(story, scene.index, last["choice"]), 0
+    return 0, 0
+
+
+async def _restore_history(participants: list[PlayerAgent], memory: AsyncStoryMemory) -> int:
+    """续跑时把已记录的对话回放给所有参与者，不产生模型调用。"""
+    history = [Msg(row["character_name"], row["content"], "assistant")
+               async for row in memory.iter_all()]
+    if history:
+        for agent in participants:
+            await agent.observe(history)
+    return len(history)
+
+
+@contextlib.asynccontextmanager
+async def _rollback_on_error(memory: AsyncStoryMemory, state: GameState | None):
+    """步骤执行出错时撤销该步骤内的状态修改，并删除该步骤已写入的对话与动作，续跑时整步重来。"""
+    mark = state.checkpoint() if state is not None else 0
+    try:
+        yield
+    except BaseException:
+        if state is not None:
+            state.rollback(mark)
+        await memory.discard_unfinished()
+        raise
+
+
+async def _finish_step(
+    memory: AsyncStoryMemory,
+    state: GameState | None,
+    scene_id: str,
+    step_index: int,
+    choice: str | None = None,
+) -> None:
+    """增量写入本步骤的状态改动并记录进度（mark_step 会一并提交）。"""
+    if state is not None:
+        await memory.save_state(state.dirty_rows())
+        state.commit()
+    await memory.mark_step(scene_id, step_index, choice)
+
+
+async def run_scenes(
+    story: Story,
+    moderator: Character,
+    characters: Dict[str, Character],
+    memory: AsyncStoryMemory,
+    turn_mode: str = "sequential",
+    concurrency: int = 5,
+    context: ContextBuilder | None = None,
+    validator: ActionValidator | None = None,
+    state: GameState | None = None,
+    gate: Callable[[], Awaitable[None]] | None = None,
+):
+    """
+    按顺序推演全部场景与步骤，逐步下发给角色，遇到 choices 时投票选择分支。
+    每完成一个步骤在记忆中记录进度，重新运行时从最后完成的步骤之后继续。
+    给出 context 时各 agent 不再累积自身记忆，每次发言的历史由上下文窗口按 token 预算组装。
+    给出 validator 时玩家使用结构化回复，动作写入记忆的 actions 表。
+    步骤出错时删除该步骤已写入的对话与动作，给出 state 时一并回滚该步骤内的状态修改；
+    续跑前同样丢弃上次未完成步骤的残留记录，并从记忆恢复对局状态。
+    步骤完成时把状态改动与进度一起写入记忆。
+    给出 gate 时每个步骤开始前、每次发言前与步骤完成前都先 await gate()，用于暂停对局；
+    gate 抛出异常可在发言之间停止对局，未完成的步骤按出错处理。
+    """
     participants: list[PlayerAgent] = [moderator.agent,
                                        *[c.agent for c in characters.values()]]
-    scene = story["master"][1]
-    scene_id = scene["id"]
-    scene_name = scene.get("name", "场景 2")
-    console.print(Rule(f"[bold cyan]{scene_name}[/bold cyan]", style="cyan"))
-    async with MsgHub(participants=participants) as scene_hub:
-        if "prompts" in scene:
-            prompt = f"现在是第二幕, {', '.join(scene['prompts'])}\n\n注意：时刻要注意自己当前要完成的任务，不要偏离任务目标！"
-            console.print(
-                Panel(prompt, title="[bold]主持人[/bold]", border_style="yellow"))
-            memory.add(scene_id, scene_name, moderator.id,
-                       moderator.name, json.dump({
-                           "type": "text",
-                           "text": prompt
-                       }))
-            for agent in scene_hub.participants:
-                if agent.name == "moderator":
-                    continue
-                reply_msg = await agent(Msg("moderator", prompt, "user"))
-                content = _msg_content(reply_msg)
-                console.print(Panel(
-                    content, title=f"[bold green]{agent.name}[/bold green]", border_style="green"))
-                char = next((c for c in characters.values()
-                            if c.agent is agent), None)
-                if char:
-                    memory.add(scene_id, scene_name,
-                               char.id, char.name, content)
-    console.print(Rule(style="dim"))
+    scenes = story.scenes
+    # 上次异常退出时未完成步骤写入的记录不参与续跑，该步骤会整步重来
+    discarded = await memory.discard_unfinished()
+    if discarded:
+        console.print(f"[dim]已丢弃未完成步骤的 {discarded} 条记录[/dim]")
+    index, step_index = _resume_position(story, await memory.last_step())
+    if state is not None:
+        rows = await memory.load_state()
+        if rows:
+            state.load_rows(rows)
+    async with MsgHub(participants=participants, enable_auto_broadcast=False) as hub:
+        if (index > 0 or step_index > 0) and context is None:
+            restored = await _restore_history(hub.participants, memory)
+            console.print(f"[dim]从第 {index + 1} 幕步骤 {step_index + 1} 继续，已回放 {restored} 条记录[/dim]")
+        while index < len(scenes):
+            scene = scenes[index]
+            scene_id = scene.key
+            scene_name = scene.title
+            steps = scene.steps
+            console.print(Rule(f"[bold cyan]{scene_name}[/bold cyan]", style="cyan"))
+            for i in range(step_index, len(steps)):
+                if gate is not None:
+                    await gate()
+                async with _rollback_on_error(memory, state):
+                    narration = await _narrate(moderator, steps[i], scene_id, scene_name, memory, context, state,
+                                               validator)
+                    await _run_round(hub, narration, scene_id, scene_name, characters, memory,
+                                     turn_mode, concurrency, context, validator, None, state, gate)
+                    if gate is not None:
+                        # 最后一次发言被中断时不能记为完成
+                        await gate()
+                await _finish_step(memory, state, scene_id, i)
+            choice = None
+            if scene.choices:
+                if gate is not None:
+                    await gate()
+                async with _rollback_on_error(memory, state):
+                    choice = await _run_choice(hub, moderator, scene, scene_id, scene_name, characters,
+                                               memory, turn_mode, concurrency, context, validator, state, gate)
+                    if gate is not None:
+                        await gate()
+                await _finish_step(memory, state, scene_id, len(steps), choice)
+            index = _next_scene_index(story, index, choice)
+            step_index = 0
+            console.print(Rule(style="dim"))
+
+
+def _print_model_stats() -> None:
+    table = Table(title="模型调用统计")
+    table.add_column("模型", style="cyan")
+    for column in ("调用", "失败", "输入 tokens", "输出 tokens", "平均耗时", "最长耗时", "排队"):
+        table.add_column(column, justify="right")
+    for name, stats in model_registry.stats().items():
+        table.add_row(name, str(stats["calls"]), str(stats["errors"]),
+                      str(stats["input_tokens"]), str(stats["output_tokens"]),
+                      f"{stats['latency_avg']:.2f}s", f"{stats['latency_max']:.2f}s", f"{stats['wait_total']:.2f}s")
+    console.print(table)
 
 
 if __name__ == "__main__":
     parser.add_argument("--story", type=str, default="shou_huo_ri")
     parser.add_argument("--config", type=str, default="config.yaml")
+    parser.add_argument("--turn-mode", type=str, default="sequential",
+                        choices=["sequential", "concurrent"], help="玩家发言方式：依次或并发")
+    parser.add_argument("--concurrency", type=int, default=5, help="并发模式下同时发言的玩家上限")
+    parser.add_argument("--session", type=str, default="", help="对局 ID，同一剧本的多局游戏按此区分记忆与进度")
+    parser.add_argument("--context-budget", type=int, default=0,
+                        help="上下文窗口 token 预算，大于 0 时由记忆组装每次发言的历史")
+    parser.add_argument("--reply-mode", type=str, default="structured", choices=["structured", "text"],
+                        help="玩家回复方式：structured 一次返回发言与动作，text 为纯文本")
+    parser.add_argument("--initial-money", type=int, default=0, help="每名玩家的初始资金")
+    parser.add_argument("--star-cost", type=int, default=0, help="每升一星每名玩家需支付的金额")
+    parser.add_argument("--replay", type=str, default="off", choices=REPLAY_MODES,
+                        help="回复录制 / 回放：record 录制，replay 只回放（离线），auto 命中回放、未命中录制")
+    parser.add_argument("--replay-dir", type=str, default="", help="回放缓存目录，默认 results/.cache/replies")
+    parser.add_argument("--web", type=int, default=0,
+                        help="大于 0 时在该端口同时启动网站，可在 /live/<频道> 观看本局的流式输出")
+    parser.add_argument("--model-concurrency", type=int, default=None,
+                        help="全局同时在途的模型请求上限（0 不限），默认读取环境变量 MODEL_MAX_CONCURRENCY")
+    parser.add_argument("--model-qps", type=float, default=None,
+                        help="全局每秒模型请求上限（0 不限），默认读取环境变量 MODEL_QPS")
     # 解析参数
     args = parser.parse_args()
     story_id = args.story
@@ -158,9 +738,37 @@ if __name__ == "__main__":
     # 读取文件
     story = parse_story(story_id)
     # 创建游戏对象
-    memory = StoryMemory(story_id)
+    model_registry.configure(args.model_concurrency, args.model_qps)
+    if args.replay != "off":
+        PlayerAgent.reply_cache = (ReplyCache(args.replay, args.replay_dir) if args.replay_dir
+                                   else ReplyCache(args.replay))
+    memory_pool = StoryMemoryPool(story_id)
+    memory = memory_pool.session(args.session)
+    context = ContextBuilder(memory, budget=args.context_budget) if args.context_budget > 0 else None
     moderator = create_moderator(config)
-    characters = create_characters(story["characters"], config)
+    characters = create_characters(story.characters, config, background_in_prompt=context is None)
+    state = GameState.from_story(story, initial_money=args.initial_money, star_cost=args.star_cost)
+    validator = ActionValidator(story, characters, state) if args.reply_mode == "structured" else None
+    # 流式输出：控制台逐字渲染，并发布到事件总线
+    channel = live_channel(story_id, args.session)
+    view = LiveView(channel)
+    for agent in [moderator.agent, *[c.agent for c in characters.values()]]:
+        agent.stream_listener = view
+    if args.web:
+        from server import app
+        threading.Thread(target=app.run, kwargs={"host": "0.0.0.0", "port": args.web, "threaded": True},
+                         daemon=True).start()
+        console.print(f"[dim]观战地址：http://127.0.0.1:{args.web}/live/{channel}[/dim]")
     # 按顺序进行场景推演
     console.print(Rule(f"[bold cyan]开始游戏[/bold cyan]", style="cyan"))
-    asyncio.run(run_scenes(story, moderator, characters, memory))
+    with memory_pool:
+        try:
+            asyncio.run(run_scenes(story, moderator, characters, memory,
+                                   turn_mode=args.turn_mode, concurrency=args.concurrency, context=context,
+                                   validator=validator, state=state))
+        finally:
+            view.close()
+    _print_model_stats()
+    if PlayerAgent.reply_cache is not None:
+        console.print(f"[dim]回放缓存：命中 {PlayerAgent.reply_cache.hits}，"
+                      f"未命中 {PlayerAgent.reply_cache.misses}[/dim]")
@@ -1,8 +1,16 @@
 import json
+import random
+import threading
+import time
 import dotenv
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from pathlib import Path
+from typing import Callable
+from urllib.parse import urlparse
 import alibabacloud_oss_v2 as oss
 import requests
+from requests.adapters import HTTPAdapter
 import argparse
 from rich.console import Console
 from rich.panel import Panel
@@ -10,6 +18,12 @@ from rich.progress import Progress, BarColumn, TextColumn, TaskProgressColumn
 from rich.rule import Rule
 from rich.table import Table
 import os
+
+from oss_sync import PREFIX_SUFFIXES, AliyunOSS, LocalOSS, OSSSync
+from store.generations import GenerationCache, request_key
+from store.model import Scene
+from store.stories import repository
+
 dotenv.load_dotenv()
 
 credentials_provider = oss.credentials.EnvironmentVariableCredentialsProvider()
@@ -21,24 +35,57 @@ client = oss.Client(config=cfg)
 
 parser = argparse.ArgumentParser()
 
-STATUS_TEXT = {"running": "进行中", "succeeded": "成功", "failed": "失败"}
+STATUS_TEXT = {"queued": "排队中", "running": "进行中", "succeeded": "成功", "failed": "失败"}
 
 NANO_BANANA_API_KEY = os.getenv("NANO_BANANA_API_KEY")
 NANO_BANANA_API_URL = os.getenv("NANO_BANANA_API_URL")
 OSS_URL = os.getenv("OSS_URL")
 RESULTS_DIR = Path(__file__).resolve().parent / "results"
 RESOURCE_DIR = Path(__file__).resolve().parent / "resources"
+OSS_MANIFEST_PATH = RESOURCE_DIR / ".oss_manifest.json"
+# HTTP 超时（秒）：连接超时；SSE 两条进度之间 / 下载两块数据之间的最长等待
+CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "10"))
+READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "300"))
+# 每个 host 保持的长连接数上限，应不小于批量生成的并发数
+HTTP_POOL_SIZE = 16
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+# 绘图计费（见 README 成本统计）：平台单价（积分/张）× 倍率 = 人民币/张
+GENERATION_PRICE = 1800
+PRICE_RATE = 0.0001
+PLAN_TEXT = {"fresh": "最新", "untracked": "已存在（未记录）", "cached": "本地缓存", "generate": "需生成"}
 console = Console()
+generation_cache = GenerationCache()
+
+_http_session: requests.Session | None = None
+_http_session_lock = threading.Lock()
+
+
+def http_session() -> requests.Session:
+    """进程内共享的 HTTP 会话：绘图 API 与结果下载复用 keep-alive 连接，避免每次重新握手。"""
+    global _http_session
+    with _http_session_lock:
+        if _http_session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _http_session = session
+        return _http_session
 
 
 def _download_image(url: str, save_path: Path) -> None:
-    """下载图片并保存到指定路径。"""
-    r = requests.get(url, stream=True)
-    r.raise_for_status()
-    save_path.parent.mkdir(parents=True, exist_ok=True)
-    with open(save_path, "wb") as f:
-        for chunk in r.iter_content(chunk_size=8192):
-            f.write(chunk)
+    """流式下载图片，先写临时文件再原子替换，中断时不会留下半张图。"""
+    with http_session().get(url, stream=True, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT)) as r:
+        r.raise_for_status()
+        save_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = save_path.with_name(f".{save_path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            with open(tmp, "wb") as f:
+                for chunk in r.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                    f.write(chunk)
+            os.replace(tmp, save_path)
+        finally:
+            tmp.unlink(missing_ok=True)
 
 
 def _parse_sse_line(line: str) -> dict | None:
@@ -56,10 +103,90 @@ def _parse_sse_line(line: str) -> dict | None:
 
 
 def _load_story(story_id: str) -> dict:
-    """加载 data 目录下故事 JSON，只读一次。"""
-    path = Path(__file__).resolve().parent / "data" / f"story__{story_id}.json"
-    with open(path, "r", encoding="utf-8") as f:
-        return json.load(f)
+    """加载 data 目录下故事 JSON，经仓库缓存，文件未变化时不重复解析。"""
+    return repository.get(story_id)
+
+
+@dataclass
+class GenerationJob:
+    """一次绘图请求及其保存位置。"""
+    title: str
+    prompt: str
+    urls: list[str]
+    save_path: Path
+    aspect_ratio: str = "9:16"
+    image_size: str = "1K"
+    model: str = "nano-banana-pro"
+
+    @property
+    def key(self) -> str:
+        return request_key(self.model, self.prompt, self.urls, self.aspect_ratio, self.image_size)
+
+    def request_body(self) -> dict:
+        return {
+            "model": self.model,
+            "urls": self.urls,
+            "prompt": self.prompt,
+            "aspectRatio": self.aspect_ratio,
+            "imageSize": self.image_size,
+        }
+
+
+class GenerationError(Exception):
+    """绘图 API 返回失败状态。"""
+
+
+def _stream_generation(request_body: dict, on_progress: Callable[[int, str], None]) -> dict:
+    """调用绘图 API 并读取 SSE 进度，每条进度回调 on_progress(progress, status)，返回最后一条数据。"""
+    last: dict = {}
+    with http_session().post(
+        NANO_BANANA_API_URL,
+        json=request_body,
+        headers={"Authorization": f"Bearer {NANO_BANANA_API_KEY}"},
+        stream=True,
+        timeout=(CONNECT_TIMEOUT, READ_TIMEOUT),
+    ) as response:
+        response.raise_for_status()
+        for raw_line in response.iter_lines(decode_unicode=True):
+            if raw_line is None:
+                continue
+            data = _parse_sse_line(raw_line)
+            if data is None:
+                continue
+            last = data
+            s = data.get("status", "running")
+            on_progress(data.get("progress", 0), s)
+            if s in ("succeeded", "failed"):
+                break
+    return last
+
+
+def _result_url(last: dict) -> str:
+    """取出生成结果的图片 URL；失败状态抛 GenerationError，无结果返回空字符串。"""
+    if last.get("status") == "succeeded" and last.get("results"):
+        return last["results"][0].get("url", "")
+    if last.get("status") == "failed":
+        raise GenerationError(last.get("failure_reason") or last.get("error") or "未知错误")
+    return ""
+
+
+def _save_result(last: dict, save_path: Path) -> str:
+    """下载生成结果到 save_path 并返回图片 URL；失败状态抛 GenerationError，无结果返回空字符串。"""
+    image_url = _result_url(last)
+    if image_url:
+        _download_image(image_url, save_path)
+    return image_url
+
+
+def _progress_display() -> Progress:
+    return Progress(
+        TextColumn("[bold blue]{task.description}"),
+        BarColumn(bar_width=40),
+        TaskProgressColumn(),
+        TextColumn("—"),
+        TextColumn("[cyan]{task.fields[status]}"),
+        expand=True,
+    )
 
 
 def generate_image(
@@ -73,13 +200,8 @@ def generate_image(
     show_request_panel: bool = True,
 ) -> str:
     """调用绘图 API 生成图片并保存到指定路径。返回图片 URL，失败返回空字符串。"""
-    request_body = {
-        "model": "nano-banana-pro",
-        "urls": urls,
-        "prompt": prompt,
-        "aspectRatio": aspect_ratio,
-        "imageSize": image_size,
-    }
+    job = GenerationJob(request_title, prompt, urls, save_path, aspect_ratio, image_size)
+    request_body = job.request_body()
     if show_request_panel:
         console.print(Panel(
             f"[bold]model[/bold] {request_body['model']}\n"
@@ -89,195 +211,349 @@ def generate_image(
             title=f"[yellow]{request_title}[/yellow]",
             border_style="yellow",
         ))
-    response = requests.post(
-        NANO_BANANA_API_URL,
-        json=request_body,
-        headers={"Authorization": f"Bearer {NANO_BANANA_API_KEY}"},
-        stream=True,
+    with _progress_display() as progress:
+        task = progress.add_task("生成中", total=100, status=STATUS_TEXT["running"])
+        last = _stream_generation(
+            request_body,
+            lambda p, s: progress.update(task, completed=p, status=STATUS_TEXT.get(s, s)))
+    try:
+        image_url = _save_result(last, save_path)
+    except GenerationError as e:
+        console.print(Panel(str(e), title="[red]生成失败[/red]", border_style="red"))
+        return ""
+    if image_url:
+        console.print(Panel(f"[green]已保存[/green] [cyan]{save_path}[/cyan]", title="完成", border_style="green"))
+    return image_url
+
+
+def generation_cost(count: int) -> float:
+    """生成 count 张图片的费用（人民币）。"""
+    return count * GENERATION_PRICE * PRICE_RATE
+
+
+def plan_job(job: GenerationJob) -> str:
+    """
+    判断任务状态：fresh 输出文件由相同请求生成；untracked 文件已存在但没有生成记录；
+    cached 请求命中本地缓存；generate 需要调用 API 付费生成。
+    """
+    key = job.key
+    if job.save_path.is_file():
+        recorded = generation_cache.recorded(job.save_path)
+        if recorded == key:
+            return "fresh"
+        if recorded is None:
+            return "untracked"
+    if generation_cache.has(key):
+        return "cached"
+    return "generate"
+
+
+def _remember(job: GenerationJob, image_url: str = "") -> None:
+    """把输出文件存入缓存并记录其请求 key。"""
+    generation_cache.put(job.key, job.save_path, {**job.request_body(), "title": job.title, "image_url": image_url})
+    generation_cache.record(job.save_path, job.key)
+
+
+def prepare_jobs(jobs: list[GenerationJob]) -> list[GenerationJob]:
+    """
+    处理不需要调用 API 的任务，返回仍需生成的任务：最新的跳过；缓存命中的直接复制到输出位置；
+    已存在但未记录的文件视为当前请求的结果纳入缓存，此后修改描述即可触发重新生成。
+    """
+    pending = []
+    for job in jobs:
+        status = plan_job(job)
+        if status == "fresh":
+            console.print(f"[dim]跳过（最新）[/dim] {job.title}")
+        elif status == "untracked":
+            _remember(job)
+            console.print(f"[dim]跳过（已存在）[/dim] {job.title}")
+        elif status == "cached":
+            generation_cache.restore(job.key, job.save_path)
+            generation_cache.record(job.save_path, job.key)
+            console.print(f"[green]从缓存恢复[/green] {job.title} → [cyan]{job.save_path}[/cyan]")
+        else:
+            pending.append(job)
+    return pending
+
+
+def generate_job(job: GenerationJob, request_title: str = "请求参数") -> str:
+    """生成单个任务（先查缓存），成功后写入缓存。返回图片 URL，跳过或失败返回空字符串。"""
+    if not prepare_jobs([job]):
+        return ""
+    image_url = generate_image(
+        job.prompt,
+        job.urls,
+        job.save_path,
+        aspect_ratio=job.aspect_ratio,
+        image_size=job.image_size,
+        request_title=request_title,
     )
-    response.raise_for_status()
+    if image_url:
+        _remember(job, image_url)
+    return image_url
 
-    last: dict = {}
-    with Progress(
-        TextColumn("[bold blue]{task.description}"),
-        BarColumn(bar_width=40),
-        TaskProgressColumn(),
-        TextColumn("—"),
-        TextColumn("[cyan]{task.fields[status]}"),
-        expand=True,
-    ) as progress:
-        task = progress.add_task("生成中", total=100, status=STATUS_TEXT["running"])
-        for raw_line in response.iter_lines(decode_unicode=True):
-            if raw_line is None:
-                continue
-            data = _parse_sse_line(raw_line)
-            if data is None:
-                continue
-            last = data
-            p = data.get("progress", 0)
-            s = data.get("status", "running")
-            progress.update(task, completed=p, status=STATUS_TEXT.get(s, s))
-            if s in ("succeeded", "failed"):
-                break
 
-    if last.get("status") == "succeeded" and last.get("results"):
-        image_url = last["results"][0].get("url", "")
-        if image_url:
-            save_path.parent.mkdir(parents=True, exist_ok=True)
-            _download_image(image_url, save_path)
-            console.print(Panel(f"[green]已保存[/green] [cyan]{save_path}[/cyan]", title="完成", border_style="green"))
-            return image_url
-    elif last.get("status") == "failed":
-        console.print(Panel(
-            last.get("failure_reason") or last.get("error") or "未知错误",
-            title="[red]生成失败[/red]",
-            border_style="red",
-        ))
-    return ""
+class RateLimiter:
+    """按最小间隔限制请求发起频率，rate 为每秒请求数，0 表示不限。线程安全。"""
 
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next = 0.0
+        self._lock = threading.Lock()
 
-def generate_character(story_id: str, character_id: str, story_data: dict | None = None) -> str:
-    """生成角色立绘并保存到 results/{story_id}/characters/{character_id}.png。"""
+    def acquire(self) -> None:
+        with self._lock:
+            now = time.monotonic()
+            wait = max(0.0, self._next - now)
+            self._next = max(now, self._next) + self.interval
+        if wait:
+            time.sleep(wait)
+
+
+_rate_limiters: dict[str, RateLimiter] = {}
+_rate_limiters_lock = threading.Lock()
+
+
+def _provider_limiter(url: str, rate: float) -> RateLimiter:
+    """同一服务商（按 host 区分）共用一个限流器。"""
+    host = urlparse(url or "").netloc
+    with _rate_limiters_lock:
+        if host not in _rate_limiters:
+            _rate_limiters[host] = RateLimiter(rate)
+        return _rate_limiters[host]
+
+
+def _is_transient(error: Exception) -> bool:
+    """网络错误、超时、429 与 5xx 视为可重试。"""
+    if isinstance(error, (requests.ConnectionError, requests.Timeout)):
+        return True
+    if isinstance(error, requests.HTTPError) and error.response is not None:
+        return error.response.status_code == 429 or error.response.status_code >= 500
+    return False
+
+
+def run_generation_queue(
+    jobs: list[GenerationJob],
+    *,
+    workers: int = 4,
+    rate: float = 1.0,
+    retries: int = 3,
+    backoff: float = 2.0,
+) -> dict[Path, str]:
+    """
+    并发执行绘图任务：最多 workers 个同时进行，同一服务商每秒最多发起 rate 个请求，
+    可重试错误按 backoff * 2^n 秒（加随机抖动）退避，最多重试 retries 次；
+    已生成成功、只是下载失败的任务只重试下载。
+    最新或可从缓存恢复的任务不调用 API（见 prepare_jobs），成功生成的图片写入缓存。
+    所有任务共用一个 rich 进度面板，返回 {save_path: 图片 URL（失败为空字符串）}。
+    """
+    jobs = prepare_jobs(jobs)
+    if not jobs:
+        return {}
+    limiter = _provider_limiter(NANO_BANANA_API_URL, rate)
+    results: dict[Path, str] = {}
+    errors: dict[Path, str] = {}
+    with _progress_display() as progress:
+        tasks = {job.save_path: progress.add_task(job.title, total=100, status=STATUS_TEXT["queued"])
+                 for job in jobs}
+
+        def work(job: GenerationJob) -> str:
+            task = tasks[job.save_path]
+            # 生成成功后保留结果 URL，之后的重试只重新下载，不再付费生成
+            image_url = ""
+            for attempt in range(retries + 1):
+                try:
+                    if not image_url:
+                        limiter.acquire()
+                        progress.update(task, completed=0, status=STATUS_TEXT["running"])
+                        last = _stream_generation(
+                            job.request_body(),
+                            lambda p, s: progress.update(task, completed=p, status=STATUS_TEXT.get(s, s)))
+                        image_url = _result_url(last)
+                        if not image_url:
+                            progress.update(task, completed=100, status="无结果")
+                            return ""
+                    progress.update(task, status="下载中")
+                    _download_image(image_url, job.save_path)
+                    _remember(job, image_url)
+                    progress.update(task, completed=100, status=STATUS_TEXT["succeeded"])
+                    return image_url
+                except Exception as e:
+                    if not _is_transient(e) or attempt == retries:
+                        errors[job.save_path] = str(e)
+                        progress.update(task, status=f"[red]{STATUS_TEXT['failed']}[/red]")
+                        return ""
+                    delay = backoff * 2 ** attempt + random.uniform(0, 1)
+                    action = "重新下载" if image_url else "重试"
+                    progress.update(task, status=f"{action} {attempt + 1}/{retries}（{delay:.0f} 秒后）")
+                    time.sleep(delay)
+            return ""
+
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            for job, image_url in zip(jobs, pool.map(work, jobs)):
+                results[job.save_path] = image_url
+
+    table = Table(title="生成结果")
+    table.add_column("任务", style="cyan")
+    table.add_column("结果")
+    for job in jobs:
+        if results[job.save_path]:
+            table.add_row(job.title, f"[green]已保存[/green] {job.save_path}")
+        else:
+            table.add_row(job.title, f"[red]{errors.get(job.save_path, '无结果')}[/red]")
+    console.print(table)
+    return results
+
+
+def character_job(story_id: str, character_id: str, story_data: dict | None = None) -> GenerationJob:
+    """构造角色立绘任务，保存到 results/{story_id}/characters/{character_id}.png。"""
     if story_data is None:
-        story_data = _load_story(story_id)
+        # 只取这一个角色，不解析整份剧本
+        character = repository.story(story_id).character(character_id)
+    else:
+        character = next((c for c in story_data.get("characters", []) if c["id"] == character_id), None)
     prompt_text = ""
+    title = character_id
     urls = []
-    for character in story_data.get("characters", []):
-        if character["id"] == character_id:
-            prompt_text = character["description"] + "\n" + character["introduction"]
-            urls.append(f"{OSS_URL}/{story_id}/characters/{character_id}.png")
-            break
+    if character is not None:
+        prompt_text = character["description"] + "\n" + character["introduction"]
+        title = character["name"]
+        urls.append(f"{OSS_URL}/{story_id}/characters/{character_id}.png")
     prompt = f"参考图片绘制一张写实动漫风格的角色图片，彩色，上半身，正面，不要有任何其他元素，图片的描述如下：{prompt_text}"
     save_path = RESULTS_DIR / story_id / "characters" / f"{character_id}.png"
-    return generate_image(
-        prompt,
-        urls,
-        save_path,
-        aspect_ratio="9:16",
-        request_title="角色图片",
-    )
-
-
-def _character_image_exists(story_id: str, character_id: str) -> bool:
-    """检查角色图片是否已存在。"""
-    return (RESULTS_DIR / story_id / "characters" / f"{character_id}.png").is_file()
-
-
-def fetch_local_resources(prefix: str) -> list[str]:
-    result = []
-    for file in (RESOURCE_DIR / prefix).glob("*.png"):
-        result.append(file.name)
-    return result
+    return GenerationJob(title, prompt, urls, save_path, aspect_ratio="9:16")
 
 
-def fetch_oss_objects(story_id: str, prefix: str) -> list[str]:
-    result = []
-    paginator = client.list_objects_v2_paginator()
-    for page in paginator.iter_page(oss.ListObjectsV2Request(
-        bucket="aimmg",
-        prefix=f"{story_id}/{prefix}/",
-        delimiter="/"
-    )):
-        for obj in page.contents:
-            filename = obj.key.split("/")[-1]
-            if filename.endswith(".png"):
-                result.append(filename)
-    return result
+def generate_character(story_id: str, character_id: str, story_data: dict | None = None) -> str:
+    """生成角色立绘并保存到 results/{story_id}/characters/{character_id}.png。"""
+    return generate_job(character_job(story_id, character_id, story_data), request_title="角色图片")
 
 
-def compare_resources(story_id: str, prefix: str) -> list[str]:
-    # 需要上传的文件列表
-    result = []
-    local_resources = fetch_local_resources(prefix)
-    oss_resources = fetch_oss_objects(story_id, prefix)
-    for local_resource in local_resources:
-        if local_resource not in oss_resources:
-            result.append(local_resource)
-    return result
+def character_jobs(story_id: str) -> list[GenerationJob]:
+    """该故事下全部角色立绘任务，是否需要生成由 prepare_jobs 判断。"""
+    story_data = _load_story(story_id)
+    return [character_job(story_id, char["id"], story_data) for char in story_data.get("characters", [])]
 
 
-def _scene_image_exists(story_id: str, scene_id: str) -> bool:
-    """检查场景图片是否已存在。"""
-    return (RESULTS_DIR / story_id / "scenes" / f"{scene_id}.png").is_file()
+def scene_job(story_id: str, scene: Scene) -> GenerationJob | None:
+    """构造场景图任务，保存到 results/{story_id}/scenes/{scene_id}.png；缺少 id 或剧本片段时返回 None。"""
+    if not scene.id:
+        return None
+    # 用场景名称 + 场景 prompts（没有时取首个步骤的旁白）作为描述
+    lines = scene.prompts or (scene.steps[0].lines("memory") if scene.steps else ())
+    if not lines:
+        console.print(f"[dim]场景 {scene.id} 没有剧本片段[/dim]")
+        return None
+    prompt_text = "\n".join([scene.title, *lines])
+    prompt = f"参考以下剧本场景描述，绘制一张写实动漫风格的场景插画，彩色，氛围感强，不要出现具体人物正脸，描述如下：{prompt_text}"
+    save_path = RESULTS_DIR / story_id / "scenes" / f"{scene.id}.png"
+    return GenerationJob(scene.title, prompt, [], save_path, aspect_ratio="16:9")
 
 
-def generate_scene(story_id: str, scene: dict, scene_index: int = 0) -> str:
+def generate_scene(story_id: str, scene: Scene) -> str:
     """生成场景图并保存到 results/{story_id}/scenes/{scene_id}.png。"""
-    scene_id = scene.get("id", "")
-    if not scene_id:
-        return ""
-    # 用场景名称 + 首段 prompts/notes 作为描述
-    name = scene.get("name") or f"第 {scene_index + 1} 幕"
-    parts = [name]
-    if "prompts" not in scene:
-        console.print(f"[dim]场景 {scene_id} 没有剧本片段[/dim]")
+    job = scene_job(story_id, scene)
+    if job is None:
         return ""
-    parts.extend(scene["prompts"])
-    prompt_text = "\n".join(parts)
-    prompt = f"参考以下剧本场景描述，绘制一张写实动漫风格的场景插画，彩色，氛围感强，不要出现具体人物正脸，描述如下：{prompt_text}"
-    urls = []
-    save_path = RESULTS_DIR / story_id / "scenes" / f"{scene_id}.png"
-    console.print(prompt)
-    console.print(save_path)
-    return generate_image(
-        prompt,
-        urls,
-        save_path,
-        aspect_ratio="16:9",
-        request_title="场景图片",
-    )
+    console.print(job.prompt)
+    console.print(job.save_path)
+    return generate_job(job, request_title="场景图片")
+
+
+def scene_jobs(story_id: str) -> list[GenerationJob]:
+    """该故事下全部场景图任务，是否需要生成由 prepare_jobs 判断。"""
+    jobs = []
+    for scene in repository.model(story_id).scenes:
+        job = scene_job(story_id, scene)
+        if job is not None:
+            jobs.append(job)
+    return jobs
+
+
+def plan_story(story_id: str, kinds: tuple[str, ...] = ("characters", "scenes")) -> list[tuple[GenerationJob, str]]:
+    """列出各图片任务的状态与预计费用，不执行任何生成。"""
+    jobs = []
+    if "characters" in kinds:
+        jobs.extend(character_jobs(story_id))
+    if "scenes" in kinds:
+        jobs.extend(scene_jobs(story_id))
+    planned = [(job, plan_job(job)) for job in jobs]
+    table = Table(title=f"生成计划 — {story_id}")
+    table.add_column("任务", style="cyan")
+    table.add_column("文件")
+    table.add_column("状态")
+    table.add_column("费用（元）", justify="right")
+    for job, status in planned:
+        text = PLAN_TEXT[status]
+        if status == "generate":
+            text = f"[yellow]{text}[/yellow]"
+        elif status == "cached":
+            text = f"[green]{text}[/green]"
+        cost = f"{generation_cost(1):.2f}" if status == "generate" else "0"
+        table.add_row(job.title, job.save_path.relative_to(RESULTS_DIR).as_posix(), text, cost)
+    console.print(table)
+    count = sum(1 for _, status in planned if status == "generate")
+    console.print(Panel(
+        f"需生成 [bold]{count}[/bold] 张 × {GENERATION_PRICE} × {PRICE_RATE} = "
+        f"[bold]¥{generation_cost(count):.2f}[/bold]\n"
+        f"本地缓存恢复 {sum(1 for _, s in planned if s == 'cached')} 张，"
+        f"无需处理 {sum(1 for _, s in planned if s in ('fresh', 'untracked'))} 张",
+        title="预计费用", border_style="yellow" if count else "green"))
+    return planned
 
 
-def generate_all_scenes(story_id: str) -> None:
-    story_data = _load_story(story_id)
-    for index, scene in enumerate(story_data.get("master", [])):
-        scene_id = scene.get("id", "")
-        scene_name = scene.get("name", f"场景 {index + 1}")
-        if not scene_id:
-            continue
-        if _scene_image_exists(story_id, scene_id):
-            console.print(f"[dim]跳过（已存在）[/dim] {scene_name} ({scene_id})")
-            continue
-        console.print(Panel(f"[bold]{scene_name}[/bold] ({scene_id})", title="当前场景", border_style="blue"))
-        generate_scene(story_id, scene, scene_index=index)
-
-
-def prepare_story_resources(story_id: str) -> None:
-    """同步故事角色资源到 OSS，使用 rich 输出日志。"""
+def generate_all_scenes(story_id: str, *, workers: int = 4, rate: float = 1.0, retries: int = 3) -> None:
+    run_generation_queue(scene_jobs(story_id), workers=workers, rate=rate, retries=retries)
+
+
+def prepare_story_resources(
+    story_id: str,
+    prefixes: list[str] | None = None,
+    *,
+    workers: int = 8,
+    full: bool = False,
+    backend=None,
+) -> None:
+    """
+    增量同步故事资源到 OSS，使用 rich 输出日志。依据 resources/.oss_manifest.json 中的内容哈希
+    只上传新增或变化的文件，清单中没有的文件先核对 OSS 上的同名对象；full=True 时列举 OSS 核对远端。
+    backend 默认为阿里云 OSS。
+    """
+    prefixes = prefixes or list(PREFIX_SUFFIXES)
     console.print(Rule(f"[bold]准备故事资源[/bold] — {story_id}", style="cyan"))
-    prefix = "characters"
-    local_resources = fetch_local_resources(prefix)
-    oss_resources = fetch_oss_objects(story_id, prefix)
-    to_upload = [f for f in local_resources if f not in oss_resources]
+    sync = OSSSync(backend or AliyunOSS(client), RESOURCE_DIR, OSS_MANIFEST_PATH)
+    to_upload, total = sync.plan(story_id, prefixes, full=full)
     # 统计
     table = Table(title="资源对比")
     table.add_column("项目", style="cyan")
     table.add_column("数量", justify="right", style="green")
-    table.add_row("本地文件", str(len(local_resources)))
-    table.add_row("OSS 已有", str(len(oss_resources)))
+    table.add_row("本地文件", str(total))
+    table.add_row("已同步", str(total - len(to_upload)))
     table.add_row("待上传", str(len(to_upload)))
     console.print(table)
     if not to_upload:
+        sync.save()
         console.print(
-            Panel("所有角色资源已同步，无需上传。", title="[green]完成[/green]", border_style="green"))
+            Panel("所有资源已同步，无需上传。", title="[green]完成[/green]", border_style="green"))
         return
-    console.print(Panel("\n".join(to_upload),
+    console.print(Panel("\n".join(f"{item.key}（{item.reason}）" for item in to_upload),
                   title="[yellow]待上传文件[/yellow]", border_style="yellow"))
-    for i, filename in enumerate(to_upload, 1):
-        local_path = RESOURCE_DIR / prefix / filename
-        key = f"{story_id}/characters/{filename}"
-        try:
-            client.put_object_from_file(
-                oss.PutObjectRequest(bucket="aimmg", key=key),
-                local_path.as_posix(),
-            )
-            console.print(
-                f"  [green]✓[/green] [{i}/{len(to_upload)}] {filename} → {key}")
-        except Exception as e:
-            console.print(
-                f"  [red]✗[/red] [{i}/{len(to_upload)}] {filename}: [red]{e}[/red]")
-    console.print(Panel(f"已上传 [bold]{len(to_upload)}[/bold] 个文件到 OSS。",
-                  title="[green]完成[/green]", border_style="green"))
+    done = 0
+
+    def report(item, error):
+        nonlocal done
+        done += 1
+        if error is None:
+            console.print(f"  [green]✓[/green] [{done}/{len(to_upload)}] {item.path.name} → {item.key}")
+        else:
+            console.print(f"  [red]✗[/red] [{done}/{len(to_upload)}] {item.path.name}: [red]{error}[/red]")
+
+    failures = sync.upload(to_upload, workers=workers, on_done=report)
+    uploaded = len(to_upload) - len(failures)
+    console.print(Panel(f"已上传 [bold]{uploaded}[/bold] 个文件到 OSS。" +
+                        (f"\n[red]失败 {len(failures)} 个[/red]" if failures else ""),
+                  title="[green]完成[/green]" if not failures else "[yellow]部分完成[/yellow]",
+                  border_style="green" if not failures else "yellow"))
 
 
 if __name__ == "__main__":
@@ -291,41 +567,46 @@ if __name__ == "__main__":
     # prepare command
     prepare_parser = subparsers.add_parser(
         "prepare", help="prepare story resources")
+    prepare_parser.add_argument(
+        "--prefix", nargs="+", choices=list(PREFIX_SUFFIXES), default=None, help="同步的资源目录，默认全部")
+    prepare_parser.add_argument("--workers", type=int, default=8, help="并发上传数")
+    prepare_parser.add_argument("--full", action="store_true", help="列举 OSS 核对远端缺失或不一致的对象")
+    prepare_parser.add_argument(
+        "--fake-oss", type=str, default=None, help="用本地目录模拟 OSS（离线调试）")
     # scene command
     scene_parser = subparsers.add_parser(
         "scene", help="generate scene")
     scene_parser.add_argument(
         "--id", type=str, default=None, help="场景 id，不传则生成该故事下全部场景")
+    # plan command
+    plan_parser = subparsers.add_parser(
+        "plan", help="show what would be generated and the cost")
+    plan_parser.add_argument(
+        "--kind", choices=["characters", "scenes", "all"], default="all", help="只看角色或场景")
+    for sub_parser in (character_parser, scene_parser):
+        sub_parser.add_argument("--workers", type=int, default=4, help="批量生成时的并发数")
+        sub_parser.add_argument("--rate", type=float, default=1.0, help="每秒最多发起的请求数，0 为不限")
+        sub_parser.add_argument("--retries", type=int, default=3, help="网络错误 / 429 / 5xx 的重试次数")
     args = parser.parse_args()
     if args.command == "character":
         if args.id is None:
-            story_data = _load_story(args.story)
-            for char in story_data.get("characters", []):
-                cid = char["id"]
-                if _character_image_exists(args.story, cid):
-                    console.print(f"[dim]跳过（已存在）[/dim] {char['name']} ({cid})")
-                    continue
-                console.print(
-                    Panel(f"[bold]{char['name']}[/bold] ({cid})", title="当前角色", border_style="blue"))
-                generate_character(args.story, cid, story_data)
+            run_generation_queue(character_jobs(args.story),
+                                 workers=args.workers, rate=args.rate, retries=args.retries)
         else:
-            if _character_image_exists(args.story, args.id):
-                console.print(f"[dim]跳过（已存在）[/dim] {args.id}")
-            else:
-                generate_character(args.story, args.id)
+            generate_character(args.story, args.id)
     elif args.command == "prepare":
-        prepare_story_resources(args.story)
+        prepare_story_resources(args.story, args.prefix, workers=args.workers, full=args.full,
+                                backend=LocalOSS(args.fake_oss) if args.fake_oss else None)
     elif args.command == "scene":
         if args.id is None:
-            generate_all_scenes(args.story)
+            generate_all_scenes(args.story, workers=args.workers, rate=args.rate, retries=args.retries)
         else:
-            story_data = _load_story(args.story)
-            for scene in story_data.get("master", []):
-                if scene["id"] == args.id:
-                    if _scene_image_exists(args.story, args.id):
-                        console.print(f"[dim]跳过（已存在）[/dim] {args.id}")
-                        continue
-                    generate_scene(args.story, scene)
-                    break
+            scene = repository.model(args.story).scene(args.id)
+            if scene is None:
+                console.print(f"[red]场景 {args.id} 不存在[/red]")
+            else:
+                generate_scene(args.story, scene)
+    elif args.command == "plan":
+        plan_story(args.story, ("characters", "scenes") if args.kind == "all" else (args.kind,))
     else:
         console.print(f"Unknown command: {args.command}")
@@ -0,0 +1,36 @@
+import asyncio
+
+from store.context import ContextBuilder, estimate_tokens
+from store.memory import StoryMemoryPool
+
+
+def test_summary_keeps_newest_evicted_turns(tmp_path):
+    async def run():
+        with StoryMemoryPool("story", tmp_path) as pool:
+            memory = pool.session("t")
+            context = ContextBuilder(memory, budget=60, summary_budget=30, scene_summary_tokens=20)
+            for i in range(20):
+                await memory.add("s1", "第一幕", "c1", "甲", f"第{i}句。补充说明")
+                await context.update()
+            return context.render()
+
+    text = asyncio.run(run())
+    summary = text.split("【近期对话】")[0]
+    assert "第0句" not in summary
+    assert "第16句" in summary
+
+
+def test_render_profile_stays_within_budget(tmp_path):
+    async def run():
+        with StoryMemoryPool("story", tmp_path) as pool:
+            memory = pool.session("t")
+            context = ContextBuilder(memory, budget=80, summary_budget=20, profile_budget=20)
+            for i in range(20):
+                await memory.add("s1", "第一幕", "c1", "甲", f"第{i}句")
+                await context.update()
+            return context.render("很长的背景" * 50)
+
+    text = asyncio.run(run())
+    assert text.startswith("【你的背景】\n很长的背景")
+    assert "…" in text.split("\n\n")[0]
+    assert estimate_tokens(text) <= 80 + 20
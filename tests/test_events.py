@@ -0,0 +1,11 @@
+from events import EventBus
+
+
+def test_drop_clears_channel_history():
+    bus = EventBus()
+    bus.publish("a.1", "token", text="x")
+    bus.publish("a.2", "token", text="y")
+    bus.drop("a.1")
+    assert bus.channels() == ["a.2"]
+    with bus.subscribe("a.1") as subscription:
+        assert subscription.get(timeout=0) is None
@@ -0,0 +1,44 @@
+import asyncio
+import sqlite3
+import time
+
+from store.memory import ActionRecord, StoryMemory, StoryMemoryPool
+
+
+def _turn(content: str, actions=()):
+    return ("s1", "场景1", "c1", "甲", content, list(actions))
+
+
+def test_discard_unfinished_keeps_completed_steps(tmp_path):
+    with StoryMemory("story", tmp_path) as memory:
+        memory.add_turns([_turn("第一步", [ActionRecord("vote", "A")])])
+        memory.mark_step("s1", 0)
+        memory.add_turns([_turn("第二步未完成", [ActionRecord("vote", "B")])])
+
+        assert memory.discard_unfinished() == 1
+        assert [row["content"] for row in memory.list_all()] == ["第一步"]
+        assert [row["name"] for row in memory.list_actions()] == ["A"]
+        assert memory.discard_unfinished() == 0
+
+
+def test_discard_unfinished_without_steps_clears_session(tmp_path):
+    with StoryMemory("story", tmp_path) as memory:
+        memory.add_turns([_turn("未完成")])
+        memory.add_turns([_turn("其他对局")], session_id="other")
+
+        assert memory.discard_unfinished() == 1
+        assert memory.list_all() == []
+        assert len(memory.list_all(session_id="other")) == 1
+
+
+def test_pool_commits_when_flush_interval_expires_without_further_writes(tmp_path):
+    with StoryMemoryPool("story", tmp_path, flush_interval=0.05) as pool:
+        memory = pool.session("t")
+        asyncio.run(memory.add_turns([_turn("第一句")]))
+        time.sleep(0.3)
+        # 另开连接，只能看到已提交的写入
+        conn = sqlite3.connect(tmp_path / "story.db")
+        try:
+            assert conn.execute("SELECT content FROM messages").fetchall() == [("第一句",)]
+        finally:
+            conn.close()
@@ -0,0 +1,52 @@
+import pytest
+
+pytest.importorskip("alibabacloud_oss_v2")
+
+from oss_sync import LocalOSS, OSSSync  # noqa: E402
+
+
+@pytest.fixture
+def resources(tmp_path):
+    directory = tmp_path / "resources" / "covers"
+    directory.mkdir(parents=True)
+    for name, content in (("a.png", b"aaa"), ("b.png", b"bbb"), ("c.png", b"ccc")):
+        (directory / name).write_bytes(content)
+    return tmp_path / "resources"
+
+
+def test_first_plan_skips_objects_already_in_oss(resources, tmp_path):
+    remote = tmp_path / "oss" / "s" / "covers"
+    remote.mkdir(parents=True)
+    (remote / "a.png").write_bytes(b"aaa")
+    (remote / "b.png").write_bytes(b"old")
+    backend = LocalOSS(tmp_path / "oss")
+    sync = OSSSync(backend, resources, tmp_path / "manifest.json")
+
+    items, total = sync.plan("s", ["covers"])
+    assert total == 3
+    assert {item.key: item.reason for item in items} == {"s/covers/b.png": "远端不一致", "s/covers/c.png": "新增"}
+    assert "s/covers/a.png" in sync.manifest
+
+
+def test_sync_uploads_only_new_or_changed_files(resources, tmp_path):
+    backend = LocalOSS(tmp_path / "oss")
+    sync = OSSSync(backend, resources, tmp_path / "manifest.json")
+    items, _ = sync.plan("s", ["covers"])
+    assert sync.upload(items) == []
+    assert backend.puts == 3
+
+    # 清单已记录全部文件，没有变化时既不上传也不列举 OSS
+    sync = OSSSync(backend, resources, tmp_path / "manifest.json")
+    lists = backend.lists
+    assert sync.plan("s", ["covers"]) == ([], 3)
+    assert backend.lists == lists
+
+    (resources / "covers" / "b.png").write_bytes(b"changed")
+    items, _ = sync.plan("s", ["covers"])
+    assert [(item.key, item.reason) for item in items] == [("s/covers/b.png", "已变化")]
+    sync.upload(items)
+    assert (tmp_path / "oss" / "s" / "covers" / "b.png").read_bytes() == b"changed"
+
+    (tmp_path / "oss" / "s" / "covers" / "c.png").unlink()
+    items, _ = sync.plan("s", ["covers"], full=True)
+    assert [(item.key, item.reason) for item in items] == [("s/covers/c.png", "远端缺失")]
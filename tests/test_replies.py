@@ -0,0 +1,65 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("agentscope")
+
+from agentscope.message import Msg  # noqa: E402
+
+from entity import PlayerAgent  # noqa: E402
+from store.replies import ReplyCache  # noqa: E402
+
+
+class FakeMemory:
+    def __init__(self):
+        self.msgs = []
+
+    async def add(self, msgs):
+        if msgs is not None:
+            self.msgs.extend(msgs if isinstance(msgs, list) else [msgs])
+
+    async def get_memory(self):
+        return list(self.msgs)
+
+
+class FakeAgent:
+    """借用 PlayerAgent.reply 的缓存逻辑；_reply 模拟 ReAct 在输入与回复之间写入的中间消息。"""
+
+    name = "甲"
+    sys_prompt = "你是甲"
+    model = SimpleNamespace(model_name="m")
+
+    def __init__(self, cache):
+        self.reply_cache = cache
+        self.memory = FakeMemory()
+        self.calls = 0
+
+    async def _reply(self, msg, structured_model):
+        self.calls += 1
+        await self.memory.add(msg)
+        await self.memory.add(Msg(self.name, "先想一想", "assistant"))
+        reply_msg = Msg(self.name, f"回复{self.calls}", "assistant")
+        await self.memory.add(reply_msg)
+        return reply_msg
+
+    async def print(self, msg, last=True):
+        pass
+
+    async def reply(self, msg):
+        return await PlayerAgent.reply(self, msg)
+
+
+def test_replay_restores_whole_memory_delta(tmp_path):
+    async def turns(agent):
+        for text in ("第一问", "第二问"):
+            await agent.reply(Msg("moderator", text, "user"))
+        return [(m.name, m.content) for m in agent.memory.msgs]
+
+    recorder = FakeAgent(ReplyCache("record", tmp_path))
+    recorded = asyncio.run(turns(recorder))
+    assert recorder.calls == 2
+
+    player = FakeAgent(ReplyCache("replay", tmp_path))
+    assert asyncio.run(turns(player)) == recorded
+    assert player.calls == 0 and player.reply_cache.hits == 2
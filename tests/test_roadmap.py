@@ -0,0 +1,146 @@
+import asyncio
+import sqlite3
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("agentscope")
+
+from agentscope.message import Msg  # noqa: E402
+
+from entity import Grant, ModeratorAction, PlayerAction, PropGive, PropGrant, PropUse  # noqa: E402
+from store.context import ContextBuilder  # noqa: E402
+from store.memory import StoryMemoryPool  # noqa: E402
+from store.model import Story  # noqa: E402
+from store.props import POOL, GameState  # noqa: E402
+from story_roadmap import ActionValidator, run_scenes  # noqa: E402
+
+STORY = {
+    "name": "测试剧本",
+    "characters": [{"id": "c1", "name": "甲", "scenes": [{"tasks": ["活下去"]}]}],
+    "props": [{"name": "地图", "count": 2}],
+    "scenes": [{"id": "s1", "name": "第一幕", "steps": [
+        [{"type": "memory", "value": ["第一步"]}],
+        [{"type": "memory", "value": ["第二步"]}],
+    ]}],
+}
+
+
+class FakeAgent:
+    """按调用次数回复的假智能体，第 fail_on 次调用时抛错。"""
+
+    stream_listener = None
+
+    def __init__(self, name: str, fail_on: int = 0):
+        self.name = name
+        self.fail_on = fail_on
+        self.calls = 0
+        self.prompts = []
+
+    async def __call__(self, msg, structured_model=None):
+        self.calls += 1
+        self.prompts.append(msg.content)
+        if self.calls == self.fail_on:
+            raise RuntimeError("模型调用失败")
+        return Msg(self.name, f"回复{self.calls}", "assistant")
+
+    async def observe(self, msg):
+        pass
+
+
+def _run(memory, fail_on: int = 0, context=None, background: str = ""):
+    story = Story.from_dict("story", STORY)
+    moderator = SimpleNamespace(id="moderator", name="moderator", agent=FakeAgent("moderator"))
+    player = SimpleNamespace(id="c1", name="甲", background=background, agent=FakeAgent("甲", fail_on))
+    asyncio.run(run_scenes(story, moderator, {"c1": player}, memory, context=context))
+    return player
+
+
+def test_resume_after_mid_step_failure_has_no_duplicates(tmp_path):
+    with StoryMemoryPool("story", tmp_path) as pool:
+        memory = pool.session("t")
+        with pytest.raises(RuntimeError):
+            _run(memory, fail_on=2)
+        rows = asyncio.run(memory.page_all())
+        assert [row["content"] for row in rows] == ["第一步", "回复1"]
+
+        _run(memory)
+        rows = asyncio.run(memory.page_all())
+        assert [row["content"] for row in rows] == ["第一步", "回复1", "第二步", "回复1"]
+        assert asyncio.run(memory.last_step())["step_index"] == 1
+
+
+def test_legacy_history_survives_migration_and_run(tmp_path):
+    # 升级前的库：messages 没有 session_id，也没有 steps 表
+    conn = sqlite3.connect(tmp_path / "story.db")
+    conn.execute("""
+        CREATE TABLE messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, scene_id TEXT NOT NULL, scene_name TEXT NOT NULL,
+            character_id TEXT NOT NULL, character_name TEXT NOT NULL, content TEXT NOT NULL,
+            created_at TEXT DEFAULT (datetime('now', 'localtime'))
+        )
+    """)
+    conn.executemany("INSERT INTO messages (scene_id, scene_name, character_id, character_name, content) "
+                     "VALUES ('s1', '第一幕', 'c1', '甲', ?)", [("旧记录1",), ("旧记录2",)])
+    conn.commit()
+    conn.close()
+
+    with StoryMemoryPool("story", tmp_path) as pool:
+        memory = pool.session("")
+        _run(memory)
+        rows = asyncio.run(memory.page_all())
+        assert [row["content"] for row in rows][:2] == ["旧记录1", "旧记录2"]
+        assert len(rows) == 6
+
+
+def test_context_prompt_has_narration_once_and_background(tmp_path):
+    with StoryMemoryPool("story", tmp_path) as pool:
+        memory = pool.session("t")
+        player = _run(memory, context=ContextBuilder(memory, budget=500, summary_budget=100, profile_budget=100), background="甲的秘密身份")
+    first = player.agent.prompts[0]
+    assert first.count("第一步") == 1
+    assert "【你的背景】\n甲的秘密身份" in first
+
+
+def _validator():
+    story = Story.from_dict("story", {**STORY, "characters": [
+        {"id": "c1", "name": "甲", "scenes": [{"tasks": ["活下去"]}]},
+        {"id": "c2", "name": "乙", "scenes": [{"tasks": ["活下去"]}]},
+    ]})
+    characters = {"c1": SimpleNamespace(id="c1", name="甲"), "c2": SimpleNamespace(id="c2", name="乙")}
+    state = GameState.from_story(story, star_cost=10)
+    return ActionValidator(story, characters, state), characters, state
+
+
+def test_moderator_deals_props_money_and_stars():
+    validator, _, state = _validator()
+    records, issues = validator.moderate(ModeratorAction(
+        speech="发放物资", stars=1,
+        grants=[Grant(to="甲", money=100, props=[PropGrant(name="地图")]), Grant(to="丙", money=5)]))
+    assert [r.kind for r in records] == ["grant", "deal", "stars"]
+    assert issues == ["发放对象 丙 不存在"]
+    assert state.money("c1") == 90 and state.money("c2") == 0
+    assert state.count("c1", "地图") == 1 and state.count(POOL, "地图") == 1
+    assert state.stars == 1
+
+
+def test_prop_use_keeps_prop_but_give_hands_it_over():
+    validator, characters, state = _validator()
+    state.give("地图", "c1")
+    c1 = characters["c1"]
+
+    records, issues = validator.validate(c1, PlayerAction(speech="", props=[PropUse(name="地图", target="乙")]))
+    assert [(r.kind, r.target) for r in records] == [("prop", "c2")] and not issues
+    assert state.count("c1", "地图") == 1 and state.count("c2", "地图") == 0
+
+    records, issues = validator.validate(c1, PlayerAction(speech="", gives=[PropGive(name="地图", to="乙")]))
+    assert [(r.kind, r.target) for r in records] == [("give", "c2")] and not issues
+    assert state.count("c1", "地图") == 0 and state.count("c2", "地图") == 1
+
+
+def test_prop_use_and_give_require_holding():
+    validator, characters, state = _validator()
+    records, issues = validator.validate(characters["c1"], PlayerAction(
+        speech="", props=[PropUse(name="地图")], gives=[PropGive(name="地图", to="乙")]))
+    assert records == [] and len(issues) == 2
+    assert state.count(POOL, "地图") == 2
@@ -0,0 +1,117 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("agentscope")
+
+from agentscope.message import Msg  # noqa: E402
+
+import sessions  # noqa: E402
+from events import EventBus  # noqa: E402
+from sessions import GameService, SessionError  # noqa: E402
+from store.memory import StoryMemoryPool  # noqa: E402
+from store.model import Story  # noqa: E402
+
+STORY = {
+    "name": "测试剧本",
+    "characters": [{"id": "c1", "name": "甲", "scenes": [{"tasks": ["活下去"]}]}],
+    "scenes": [{"id": "s1", "name": "第一幕", "steps": [[{"type": "memory", "value": ["第一步"]}]]}],
+}
+
+
+class BlockingAgent:
+    """发言一直等待，直到被 interrupt()；与 agentscope 一样在调用内部处理取消并正常返回。"""
+
+    stream_listener = None
+
+    def __init__(self, name: str, block: bool = True):
+        self.name = name
+        self.block = block
+        self.calls = 0
+        self.interrupted = False
+        self._reply_task = None
+
+    async def __call__(self, msg, structured_model=None):
+        self.calls += 1
+        if not self.block:
+            return Msg(self.name, f"回复{self.calls}", "assistant")
+        self._reply_task = asyncio.current_task()
+        try:
+            await asyncio.Event().wait()
+        except asyncio.CancelledError:
+            self.interrupted = True
+            return Msg(self.name, "被打断", "assistant")
+        finally:
+            self._reply_task = None
+
+    async def interrupt(self, msg=None):
+        if self._reply_task is not None:
+            self._reply_task.cancel()
+
+    async def observe(self, msg):
+        pass
+
+    async def print(self, msg, last=True):
+        pass
+
+
+@pytest.fixture
+def service(tmp_path, monkeypatch):
+    story = Story.from_dict("story", STORY)
+    player = SimpleNamespace(id="c1", name="甲", background="", agent=BlockingAgent("甲"))
+    monkeypatch.setattr(sessions, "repository", SimpleNamespace(model=lambda story_id: story))
+    monkeypatch.setattr(sessions, "create_characters", lambda characters, config, **kwargs: {"c1": player})
+    monkeypatch.setattr(sessions, "create_moderator", lambda config: SimpleNamespace(
+        id="moderator", name="moderator", agent=BlockingAgent("moderator")))
+    service = GameService({}, tmp_path, event_bus=EventBus())
+    service.player = player
+    yield service
+    service.close()
+
+
+def test_stop_interrupts_running_session(service, tmp_path):
+    service.create("story", session_id="t", reply_mode="text")
+    deadline = time.time() + 5
+    while service.player.agent.calls == 0 and time.time() < deadline:
+        time.sleep(0.01)
+    assert service.get("t")["status"] == "running", service.get("t")["error"]
+
+    started = time.time()
+    info = service.stop("t")
+    # 由 interrupt() 结束，而不是等到 STOP_TIMEOUT 后取消任务
+    assert time.time() - started < sessions.STOP_TIMEOUT
+    assert info["status"] == "stopped"
+    assert service.player.agent.interrupted
+    assert service.list_sessions() == []
+    # 被中断的步骤不算完成，被打断的发言也不留在记忆中
+    with StoryMemoryPool("story", tmp_path) as pool:
+        memory = pool.session("t")
+        assert asyncio.run(memory.last_step()) is None
+        assert [row["content"] for row in asyncio.run(memory.page_all())] == []
+
+
+@pytest.mark.parametrize("options", [{"turn_mode": "x"}, {"reply_mode": "x"}, {"concurrency": "abc"},
+                                     {"concurrency": 0}])
+def test_create_rejects_invalid_options(service, options):
+    with pytest.raises(SessionError):
+        service.create("story", session_id="t", **options)
+    assert service.list_sessions() == []
+
+
+def test_ended_sessions_free_their_slot_and_expire(service):
+    service.max_sessions = 1
+    service.ended_ttl = 0
+    service.player.agent.block = False
+    service.create("story", session_id="a", reply_mode="text")
+    deadline = time.time() + 5
+    while service.get("a")["status"] == "running" and time.time() < deadline:
+        time.sleep(0.01)
+    assert service.get("a")["status"] == "finished"
+
+    service.player.agent.block = True
+    service.create("story", session_id="b", reply_mode="text")
+    assert [s["id"] for s in service.list_sessions()] == ["b"]
+    with pytest.raises(SessionError):
+        service.create("story", session_id="c", reply_mode="text")
@@ -0,0 +1,50 @@
+import json
+import os
+
+import pytest
+
+from store.model import Story, StoryError
+from store.stories import StoryRepository
+
+
+def _write(data_dir, story_id, data, mtime=None):
+    path = data_dir / f"story__{story_id}.json"
+    path.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+    if mtime is not None:
+        os.utime(path, ns=(mtime, mtime))
+    return path
+
+
+def test_duplicate_character_id_raises_story_error(tmp_path):
+    _write(tmp_path, "dup", {"name": "重复", "characters": [{"id": "a", "name": "甲"}, {"id": "a", "name": "乙"}]})
+    with pytest.raises(StoryError):
+        StoryRepository(tmp_path).story("dup")
+    assert not (tmp_path / "story__dup.sqlite").exists()
+
+
+@pytest.mark.parametrize("data", [
+    {"name": "选项", "scenes": [{"id": "s1", "steps": [], "choices": ["A", "B"]}]},
+    {"name": "角色 id", "characters": [{"id": ["a"], "name": "甲"}]},
+    {"name": "场景 id", "scenes": [{"id": {"x": 1}, "steps": []}]},
+])
+def test_malformed_story_raises_story_error(tmp_path, data):
+    with pytest.raises(StoryError):
+        Story.from_dict("bad", data)
+    _write(tmp_path, "bad", data)
+    with pytest.raises(StoryError):
+        StoryRepository(tmp_path).story("bad")
+
+
+def test_old_handle_keeps_working_after_reload(tmp_path):
+    repository = StoryRepository(tmp_path)
+    _write(tmp_path, "s", {"name": "旧", "characters": [{"id": "a", "name": "甲"}]}, mtime=1_000_000_000)
+    old = repository.story("s")
+    _write(tmp_path, "s", {"name": "新版本", "characters": [{"id": "a", "name": "甲"}, {"id": "b", "name": "乙"}]},
+           mtime=2_000_000_000)
+    assert repository.story("s").name == "新版本"
+    assert repository.model("s").character("b").name == "乙"
+    # 其他请求线程手里的旧版本继续可用，读到的仍是旧内容
+    assert old.counts()["characters"] == 1
+    assert old.character("a")["name"] == "甲"
+    repository.invalidate()
+    assert old.counts()["characters"] == 1
@@ -0,0 +1,170 @@
+"""角色图 / 封面缩略图：按尺寸与源文件哈希生成 WebP/JPEG 衍生图，存放在原图目录的 .thumbs 下。"""
+
+import argparse
+import hashlib
+import os
+import re
+import threading
+from pathlib import Path
+
+from PIL import Image
+
+PROJECT_ROOT = Path(__file__).resolve().parent
+RESULTS_DIR = PROJECT_ROOT / "results"
+THUMBS_DIRNAME = ".thumbs"
+# 允许生成的宽度（像素），请求其他宽度一律拒绝，避免任意尺寸占满磁盘
+WIDTHS = (240, 480, 960)
+FORMATS = {"webp": "WEBP", "jpg": "JPEG"}
+SOURCE_SUFFIXES = (".png", ".jpg", ".jpeg")
+KINDS = ("characters", "covers", "scenes")
+
+# <stem>.<width>w.<源文件哈希前 12 位>.<webp|jpg>
+RE_THUMB = re.compile(r"^(.+)\.(\d+)w\.([0-9a-f]{12})\.(webp|jpg)$")
+
+_hash_cache: dict[Path, tuple[tuple[int, int], str]] = {}
+_hash_lock = threading.Lock()
+
+
+def source_hash(source: Path) -> str:
+    """源文件内容哈希（前 12 位），按 (mtime_ns, size) 缓存，文件不变时不重复读取。"""
+    st = source.stat()
+    signature = (st.st_mtime_ns, st.st_size)
+    with _hash_lock:
+        cached = _hash_cache.get(source)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+    digest = hashlib.sha256(source.read_bytes()).hexdigest()[:12]
+    with _hash_lock:
+        _hash_cache[source] = (signature, digest)
+    return digest
+
+
+def thumbnail_name(source: Path, width: int, fmt: str) -> str:
+    return f"{source.stem}.{width}w.{source_hash(source)}.{fmt}"
+
+
+def find_source(directory: Path, stem: str) -> Path | None:
+    """在原图目录中按 stem 查找源图。"""
+    for suffix in SOURCE_SUFFIXES:
+        path = directory / f"{stem}{suffix}"
+        if path.is_file():
+            return path
+    return None
+
+
+def ensure_thumbnail(source: Path, width: int, fmt: str = "webp") -> Path:
+    """返回缩略图路径，不存在时生成（先写临时文件再原子替换）。"""
+    if width not in WIDTHS or fmt not in FORMATS:
+        raise ValueError(f"不支持的缩略图规格: {width}w {fmt}")
+    target = source.parent / THUMBS_DIRNAME / thumbnail_name(source, width, fmt)
+    if target.is_file():
+        return target
+    target.parent.mkdir(parents=True, exist_ok=True)
+    with Image.open(source) as img:
+        img = img.convert("RGB")
+        if img.width > width:
+            img = img.resize((width, round(img.height * width / img.width)), Image.Resampling.LANCZOS)
+        tmp = target.with_name(f".{target.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        if fmt == "webp":
+            img.save(tmp, FORMATS[fmt], quality=80, method=4)
+        else:
+            img.save(tmp, FORMATS[fmt], quality=82, optimize=True, progressive=True)
+    os.replace(tmp, target)
+    return target
+
+
+def source_signature(story_id: str, kinds: tuple[str, ...] = KINDS) -> tuple[tuple, float]:
+    """
+    剧本原图的签名 ((kind, 文件名, mtime_ns, size), ...) 与其中最新的 mtime（秒）。
+    只 stat 不读文件，供页面缓存键与 ETag 使用：原图重新生成后页面里的缩略图 URL 随之变化。
+    """
+    entries = []
+    latest = 0.0
+    for kind in kinds:
+        try:
+            with os.scandir(RESULTS_DIR / story_id / kind) as it:
+                for entry in it:
+                    if not entry.is_file() or not entry.name.lower().endswith(SOURCE_SUFFIXES):
+                        continue
+                    st = entry.stat()
+                    entries.append((kind, entry.name, st.st_mtime_ns, st.st_size))
+                    latest = max(latest, st.st_mtime)
+        except OSError:
+            continue
+    return tuple(sorted(entries)), latest
+
+
+def thumbnail_url(story_id: str, kind: str, stem: str, width: int, fmt: str = "webp") -> str:
+    """
+    缩略图 URL，文件名内含源文件哈希，可长期缓存；源图不存在时返回空字符串。
+    只计算文件名，不生成文件，首次请求时由网站按需生成。
+    """
+    source = find_source(RESULTS_DIR / story_id / kind, stem)
+    if source is None:
+        return ""
+    return f"/results/{story_id}/{kind}/{THUMBS_DIRNAME}/{thumbnail_name(source, width, fmt)}"
+
+
+def resolve_thumbnail(story_id: str, kind: str, name: str) -> Path | None:
+    """
+    根据缩略图文件名找到（必要时生成）对应文件。
+    文件名不合法、尺寸不允许、源图不存在或哈希已过期时返回 None。
+    """
+    m = RE_THUMB.match(name)
+    if kind not in KINDS or m is None:
+        return None
+    stem, width, digest, fmt = m.group(1), int(m.group(2)), m.group(3), m.group(4)
+    if width not in WIDTHS:
+        return None
+    source = find_source(RESULTS_DIR / story_id / kind, stem)
+    if source is None or source_hash(source) != digest:
+        return None
+    return ensure_thumbnail(source, width, fmt)
+
+
+def prune_thumbnails(directory: Path) -> int:
+    """删除源图已变化或已删除的过期缩略图，返回删除数量。"""
+    thumbs = directory / THUMBS_DIRNAME
+    if not thumbs.is_dir():
+        return 0
+    removed = 0
+    for path in thumbs.iterdir():
+        m = RE_THUMB.match(path.name)
+        if m is None:
+            continue
+        source = find_source(directory, m.group(1))
+        if source is None or source_hash(source) != m.group(3):
+            path.unlink()
+            removed += 1
+    return removed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="预先生成角色图 / 封面 / 场景图缩略图")
+    parser.add_argument("--story", default="shou_huo_ri", help="剧本 ID，对应 results/<id>")
+    parser.add_argument("--widths", type=int, nargs="+", default=list(WIDTHS), help="生成的宽度")
+    parser.add_argument("--formats", nargs="+", default=list(FORMATS), choices=list(FORMATS), help="生成的格式")
+    args = parser.parse_args()
+
+    story_dir = RESULTS_DIR / args.story
+    if not story_dir.is_dir():
+        print(f"目录不存在: {story_dir}")
+        exit(1)
+    for kind in KINDS:
+        directory = story_dir / kind
+        if not directory.is_dir():
+            continue
+        removed = prune_thumbnails(directory)
+        if removed:
+            print(f"  {kind}: 删除过期缩略图 {removed} 个")
+        for source in sorted(directory.iterdir()):
+            if not source.is_file() or source.suffix.lower() not in SOURCE_SUFFIXES:
+                continue
+            for width in args.widths:
+                for fmt in args.formats:
+                    path = ensure_thumbnail(source, width, fmt)
+                    print(f"  {kind}/{THUMBS_DIRNAME}/{path.name} ({path.stat().st_size // 1024} KB)")
+
+
+if __name__ == "__main__":
+    main()